@@ -0,0 +1,78 @@
+"""Memory benchmark: slotted Conversation/Message objects vs the previous dict-of-lists layout.
+
+Builds 100k conversations holding a full history window in each layout and
+reports the traced allocation size. Run from the backend directory:
+    python benchmarks/bench_conversation_memory.py [conversations]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vreg_app import CONVERSATION_HISTORY_SIZE, Conversation, Message  # noqa: E402
+
+# Message bodies are shared between both layouts so only container overhead is compared
+CONTENT = "How do I request a refund?"
+HTML = CONTENT
+
+
+def build_dict_layout(count: int) -> dict:
+    """The previous layout: a dict per conversation holding a list of message dicts"""
+    conversations = {}
+    now = time.time()
+    for i in range(count):
+        messages = []
+        for j in range(CONVERSATION_HISTORY_SIZE):
+            messages.append({
+                'role': 'user' if j % 2 == 0 else 'assistant',
+                'content': CONTENT,
+                'html': HTML,
+                'timestamp': now + j
+            })
+        conversations[f"conv-{i}"] = {
+            'user_name': None,
+            'created_at': now,
+            'last_activity': now,
+            'messages': messages,
+            'version': 0,
+            'bytes': 0
+        }
+    return conversations
+
+
+def build_slotted_layout(count: int) -> dict:
+    """The current layout: slotted Conversation with a deque ring buffer of slotted Messages"""
+    conversations = {}
+    now = time.time()
+    for i in range(count):
+        conv = Conversation(now)
+        for j in range(CONVERSATION_HISTORY_SIZE):
+            conv.messages.append(Message('user' if j % 2 == 0 else 'assistant', CONTENT, HTML, now + j))
+        conversations[f"conv-{i}"] = conv
+    return conversations
+
+
+def measure(builder, count: int) -> int:
+    tracemalloc.start()
+    data = builder(count)
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    legacy = measure(build_dict_layout, count)
+    slotted = measure(build_slotted_layout, count)
+    mb = 1024 * 1024
+    print(f"{count} conversations x {CONVERSATION_HISTORY_SIZE} messages")
+    print(f"  dict layout    {legacy / mb:8.1f} MiB  ({legacy // count} bytes/conversation)")
+    print(f"  slotted layout {slotted / mb:8.1f} MiB  ({slotted // count} bytes/conversation)")
+    print(f"  saved          {(legacy - slotted) / mb:8.1f} MiB  ({(1 - slotted / legacy) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Microbenchmark: single-pass HyperlinkProcessor vs the previous three-pass linkifier.
+
+Run from the backend directory:
+    python benchmarks/bench_hyperlinks.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vreg_app import HyperlinkProcessor  # noqa: E402
+
+
+def legacy_convert_to_hyperlinks(text: str) -> str:
+    """The previous implementation: email pass, URL pass, then placeholder substitution"""
+    placeholders = {}
+    placeholder_counter = [0]
+
+    def create_placeholder(content):
+        placeholder = f"___PLACEHOLDER_{placeholder_counter[0]}___"
+        placeholders[placeholder] = content
+        placeholder_counter[0] += 1
+        return placeholder
+
+    email_pattern = r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})'
+
+    def email_replacer(match):
+        email = match.group(1)
+        link = f'<a href="mailto:{email}" style="color: #0066cc; text-decoration: underline; font-weight: 500;">{email}</a>'
+        return create_placeholder(link)
+
+    result = re.sub(email_pattern, email_replacer, text)
+
+    url_pattern = r'((?:https?://)?(?:www\.)?[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}(?:/[^\s]*)?)'
+
+    def url_replacer(match):
+        url = match.group(1)
+        if '___PLACEHOLDER_' in url:
+            return url
+        href = url
+        if not url.startswith('http'):
+            if 'www.vreg.gov.ng' in url:
+                href = url.replace('www.vreg.gov.ng', 'https://vreg.gov.ng')
+            elif 'www.trade.gov.ng' in url:
+                href = url.replace('www.trade.gov.ng', 'https://trade.gov.ng')
+            elif url.startswith('www.'):
+                href = f'https://{url[4:]}'
+            else:
+                href = f'https://{url}'
+        link = f'<a href="{href}" target="_blank" rel="noopener noreferrer" style="color: #0066cc; text-decoration: underline; font-weight: 500;">{url}</a>'
+        return create_placeholder(link)
+
+    result = re.sub(url_pattern, url_replacer, result)
+
+    for placeholder, content in placeholders.items():
+        result = result.replace(placeholder, content)
+
+    return result
+
+
+SENTENCE = (
+    "Please visit www.vreg.gov.ng and click on Login, or validate your TIN at www.trade.gov.ng. "
+    "Send the invoice number and payment proof to payments@vreg.gov.ng or support@vreg.gov.ng. "
+)
+
+
+def main():
+    for repeats in (1, 10, 100):
+        text = SENTENCE * repeats
+        assert HyperlinkProcessor.convert_to_hyperlinks(text) == legacy_convert_to_hyperlinks(text)
+        number = max(1, 2000 // repeats)
+        legacy = min(timeit.repeat(lambda: legacy_convert_to_hyperlinks(text), number=number, repeat=5)) / number
+        current = min(timeit.repeat(lambda: HyperlinkProcessor.convert_to_hyperlinks(text), number=number, repeat=5)) / number
+        print(
+            f"{len(text):>7} chars, {4 * repeats:>4} links: "
+            f"legacy {legacy * 1e6:10.1f} µs  single-pass {current * 1e6:10.1f} µs  "
+            f"speedup {legacy / current:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
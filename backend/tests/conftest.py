@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Keep importing vreg_app free of snapshot files, spill files and a SIGTERM handler
+os.environ.setdefault("CONVERSATION_SNAPSHOT_PATH", "")
+os.environ.setdefault("CONVERSATION_SPILL_IDLE_SECONDS", "0")
+os.environ.setdefault("ANTHROPIC_API_KEY", "test-key")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
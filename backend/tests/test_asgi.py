@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from starlette.testclient import TestClient
+
+import vreg_app
+import vreg_asgi
+from vreg_app import LLMResiliencePolicy
+
+
+@pytest.fixture
+def client():
+    return TestClient(vreg_asgi.app)
+
+
+def hedging_policy(dispatcher):
+    policy = LLMResiliencePolicy(deadline_seconds=5, max_retries=0, hedge_enabled=True,
+                                 hedge_max_ratio=1.0, hedge_min_samples=1, dispatcher=dispatcher)
+    policy.record_latency(0.01)
+    return policy
+
+
+def test_oversized_body_is_rejected_with_413(client):
+    body = b'{"message": "' + b"a" * vreg_app.app.config["MAX_CONTENT_LENGTH"] + b'"}'
+
+    response = client.post("/chat", content=body, headers={"Content-Type": "application/json"})
+
+    assert response.status_code == 413
+
+
+def test_malformed_json_is_a_400(client):
+    response = client.post("/chat", content=b"{not json", headers={"Content-Type": "application/json"})
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/chat", "/chat/stream"])
+def test_full_dispatcher_returns_503_with_retry_after(client, monkeypatch, path):
+    dispatcher = vreg_asgi.AsyncLLMDispatcher(max_in_flight=1, max_queued=0)
+    dispatcher.in_flight = 1
+    monkeypatch.setattr(vreg_asgi, "dispatcher", dispatcher)
+
+    response = client.post(path, json={"message": "hello", "conversation_id": "asgi-full"})
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.json()["retry_after"] == int(response.headers["Retry-After"])
+
+
+def test_overloaded_turn_returns_503_and_leaves_the_history_unchanged(client, monkeypatch):
+    async def overloaded(*args):
+        return vreg_app.rag_system.overloaded_response(3)
+
+    monkeypatch.setattr(vreg_asgi, "generate_rag_response", overloaded)
+    manager = vreg_app.conversation_manager
+    manager.get_or_create_conversation("asgi-shed")
+    manager.set_user_name("asgi-shed", "Ada")
+
+    response = client.post("/chat", json={"message": "How do I renew my plate?", "conversation_id": "asgi-shed"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert manager.get_conversation_history("asgi-shed") == []
+
+
+def test_hedge_wins_and_the_slow_primary_is_cancelled(monkeypatch):
+    dispatcher = vreg_asgi.AsyncLLMDispatcher(max_in_flight=4, max_queued=0)
+    policy = hedging_policy(dispatcher)
+    monkeypatch.setattr(vreg_asgi, "dispatcher", dispatcher)
+    monkeypatch.setattr(vreg_asgi, "resilience", policy)
+    calls, cancelled = [], []
+
+    async def request(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "primary"
+        return "hedge"
+
+    async def run():
+        result = await vreg_asgi.resilient_call(request)
+        await asyncio.sleep(0)  # Let the cancelled primary unwind
+        return result
+
+    assert asyncio.run(run()) == "hedge"
+    assert cancelled == [True]
+    assert policy.stats()["hedge_wins"] == 1
+    # Async hedges run as tasks, so the sync hedge thread pool is never created
+    assert policy.hedge_pool is None
+
+
+def test_hedge_pool_is_only_created_by_sync_hedging():
+    policy = hedging_policy(vreg_app.LLMDispatcher(max_in_flight=4, max_queued=0))
+    assert policy.hedge_pool is None
+
+    policy.call(lambda timeout: "ok")
+
+    assert policy.hedge_pool is not None
+    assert vreg_asgi.resilience.hedge_pool is None
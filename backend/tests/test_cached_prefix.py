@@ -0,0 +1,63 @@
+import vreg_app
+from vreg_app import CLAUDE_INPUT_TOKEN_BUDGET, VREG_SYSTEM_PROMPT, VREGRAGSystem, estimate_tokens, vreg_faqs
+
+
+def faq(i):
+    return {"question": f"How do I handle case {i}?", "answer": f"Case {i} is handled at any VREG office. " * 5}
+
+
+def test_small_knowledge_base_is_cached_with_numbered_faqs():
+    prefix, faq_numbers = VREGRAGSystem.build_cached_prefix(vreg_faqs)
+
+    assert prefix.startswith(VREG_SYSTEM_PROMPT)
+    assert vreg_faqs[-1]["question"] in prefix
+    assert faq_numbers == {f"faq-{i}": i + 1 for i in range(len(vreg_faqs))}
+
+
+def test_large_corpus_does_not_land_in_the_prefix():
+    corpus = [faq(i) for i in range(5000)]
+
+    prefix, faq_numbers = VREGRAGSystem.build_cached_prefix(corpus)
+
+    assert prefix == VREG_SYSTEM_PROMPT
+    assert faq_numbers == {}
+
+
+def test_knowledge_base_over_the_limit_is_left_out():
+    prefix, faq_numbers = VREGRAGSystem.build_cached_prefix(vreg_faqs, max_kb_tokens=100)
+
+    assert prefix == VREG_SYSTEM_PROMPT
+    assert faq_numbers == {}
+
+
+def prepare(monkeypatch, scored_faqs, history):
+    rag_system = vreg_app.rag_system
+    monkeypatch.setattr(rag_system, "retrieve_scored_faqs", lambda embedding, n_results: scored_faqs)
+    monkeypatch.setattr(rag_system, "select_direct_answer", lambda *args: None)
+    return rag_system.prepare_rag_request("How do I handle this case?", "Ada", history + [{"role": "user", "content": "How do I handle this case?"}])
+
+
+def long_history(turns):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " + "about plates " * 40}
+        for i in range(turns)
+    ]
+
+
+def test_cached_prefix_counts_against_the_input_budget(monkeypatch):
+    rag_request = prepare(monkeypatch, [], long_history(20))
+    usage = rag_request["token_usage"]
+
+    assert usage["cached_prefix"] == estimate_tokens(vreg_app.rag_system.cached_system_prompt)
+    assert usage["estimated_input"] <= CLAUDE_INPUT_TOKEN_BUDGET
+    assert usage["history_messages_dropped"] > 0
+
+
+def test_faqs_outside_the_cached_prefix_are_sent_in_full(monkeypatch):
+    rag_system = vreg_app.rag_system
+    monkeypatch.setattr(rag_system, "faq_numbers", {})
+    retrieved = faq(4242)
+
+    rag_request = prepare(monkeypatch, [("faq-4242", retrieved, 0.9)], [])
+
+    assert retrieved["answer"] in rag_request["messages"][-1]["content"]
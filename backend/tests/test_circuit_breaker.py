@@ -0,0 +1,103 @@
+import time
+
+import httpx
+import pytest
+from anthropic import APIConnectionError, BadRequestError, InternalServerError
+
+from vreg_app import LLMCircuitBreaker, LLMDeadlineExceeded
+
+REQUEST = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+
+
+def connection_error():
+    return APIConnectionError(request=REQUEST)
+
+
+def status_error(cls, status):
+    return cls("error", response=httpx.Response(status, request=REQUEST), body=None)
+
+
+@pytest.fixture
+def breaker():
+    return LLMCircuitBreaker(failure_threshold=2, latency_slo_seconds=1.0, open_seconds=0.05)
+
+
+def test_breaker_opens_after_consecutive_failures(breaker):
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+
+    assert breaker.state == LLMCircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.stats()["trips"] == 1
+    assert breaker.stats()["short_circuited"] == 1
+
+
+def test_success_resets_the_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_success(0.1)
+    breaker.record_failure()
+
+    assert breaker.state == LLMCircuitBreaker.CLOSED
+
+
+def test_slow_successes_count_as_failures(breaker):
+    breaker.record_success(2.0)
+    breaker.record_success(2.0)
+
+    assert breaker.state == LLMCircuitBreaker.OPEN
+
+
+def test_half_open_lets_one_probe_through(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    assert breaker.allow_request()
+    assert breaker.state == LLMCircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+
+
+def test_successful_probe_closes_the_breaker(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.allow_request()
+
+    breaker.record_success(0.1)
+
+    assert breaker.state == LLMCircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_failed_probe_reopens_the_breaker(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.allow_request()
+
+    breaker.record_failure()
+
+    assert breaker.state == LLMCircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.stats()["trips"] == 1
+
+
+def test_rejected_probe_frees_the_probe_without_reopening(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.allow_request()
+
+    breaker.record_rejected()
+
+    assert breaker.state == LLMCircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_only_upstream_errors_count_as_failures():
+    assert LLMCircuitBreaker.counts_as_failure(connection_error())
+    assert LLMCircuitBreaker.counts_as_failure(status_error(InternalServerError, 500))
+    assert LLMCircuitBreaker.counts_as_failure(LLMDeadlineExceeded("late"))
+    assert not LLMCircuitBreaker.counts_as_failure(status_error(BadRequestError, 400))
+    assert not LLMCircuitBreaker.counts_as_failure(ValueError("bug"))
@@ -0,0 +1,81 @@
+import os
+import time
+
+from vreg_app import ColdConversationTier, Conversation, ConversationSnapshot, InMemoryConversationStore, Message
+
+
+def populate(store, conversation_id, name=None, messages=3):
+    store.get_or_create_conversation(conversation_id)
+    if name:
+        store.set_user_name(conversation_id, name)
+    for i in range(messages):
+        store.add_message(conversation_id, Message("user", f"{conversation_id} message {i}", None, 1000.0 + i))
+
+
+def test_cold_tier_round_trip_and_compaction(tmp_path):
+    tier = ColdConversationTier(str(tmp_path / "spill.bin"))
+    conv = Conversation(1.0)
+    conv.messages.append(Message("user", "hello", None, 1.5))
+    blob = ConversationSnapshot.encode_conversation(conv)
+    for i in range(50):
+        tier.put(f"c{i}", blob, last_activity=time.time())
+    for i in range(1, 50):
+        assert tier.take(f"c{i}") == blob
+
+    tier.maybe_compact()
+
+    assert len(tier) == 1
+    assert ConversationSnapshot.decode_conversation(tier.take("c0")).messages[0].content == "hello"
+    assert tier.take("c0") is None
+    tier.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_spill_files_are_private_to_each_store(tmp_path):
+    path = str(tmp_path / "spill.bin")
+    first = InMemoryConversationStore(spill_path=path)
+    second = InMemoryConversationStore(spill_path=path)
+    populate(first, "alice")
+    populate(second, "bob")
+    time.sleep(0.02)
+
+    assert first.spill_idle_conversations(0.01) == 1
+    assert second.spill_idle_conversations(0.01) == 1
+
+    assert [m["content"] for m in first.get_conversation_history("alice")][-1] == "alice message 2"
+    assert [m["content"] for m in second.get_conversation_history("bob")][-1] == "bob message 2"
+    assert first.memory_stats()["rehydrated_from_disk"] == 1
+    first.close()
+    second.close()
+
+
+def test_memory_and_disk_stay_bounded_past_both_limits(tmp_path):
+    store = InMemoryConversationStore(memory_budget_bytes=20_000, spill_path=str(tmp_path / "spill.bin"),
+                                      cold_tier_max_bytes=10_000)
+    for i in range(100):
+        store.get_or_create_conversation(f"c{i}")
+        for j in range(5):
+            # Random-looking text so the spilled records don't compress to nothing
+            store.add_message(f"c{i}", Message("user", os.urandom(200).hex(), None, 1000.0 + j))
+
+    stats = store.memory_stats()
+    assert stats["approx_bytes"] <= 20_000
+    assert stats["disk_tier"]["live_bytes"] <= 10_000
+    assert stats["disk_tier"]["evictions"] > 0
+    assert stats["lru_evictions"] == 0  # Eviction happens in the disk tier, not by skipping it
+    # The most recent conversations survive, the oldest spilled ones are gone
+    assert store.get_full_conversation("c99") is not None
+    assert store.get_full_conversation("c0") is None
+    assert store.count() < 100
+    store.close()
+
+
+def test_cold_tier_evicts_least_recently_spilled_first(tmp_path):
+    tier = ColdConversationTier(str(tmp_path / "spill.bin"), max_bytes=250)
+    for conversation_id in ("a", "b", "c"):
+        tier.put(conversation_id, b"x" * 100, last_activity=time.time())
+
+    assert tier.take("a") is None
+    assert tier.take("b") == b"x" * 100
+    assert tier.stats()["evictions"] == 1
+    tier.close()
@@ -0,0 +1,174 @@
+import os
+import pickle
+import signal
+import time
+import zlib
+
+import pytest
+
+from vreg_app import ConversationManager, ConversationSnapshot, InMemoryConversationStore, Message
+
+
+def populate(store, conversation_id, name=None, messages=3):
+    store.get_or_create_conversation(conversation_id)
+    if name:
+        store.set_user_name(conversation_id, name)
+    for i in range(messages):
+        store.add_message(conversation_id, Message("user", f"{conversation_id} message {i}", None, 1000.0 + i))
+
+
+def wait_for_restore(store):
+    deadline = time.time() + 5
+    while store.memory_stats()["snapshot_restore_pending"]:
+        assert time.time() < deadline, "snapshot was never fully restored"
+        time.sleep(0.01)
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "conversations.snapshot")
+    old = InMemoryConversationStore()
+    populate(old, "c1", "Ada")
+    populate(old, "c2")
+    old.set_summary("c1", "Asked about plates", 1000.0)
+    expected = {cid: old.get_full_conversation(cid) for cid in ("c1", "c2")}
+
+    assert old.save_snapshot(path) == 2
+    assert os.listdir(tmp_path) == [f"conversations.snapshot.{os.getpid()}"]
+
+    new = InMemoryConversationStore()
+    new.attach_snapshot(path)
+    # Conversations are served lazily before the background restore finishes
+    assert new.get_full_conversation("c1") == expected["c1"]
+    wait_for_restore(new)
+
+    assert new.get_full_conversation("c2") == expected["c2"]
+    assert new.get_summary("c1") == "Asked about plates"
+    assert new.get_summarized_through("c1") == 1000.0
+    assert new.memory_stats()["restored_from_snapshot"] == 2
+    # Restored snapshots are deleted so they are not replayed on the next start
+    assert os.listdir(tmp_path) == []
+
+
+def test_snapshots_from_several_workers_are_merged(tmp_path):
+    path = str(tmp_path / "conversations.snapshot")
+    for pid, conversation_id in ((111, "a"), (222, "b")):
+        worker = InMemoryConversationStore()
+        populate(worker, conversation_id)
+        records = [(conversation_id, ConversationSnapshot.encode_conversation(worker.conversations[conversation_id]))]
+        ConversationSnapshot.write(f"{path}.{pid}", records)
+
+    store = InMemoryConversationStore()
+    store.attach_snapshot(path)
+    wait_for_restore(store)
+
+    assert store.count() == 2
+    # A second worker starting later finds nothing left to claim
+    assert ConversationSnapshot.claim(path) == []
+
+
+def test_unrestored_records_are_carried_into_the_next_snapshot(tmp_path):
+    path = str(tmp_path / "conversations.snapshot")
+    old = InMemoryConversationStore()
+    populate(old, "c1")
+    old.save_snapshot(path)
+
+    new = InMemoryConversationStore()
+    new.snapshots = ConversationSnapshot.claim(path)  # Claimed, but not hydrated yet
+    populate(new, "c2")
+
+    assert new.save_snapshot(path) == 2
+
+
+def test_other_format_versions_are_skipped_and_left_in_place(tmp_path, monkeypatch):
+    path = str(tmp_path / "conversations.snapshot")
+    old = InMemoryConversationStore()
+    populate(old, "c1")
+    monkeypatch.setattr(ConversationSnapshot, "FORMAT_VERSION", 99)
+    old.save_snapshot(path)
+    monkeypatch.undo()
+
+    store = InMemoryConversationStore()
+    store.attach_snapshot(path)
+
+    assert store.get_full_conversation("c1") is None
+    assert os.listdir(tmp_path) == [f"conversations.snapshot.{os.getpid()}"]
+
+
+def test_truncated_snapshot_is_ignored(tmp_path):
+    path = tmp_path / "conversations.snapshot"
+    path.write_bytes(b"VREG")
+
+    assert ConversationSnapshot.open(str(path)) is None
+
+
+def test_records_written_before_summaries_still_decode():
+    blob = zlib.compress(pickle.dumps(("Ada", 1.0, 2.0, 3, [("user", "hi", None, 1.5)])))
+
+    conv = ConversationSnapshot.decode_conversation(blob)
+
+    assert conv.user_name == "Ada"
+    assert conv.version == 3
+    assert [m.content for m in conv.messages] == ["hi"]
+    assert conv.summary is None
+    assert conv.summarized_through == 0.0
+
+
+@pytest.mark.parametrize("record_count", [0, 1, 25])
+def test_write_and_open(tmp_path, record_count):
+    path = str(tmp_path / "snapshot")
+    records = [(f"c{i}", zlib.compress(f"record {i}".encode())) for i in range(record_count)]
+
+    assert ConversationSnapshot.write(path, records) == record_count
+
+    snapshot = ConversationSnapshot.open(path)
+    assert snapshot.record_count == record_count
+    assert sorted(snapshot.pending_ids()) == sorted(cid for cid, _ in records)
+    assert dict(snapshot.pending_records()) == dict(records)
+    if records:
+        assert snapshot.take("c0") == records[0][1]
+        assert snapshot.take("c0") is None
+
+
+@pytest.fixture
+def sigterm_handler():
+    original = signal.getsignal(signal.SIGTERM)
+    yield
+    signal.signal(signal.SIGTERM, original)
+
+
+def test_sigterm_saves_from_a_thread_without_deadlocking(tmp_path, sigterm_handler):
+    calls = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: calls.append(signum))
+    store = InMemoryConversationStore()
+    manager = ConversationManager(store=store)
+    manager.enable_snapshots(str(tmp_path / "conversations.snapshot"))
+    populate(store, "c1")
+
+    # The signal arrives while the main thread is inside the store holding c1's stripe lock
+    with store._locked("c1"):
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+        assert calls == [signal.SIGTERM]
+        assert not manager.snapshot_saved.wait(0.1)
+
+    assert manager.wait_for_snapshot(5)
+    assert os.listdir(tmp_path) == [f"conversations.snapshot.{os.getpid()}"]
+
+
+def test_sigterm_with_default_action_exits_through_atexit(tmp_path, sigterm_handler):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    manager = ConversationManager(store=InMemoryConversationStore())
+    manager.enable_snapshots(str(tmp_path / "conversations.snapshot"))
+
+    with pytest.raises(SystemExit) as excinfo:
+        signal.getsignal(signal.SIGTERM)(signal.SIGTERM, None)
+
+    assert excinfo.value.code == 128 + signal.SIGTERM
+    assert manager.wait_for_snapshot(5)
+
+
+def test_ignored_sigterm_stays_ignored(tmp_path, sigterm_handler):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    manager = ConversationManager(store=InMemoryConversationStore())
+    manager.enable_snapshots(str(tmp_path / "conversations.snapshot"))
+
+    assert signal.getsignal(signal.SIGTERM) == signal.SIG_IGN
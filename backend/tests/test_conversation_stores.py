@@ -0,0 +1,181 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from vreg_app import (
+    CONVERSATION_HISTORY_SIZE,
+    InMemoryConversationStore,
+    Message,
+    RedisConversationStore,
+    SQLiteConversationStore,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = InMemoryConversationStore(expiry_interval_seconds=0.01)
+    elif request.param == "sqlite":
+        store = SQLiteConversationStore(str(tmp_path / "conversations.db"), batch_window_ms=1)
+    else:
+        store = RedisConversationStore(client=fakeredis.FakeRedis(decode_responses=True))
+    yield store
+    store.close()
+
+
+def message(content, role="user", timestamp=None):
+    return Message(role, content, None, timestamp or time.time())
+
+
+def test_missing_conversation_reads_as_empty(store):
+    assert store.get_full_conversation("nobody") is None
+    assert store.get_conversation_history("nobody") == []
+    assert store.get_user_name("nobody") is None
+    assert store.get_summary("nobody") is None
+    assert store.get_summarized_through("nobody") == 0.0
+    assert store.get_conversation_revision("nobody") is None
+
+
+def test_writes_to_missing_conversation_do_not_create_it(store):
+    store.add_message("ghost", message("hello"))
+    store.set_user_name("ghost", "Ada")
+    store.set_summary("ghost", "summary", 1.0)
+
+    assert store.get_full_conversation("ghost") is None
+    assert store.count() == 0
+
+
+def test_new_conversation(store):
+    before = time.time()
+    conv = store.get_or_create_conversation("c1")
+
+    assert before - 1 <= conv.created_at <= time.time()
+    full = store.get_full_conversation("c1")
+    assert full["user_name"] is None
+    assert full["messages"] == []
+    assert full["created_at"] == pytest.approx(conv.created_at)
+    assert store.count() == 1
+
+
+def test_get_or_create_keeps_existing_conversation(store):
+    created_at = store.get_or_create_conversation("c1").created_at
+    store.add_message("c1", message("hello"))
+
+    assert store.get_or_create_conversation("c1").created_at == pytest.approx(created_at)
+    assert [m["content"] for m in store.get_conversation_history("c1")] == ["hello"]
+
+
+def test_messages_round_trip_in_order(store):
+    store.get_or_create_conversation("c1")
+    store.add_message("c1", message("question", "user", 1000.0))
+    store.add_message("c1", Message("assistant", "answer", "<p>answer</p>", 1001.0))
+
+    assert store.get_conversation_history("c1") == [
+        {"role": "user", "content": "question", "html": None, "timestamp": 1000.0},
+        {"role": "assistant", "content": "answer", "html": "<p>answer</p>", "timestamp": 1001.0},
+    ]
+    assert store.get_full_conversation("c1")["messages"] == store.get_conversation_history("c1")
+
+
+def test_history_is_trimmed_to_the_window(store):
+    store.get_or_create_conversation("c1")
+    for i in range(CONVERSATION_HISTORY_SIZE + 3):
+        store.add_message("c1", message(f"m{i}", timestamp=1000.0 + i))
+
+    history = store.get_conversation_history("c1")
+    assert [m["content"] for m in history] == [f"m{i}" for i in range(3, CONVERSATION_HISTORY_SIZE + 3)]
+    assert [m["content"] for m in store.get_conversation_history("c1", 2)] == [
+        f"m{CONVERSATION_HISTORY_SIZE + 1}", f"m{CONVERSATION_HISTORY_SIZE + 2}"
+    ]
+    assert store.get_conversation_history("c1", 0) == []
+
+
+def test_user_name_round_trip(store):
+    store.get_or_create_conversation("c1")
+    store.set_user_name("c1", "Ada")
+
+    assert store.get_user_name("c1") == "Ada"
+    assert store.get_full_conversation("c1")["user_name"] == "Ada"
+
+
+def test_summary_round_trip(store):
+    store.get_or_create_conversation("c1")
+    store.set_summary("c1", "User asked about plates", 1234.5)
+
+    assert store.get_summary("c1") == "User asked about plates"
+    assert store.get_summarized_through("c1") == 1234.5
+
+
+def test_writes_change_the_revision(store):
+    store.get_or_create_conversation("c1")
+    revisions = [store.get_conversation_revision("c1")]
+    store.add_message("c1", message("hello"))
+    revisions.append(store.get_conversation_revision("c1"))
+    store.set_user_name("c1", "Ada")
+    revisions.append(store.get_conversation_revision("c1"))
+
+    assert len(set(revisions)) == 3
+    assert store.get_full_conversation("c1")["revision"] == revisions[-1]
+
+
+def test_conversations_are_independent(store):
+    store.get_or_create_conversation("c1")
+    store.get_or_create_conversation("c2")
+    store.add_message("c1", message("for c1"))
+    store.set_user_name("c2", "Ada")
+
+    assert [m["content"] for m in store.get_conversation_history("c1")] == ["for c1"]
+    assert store.get_conversation_history("c2") == []
+    assert store.get_user_name("c1") is None
+
+
+def test_cleanup_removes_idle_conversations(store):
+    if store.backend_name == "redis":
+        pytest.skip("Redis expires conversations with key TTLs (see test_redis_store)")
+    store.get_or_create_conversation("c1")
+    store.add_message("c1", message("hello", timestamp=time.time()))
+    time.sleep(0.05)
+
+    assert store.cleanup_old_conversations(0.01 / 3600) == 1
+    assert store.get_full_conversation("c1") is None
+    assert store.count() == 0
+
+
+def read_from_fresh_threads(store, count, concurrently=False):
+    barrier = threading.Barrier(count if concurrently else 1)
+
+    def read():
+        barrier.wait()
+        store.get_conversation_history("c1")
+
+    threads = [threading.Thread(target=read) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+        if not concurrently:
+            thread.join()
+    for thread in threads:
+        thread.join()
+
+
+def test_sqlite_readers_are_reused_across_request_threads(tmp_path):
+    store = SQLiteConversationStore(str(tmp_path / "conversations.db"), batch_window_ms=1)
+    store.get_or_create_conversation("c1")
+    opened = store.memory_stats()["reader_connections_opened"]
+
+    read_from_fresh_threads(store, 20)
+
+    assert store.memory_stats()["reader_connections_opened"] == opened
+    store.close()
+
+
+def test_sqlite_reader_pool_keeps_at_most_its_size_idle(tmp_path):
+    store = SQLiteConversationStore(str(tmp_path / "conversations.db"), batch_window_ms=1, reader_pool_size=2)
+    store.get_or_create_conversation("c1")
+
+    read_from_fresh_threads(store, 8, concurrently=True)
+
+    assert len(store.idle_readers) <= 2
+    store.close()
+    assert store.idle_readers == []
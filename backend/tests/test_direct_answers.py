@@ -0,0 +1,57 @@
+import pytest
+
+import vreg_app
+from vreg_app import DIRECT_ANSWER_MARGIN, DIRECT_ANSWER_MIN_SCORE
+
+REPLY = ("Sure thing! Check your spam folder. Anything else I can help with? 😊", "<p>rendered</p>")
+
+
+@pytest.fixture
+def rag_system(monkeypatch):
+    rag_system = vreg_app.rag_system
+    monkeypatch.setattr(rag_system, "direct_answers", {"faq-0": REPLY})
+    return rag_system
+
+
+def hits(top, runner_up=None):
+    scored = [("faq-0", {}, top)]
+    if runner_up is not None:
+        scored.append(("faq-1", {}, runner_up))
+    return scored
+
+
+def test_confident_unambiguous_match_is_answered_directly(rag_system):
+    assert rag_system.select_direct_answer(hits(0.95, 0.5)) == REPLY
+    assert rag_system.select_direct_answer(hits(DIRECT_ANSWER_MIN_SCORE)) == REPLY
+
+
+def test_score_below_the_threshold_goes_to_claude(rag_system):
+    assert rag_system.select_direct_answer(hits(DIRECT_ANSWER_MIN_SCORE - 0.01)) is None
+
+
+def test_close_runner_up_goes_to_claude(rag_system):
+    assert rag_system.select_direct_answer(hits(0.95, 0.95 - DIRECT_ANSWER_MARGIN + 0.01)) is None
+
+
+def test_answer_already_given_is_not_repeated(rag_system):
+    history = [{"role": "user", "content": "No confirmation link"}, {"role": "assistant", "content": REPLY[0]}]
+
+    assert rag_system.select_direct_answer(hits(0.95), history) is None
+
+
+def test_no_hits_or_disabled_means_no_direct_answer(rag_system, monkeypatch):
+    assert rag_system.select_direct_answer([]) is None
+    monkeypatch.setattr(vreg_app, "DIRECT_ANSWER_ENABLED", False)
+    assert rag_system.select_direct_answer(hits(0.99)) is None
+
+
+def test_rendered_replies_end_with_punctuation_and_links(rag_system, monkeypatch):
+    class Collection:
+        def get(self, include):
+            return {"ids": ["faq-0"], "metadatas": [{"answer": "Visit www.vreg.gov.ng "}]}
+
+    monkeypatch.setattr(rag_system, "collection", Collection())
+    reply, html = rag_system._render_direct_answers()["faq-0"]
+
+    assert reply == "Sure thing! Visit www.vreg.gov.ng. Anything else I can help with? 😊"
+    assert html == rag_system.hyperlink_processor.convert_to_hyperlinks(reply)
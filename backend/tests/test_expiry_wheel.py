@@ -0,0 +1,48 @@
+import vreg_app
+from vreg_app import ExpiryWheel, InMemoryConversationStore, Message
+
+
+def test_buckets_come_due_oldest_first_once_they_end_before_the_cutoff():
+    wheel = ExpiryWheel(tick_seconds=10)
+    wheel.touch("a", 5)
+    wheel.touch("b", 15)
+    wheel.touch("c", 19)
+    wheel.touch("d", 35)
+
+    assert wheel.pop_due(9) == set()
+    assert wheel.pop_due(10) == {"a"}
+    assert wheel.pop_due(25) == {"b", "c"}
+    assert wheel.pop_due(100) == {"d"}
+    assert wheel.pop_due(1000) == set()
+    assert wheel.buckets == {} and wheel.ticks == []
+
+
+def test_touching_again_re_arms_in_a_later_bucket():
+    wheel = ExpiryWheel(tick_seconds=10)
+    wheel.touch("a", 5)
+    wheel.touch("a", 25)
+
+    # The stale entry still comes due; the store re-checks last_activity before expiring
+    assert wheel.pop_due(10) == {"a"}
+    assert wheel.pop_due(30) == {"a"}
+
+
+def test_store_expires_only_conversations_idle_past_the_max_age(monkeypatch):
+    now = [10000.0]
+    monkeypatch.setattr(vreg_app.time, "time", lambda: now[0])
+    store = InMemoryConversationStore(expiry_interval_seconds=10)
+    for conversation_id in ("idle", "active"):
+        store.get_or_create_conversation(conversation_id)
+
+    now[0] += 50
+    store.add_message("active", Message("user", "still here", None, now[0]))
+    now[0] += 50
+
+    # Both were touched in the first bucket, but "active" was re-armed later
+    assert store.cleanup_old_conversations(60 / 3600) == 1
+    assert store.get_full_conversation("idle") is None
+    assert store.get_full_conversation("active") is not None
+
+    now[0] += 100
+    assert store.cleanup_old_conversations(60 / 3600) == 1
+    assert store.count() == 0
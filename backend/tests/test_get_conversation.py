@@ -0,0 +1,61 @@
+import pytest
+
+import vreg_app
+
+
+@pytest.fixture
+def client():
+    return vreg_app.app.test_client()
+
+
+@pytest.fixture
+def conversation_id():
+    manager = vreg_app.conversation_manager
+    manager.get_or_create_conversation("etag-test")
+    manager.set_user_name("etag-test", "Ada")
+    manager.add_message("etag-test", "assistant", "Visit www.vreg.gov.ng to log in.")
+    return "etag-test"
+
+
+def fetch(client, conversation_id, etag=None):
+    headers = {"If-None-Match": etag} if etag else {}
+    return client.post("/get-conversation", json={"conversation_id": conversation_id}, headers=headers)
+
+
+def test_response_carries_an_etag_and_rendered_messages(client, conversation_id):
+    response = fetch(client, conversation_id)
+
+    assert response.status_code == 200
+    assert response.headers["ETag"]
+    message = response.get_json()["messages"][0]
+    assert message["raw_content"] == "Visit www.vreg.gov.ng to log in."
+    assert message["content"] == vreg_app.HyperlinkProcessor.convert_to_hyperlinks(message["raw_content"])
+
+
+def test_matching_etag_gets_304_without_a_body(client, conversation_id):
+    etag = fetch(client, conversation_id).headers["ETag"]
+
+    response = fetch(client, conversation_id, etag)
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.data == b""
+
+
+def test_etag_changes_when_the_conversation_does(client, conversation_id):
+    etag = fetch(client, conversation_id).headers["ETag"]
+    vreg_app.conversation_manager.add_message(conversation_id, "user", "Thanks!")
+
+    response = fetch(client, conversation_id, etag)
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.get_json()["messages"][-1]["raw_content"] == "Thanks!"
+
+
+def test_unknown_conversation_is_a_404_even_with_an_etag(client):
+    assert fetch(client, "nobody", '"stale"').status_code == 404
+
+
+def test_missing_conversation_id_is_a_400(client):
+    assert client.post("/get-conversation", json={}).status_code == 400
@@ -0,0 +1,75 @@
+from vreg_app import HISTORY_OPENER, MESSAGE_TOKEN_OVERHEAD, estimate_tokens, select_history_window
+
+
+def turn(role, content):
+    return {"role": role, "content": content}
+
+
+def cost(msg):
+    return estimate_tokens(msg["content"]) + MESSAGE_TOKEN_OVERHEAD
+
+
+OPENER_COST = estimate_tokens(HISTORY_OPENER) + MESSAGE_TOKEN_OVERHEAD
+
+HISTORY = [
+    turn("user", "How do I register a new vehicle?"),
+    turn("assistant", "Log in to the portal and fill in the registration form."),
+    turn("user", "What documents do I need?"),
+    turn("assistant", "Your customs papers and proof of ownership."),
+]
+
+
+def test_whole_history_fits_a_large_budget():
+    window, used, dropped = select_history_window(HISTORY, 10000)
+
+    assert window == HISTORY
+    assert used == sum(cost(msg) for msg in HISTORY)
+    assert dropped == 0
+
+
+def test_oldest_messages_are_dropped_to_fit_the_budget():
+    budget = cost(HISTORY[2]) + cost(HISTORY[3]) + OPENER_COST
+
+    window, used, dropped = select_history_window(HISTORY, budget)
+
+    assert window == HISTORY[2:]
+    assert used == cost(HISTORY[2]) + cost(HISTORY[3])
+    assert used <= budget
+    assert dropped == 2
+
+
+def test_nothing_fits_a_tiny_budget():
+    assert select_history_window(HISTORY, 1) == ([], 0, len(HISTORY))
+    assert select_history_window([], 100) == ([], 0, 0)
+    assert select_history_window(None, 100) == ([], 0, 0)
+
+
+def test_leading_assistant_turns_are_kept_behind_an_opener():
+    # The name-capture exchange only stores the assistant's side
+    history = [
+        turn("assistant", "Hello! What's your name?"),
+        turn("assistant", "Hello Ada! Nice to meet you. How can I help you with VREG today?"),
+    ]
+
+    window, used, dropped = select_history_window(history, 10000)
+
+    assert window == [turn("user", HISTORY_OPENER)] + history
+    assert used == OPENER_COST + sum(cost(msg) for msg in history)
+    assert dropped == 0
+
+
+def test_a_window_cut_at_an_assistant_turn_still_opens_with_a_user_message():
+    history = [turn("user", "I imported a car last month and want to know every step " * 3), HISTORY[3]]
+    budget = cost(history[1]) + OPENER_COST
+
+    window, used, dropped = select_history_window(history, budget)
+
+    assert window == [turn("user", HISTORY_OPENER), history[1]]
+    assert used == budget
+    assert dropped == 1
+
+
+def test_an_assistant_turn_without_room_for_the_opener_is_left_out():
+    budget = cost(HISTORY[3]) + OPENER_COST - 1
+
+    assert select_history_window(HISTORY, budget) == ([], 0, len(HISTORY))
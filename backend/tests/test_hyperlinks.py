@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from vreg_app import HyperlinkProcessor, IncrementalHyperlinker
+
+TEXTS = [
+    "Email support@vreg.gov.ng or payments@vreg.gov.ng, or visit www.vreg.gov.ng today.",
+    "Log in at https://vreg.gov.ng/login?next=/dashboard and check your dashboard.\nStill stuck? Write to support@vreg.gov.ng",
+    "No links here, just a plain answer about customs duty.",
+    "vreg.gov.ng",
+    "Trailing space after a link www.vreg.gov.ng \t\r\n",
+    "",
+]
+
+
+def stream(chunks):
+    linkifier = IncrementalHyperlinker()
+    return "".join(linkifier.feed(chunk) for chunk in chunks) + linkifier.flush()
+
+
+def random_chunks(text, rng):
+    cuts = sorted(rng.sample(range(1, len(text)), rng.randint(0, len(text) - 1))) if len(text) > 1 else []
+    bounds = [0] + cuts + [len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_every_single_split_matches_one_shot_conversion(text):
+    expected = HyperlinkProcessor.convert_to_hyperlinks(text)
+    for cut in range(len(text) + 1):
+        assert stream([text[:cut], text[cut:]]) == expected
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_random_chunkings_match_one_shot_conversion(text):
+    rng = random.Random(text)
+    expected = HyperlinkProcessor.convert_to_hyperlinks(text)
+    for _ in range(200):
+        assert stream(random_chunks(text, rng)) == expected
+
+
+def test_character_by_character_matches_one_shot_conversion():
+    text = TEXTS[1]
+    assert stream(list(text)) == HyperlinkProcessor.convert_to_hyperlinks(text)
+
+
+def test_text_before_the_last_whitespace_is_emitted_immediately():
+    linkifier = IncrementalHyperlinker()
+
+    assert linkifier.feed("Visit www.vreg") == "Visit "
+    assert linkifier.feed(".gov.ng now") == HyperlinkProcessor.convert_to_hyperlinks("www.vreg.gov.ng ")
+    assert linkifier.flush() == "now"
+    assert linkifier.flush() == ""
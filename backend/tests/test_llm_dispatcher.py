@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+import vreg_app
+from vreg_app import LLMDispatcher, LLMOverloadedError
+
+
+def hold_slot(dispatcher):
+    """Occupy one dispatcher slot from another thread until the returned event is set"""
+    acquired, release = threading.Event(), threading.Event()
+
+    def run():
+        with dispatcher.slot():
+            acquired.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    acquired.wait(5)
+    return release
+
+
+def test_dispatcher_rejects_when_the_queue_is_full():
+    dispatcher = LLMDispatcher(max_in_flight=1, max_queued=0, queue_timeout_seconds=1)
+    release = hold_slot(dispatcher)
+
+    assert dispatcher.is_full()
+    with pytest.raises(LLMOverloadedError) as excinfo:
+        with dispatcher.slot():
+            pass
+    release.set()
+
+    assert excinfo.value.retry_after >= 1
+    assert dispatcher.stats()["rejected"] == 1
+
+
+def test_dispatcher_times_out_queued_callers():
+    dispatcher = LLMDispatcher(max_in_flight=1, max_queued=1, queue_timeout_seconds=0.05)
+    release = hold_slot(dispatcher)
+
+    started = time.time()
+    with pytest.raises(LLMOverloadedError):
+        with dispatcher.slot():
+            pass
+    release.set()
+
+    assert time.time() - started >= 0.05
+    assert dispatcher.stats()["timed_out"] == 1
+    assert dispatcher.queued == 0
+
+
+def test_dispatcher_hands_a_released_slot_to_a_queued_caller():
+    dispatcher = LLMDispatcher(max_in_flight=1, max_queued=1, queue_timeout_seconds=5)
+    release = hold_slot(dispatcher)
+    threading.Timer(0.05, release.set).start()
+
+    with dispatcher.slot():
+        assert dispatcher.in_flight == 1
+
+    assert dispatcher.in_flight == 0
+    assert dispatcher.stats()["admitted"] == 2
+
+
+def test_dispatcher_never_queues_without_wait():
+    dispatcher = LLMDispatcher(max_in_flight=1, max_queued=5, queue_timeout_seconds=5)
+    release = hold_slot(dispatcher)
+
+    with pytest.raises(LLMOverloadedError):
+        with dispatcher.slot(wait=False):
+            pass
+    release.set()
+
+
+def test_chat_returns_503_with_retry_after_when_the_dispatcher_is_full(monkeypatch):
+    dispatcher = LLMDispatcher(max_in_flight=1, max_queued=0, queue_timeout_seconds=1)
+    monkeypatch.setattr(vreg_app, "llm_dispatcher", dispatcher)
+    release = hold_slot(dispatcher)
+
+    response = vreg_app.app.test_client().post("/chat", json={"message": "hello", "conversation_id": "c1"})
+    release.set()
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.get_json()["retry_after"] == int(response.headers["Retry-After"])
+
+
+def test_a_shed_chat_turn_leaves_the_history_unchanged(monkeypatch):
+    # Room in the queue lets the request past the early check; the slot then times out
+    dispatcher = LLMDispatcher(max_in_flight=1, max_queued=1, queue_timeout_seconds=0.01)
+    monkeypatch.setattr(vreg_app, "llm_dispatcher", dispatcher)
+    monkeypatch.setattr(vreg_app.rag_system, "select_direct_answer", lambda *args: None)
+    manager = vreg_app.conversation_manager
+    manager.get_or_create_conversation("shed")
+    manager.set_user_name("shed", "Ada")
+    before = manager.get_conversation_history("shed")
+    release = hold_slot(dispatcher)
+
+    client = vreg_app.app.test_client()
+    responses = [
+        client.post("/chat", json={"message": "How do I renew my plate number?", "conversation_id": "shed"})
+        for _ in range(2)
+    ]
+    release.set()
+
+    assert [response.status_code for response in responses] == [503, 503]
+    assert manager.get_conversation_history("shed") == before
@@ -0,0 +1,138 @@
+import threading
+import time
+
+import httpx
+import pytest
+from anthropic import APIConnectionError, BadRequestError, InternalServerError
+
+import vreg_app
+from vreg_app import LLMDispatcher, LLMResiliencePolicy
+
+REQUEST = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+
+
+def connection_error():
+    return APIConnectionError(request=REQUEST)
+
+
+def status_error(cls, status):
+    return cls("error", response=httpx.Response(status, request=REQUEST), body=None)
+
+
+def flaky(failures, result="ok"):
+    """request(timeout) that raises each of failures in turn, then returns result"""
+    calls = []
+
+    def request(timeout):
+        calls.append(timeout)
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return result
+
+    return request, calls
+
+
+def test_retryable_errors_are_retried():
+    policy = LLMResiliencePolicy(deadline_seconds=5, max_retries=2, base_delay_seconds=0.01)
+    request, calls = flaky([connection_error(), status_error(InternalServerError, 500)])
+
+    assert policy.call(request) == "ok"
+    assert len(calls) == 3
+    assert policy.stats()["retries"] == 2
+
+
+def test_retries_stop_after_max_retries():
+    policy = LLMResiliencePolicy(deadline_seconds=5, max_retries=1, base_delay_seconds=0.01)
+    request, calls = flaky([connection_error(), connection_error()])
+
+    with pytest.raises(APIConnectionError):
+        policy.call(request)
+    assert len(calls) == 2
+
+
+def test_non_retryable_errors_are_raised_immediately():
+    policy = LLMResiliencePolicy(deadline_seconds=5, max_retries=2, base_delay_seconds=0.01)
+    request, calls = flaky([status_error(BadRequestError, 400)])
+
+    with pytest.raises(BadRequestError):
+        policy.call(request)
+    assert len(calls) == 1
+
+
+def test_timeouts_shrink_to_the_remaining_deadline():
+    policy = LLMResiliencePolicy(deadline_seconds=0.2, max_retries=5, base_delay_seconds=0.01)
+    request, calls = flaky([connection_error()])
+
+    policy.call(request)
+
+    assert calls[0] <= 0.2
+    assert calls[1] < calls[0]
+
+
+def test_no_retry_once_a_stream_has_sent_text():
+    policy = LLMResiliencePolicy(deadline_seconds=5, max_retries=2, base_delay_seconds=0.01)
+    deadline = policy.start()
+
+    assert policy.retry_delay(0, connection_error(), deadline) is not None
+    assert policy.retry_delay(0, connection_error(), deadline, streamed=True) is None
+
+
+def test_deadline_is_enforced_across_retries(monkeypatch):
+    monkeypatch.setattr(vreg_app.random, "uniform", lambda low, high: high)  # Longest full-jitter delay
+    policy = LLMResiliencePolicy(deadline_seconds=0.05, max_retries=5, base_delay_seconds=1)
+    request, calls = flaky([connection_error()] * 5)
+
+    with pytest.raises(APIConnectionError):
+        policy.call(request)
+    # The backoff would overrun the deadline, so the first error is raised instead of sleeping
+    assert len(calls) == 1
+
+
+def hedging_policy(dispatcher):
+    policy = LLMResiliencePolicy(deadline_seconds=5, max_retries=0, hedge_enabled=True,
+                                 hedge_max_ratio=1.0, hedge_min_samples=1, dispatcher=dispatcher)
+    policy.record_latency(0.01)
+    return policy
+
+
+def slow_first(delay):
+    """request(timeout) whose first call takes delay seconds and later calls return at once"""
+    lock = threading.Lock()
+    calls = []
+
+    def request(timeout):
+        with lock:
+            calls.append(timeout)
+            first = len(calls) == 1
+        if first:
+            time.sleep(delay)
+            return "primary"
+        return "hedge"
+
+    return request, calls
+
+
+def test_hedge_wins_when_the_primary_is_slow():
+    dispatcher = LLMDispatcher(max_in_flight=4, max_queued=0)
+    policy = hedging_policy(dispatcher)
+    request, calls = slow_first(0.5)
+
+    with dispatcher.slot():
+        started = time.monotonic()
+        assert policy.call(request) == "hedge"
+        assert time.monotonic() - started < 0.4
+
+    assert policy.stats()["hedges"] == 1
+    assert policy.stats()["hedge_wins"] == 1
+
+
+def test_hedge_needs_a_free_dispatcher_slot():
+    dispatcher = LLMDispatcher(max_in_flight=1, max_queued=0)
+    policy = hedging_policy(dispatcher)
+    request, calls = slow_first(0.1)
+
+    with dispatcher.slot():
+        assert policy.call(request) == "primary"
+
+    assert len(calls) == 1
+    assert policy.stats()["hedges"] == 0
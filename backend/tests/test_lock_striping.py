@@ -0,0 +1,112 @@
+import threading
+import time
+
+from vreg_app import InMemoryConversationStore, Message
+
+
+def stripe_of(store, conversation_id):
+    return hash(conversation_id) % len(store.stripes)
+
+
+def ids_in_stripes(store, count, same_stripe):
+    """count conversation ids that all share one stripe, or all sit in different stripes"""
+    ids, stripes = [], set()
+    for i in range(10000):
+        conversation_id = f"conv-{i}"
+        stripe = stripe_of(store, conversation_id)
+        if same_stripe and ids and stripe != stripe_of(store, ids[0]):
+            continue
+        if not same_stripe and stripe in stripes:
+            continue
+        ids.append(conversation_id)
+        stripes.add(stripe)
+        if len(ids) == count:
+            return ids
+    raise AssertionError("not enough conversation ids found")
+
+
+def add_concurrently(store, conversation_ids, threads_per_conversation=4, messages_per_thread=50):
+    barrier = threading.Barrier(len(conversation_ids) * threads_per_conversation)
+
+    def run(conversation_id):
+        barrier.wait()
+        for i in range(messages_per_thread):
+            store.add_message(conversation_id, Message("user", f"m{i}", None, time.time()))
+
+    threads = [threading.Thread(target=run, args=(cid,)) for cid in conversation_ids for _ in range(threads_per_conversation)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return threads_per_conversation * messages_per_thread
+
+
+def version(store, conversation_id):
+    return int(store.get_conversation_revision(conversation_id).rsplit(":", 1)[1])
+
+
+def test_concurrent_writes_across_stripes_lose_no_updates():
+    store = InMemoryConversationStore(lock_stripes=8)
+    conversation_ids = ids_in_stripes(store, 4, same_stripe=False)
+    for conversation_id in conversation_ids:
+        store.get_or_create_conversation(conversation_id)
+
+    expected = add_concurrently(store, conversation_ids)
+
+    for conversation_id in conversation_ids:
+        assert version(store, conversation_id) == expected
+        assert len(store.get_conversation_history(conversation_id)) == store.conversations[conversation_id].messages.maxlen
+    assert store.lock_stats()["acquisitions"] >= expected * len(conversation_ids)
+
+
+def test_concurrent_writes_within_one_stripe_lose_no_updates():
+    store = InMemoryConversationStore(lock_stripes=8)
+    conversation_ids = ids_in_stripes(store, 4, same_stripe=True)
+    for conversation_id in conversation_ids:
+        store.get_or_create_conversation(conversation_id)
+
+    expected = add_concurrently(store, conversation_ids)
+
+    for conversation_id in conversation_ids:
+        assert version(store, conversation_id) == expected
+
+
+def hold_stripe_while_writing(store, held_id, written_id):
+    """Write to written_id from another thread while this thread holds held_id's stripe"""
+    done = threading.Event()
+
+    def write():
+        store.add_message(written_id, Message("user", "hello", None, time.time()))
+        done.set()
+
+    with store._locked(held_id):
+        before = store.lock_stats()
+        thread = threading.Thread(target=write)
+        thread.start()
+        finished_while_held = done.wait(0.2)
+    thread.join()
+    return finished_while_held, before, store.lock_stats()
+
+
+def test_a_busy_stripe_does_not_block_other_stripes():
+    store = InMemoryConversationStore(lock_stripes=8)
+    held_id, written_id = ids_in_stripes(store, 2, same_stripe=False)
+    store.get_or_create_conversation(written_id)
+
+    finished_while_held, before, after = hold_stripe_while_writing(store, held_id, written_id)
+
+    assert finished_while_held
+    assert after["contended"] == before["contended"] == 0
+
+
+def test_writers_on_a_busy_stripe_wait_and_are_counted_as_contended():
+    store = InMemoryConversationStore(lock_stripes=8)
+    held_id, written_id = ids_in_stripes(store, 2, same_stripe=True)
+    store.get_or_create_conversation(written_id)
+
+    finished_while_held, before, after = hold_stripe_while_writing(store, held_id, written_id)
+
+    assert not finished_while_held
+    assert after["contended"] == before["contended"] + 1
+    assert store.lock_contentions[stripe_of(store, written_id)] == 1
+    assert version(store, written_id) == 1
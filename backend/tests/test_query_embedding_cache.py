@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import vreg_app
+from vreg_app import QueryEmbeddingCache, normalize_query_text
+
+
+def vector(value):
+    return np.full(4, value, dtype=np.float32)
+
+
+def test_hits_and_misses_are_counted():
+    cache = QueryEmbeddingCache(max_size=4)
+
+    assert cache.get("plates") is None
+    cache.put("plates", vector(1))
+
+    assert np.array_equal(cache.get("plates"), vector(1))
+    assert cache.stats() == {"size": 1, "max_size": 4, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = QueryEmbeddingCache(max_size=2)
+    cache.put("a", vector(1))
+    cache.put("b", vector(2))
+    cache.get("a")  # b is now the least recently used
+    cache.put("c", vector(3))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats()["size"] == 2
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(vreg_app.time, "time", lambda: now[0])
+    cache = QueryEmbeddingCache(max_size=4, ttl_seconds=60)
+    cache.put("plates", vector(1))
+
+    now[0] += 59
+    assert cache.get("plates") is not None
+    now[0] += 2
+    assert cache.get("plates") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_zero_size_cache_stores_nothing():
+    cache = QueryEmbeddingCache(max_size=0)
+    cache.put("plates", vector(1))
+
+    assert cache.get("plates") is None
+
+
+def test_cached_embeddings_are_read_only():
+    cache = QueryEmbeddingCache()
+    cache.put("plates", vector(1))
+
+    with pytest.raises(ValueError):
+        cache.get("plates")[0] = 5
+
+
+def test_equivalent_questions_share_a_key():
+    assert normalize_query_text("How do I  renew my PLATE?") == normalize_query_text("how do i renew my plate")
+
+
+def test_repeated_queries_are_embedded_once(monkeypatch):
+    rag_system = vreg_app.rag_system
+    monkeypatch.setattr(rag_system, "query_cache", QueryEmbeddingCache(max_size=8))
+    calls = []
+
+    def embed_query(text):
+        calls.append(text)
+        return vector(len(calls))
+
+    monkeypatch.setattr(rag_system.embedding_engine, "embed_query", embed_query)
+
+    first = rag_system.embed_query("Where is my certificate?")
+    second = rag_system.embed_query("where is my certificate")
+
+    assert calls == ["Where is my certificate?"]
+    assert second is first
@@ -0,0 +1,79 @@
+import time
+
+import fakeredis
+import pytest
+
+from vreg_app import Message, RedisConversationStore
+
+
+@pytest.fixture
+def store():
+    client = fakeredis.FakeRedis(decode_responses=True)
+    store = RedisConversationStore(client=client, history_size=3, ttl_seconds=600)
+    yield store
+    store.close()
+
+
+def message(content, timestamp=None):
+    return Message("user", content, None, timestamp or time.time())
+
+
+def test_writes_to_missing_conversation_do_not_create_it(store):
+    store.add_message("ghost", message("hello"))
+    store.set_user_name("ghost", "Ada")
+    store.set_summary("ghost", "summary", 1.0)
+
+    assert store.get_full_conversation("ghost") is None
+    assert store.get_conversation_history("ghost") == []
+    assert store.client.keys("*") == []
+
+
+def test_history_is_trimmed_to_the_window(store):
+    store.get_or_create_conversation("c1")
+    for i in range(5):
+        store.add_message("c1", message(f"m{i}", 1000.0 + i))
+
+    history = store.get_conversation_history("c1")
+    assert [m["content"] for m in history] == ["m2", "m3", "m4"]
+    assert [m["content"] for m in store.get_conversation_history("c1", 2)] == ["m3", "m4"]
+
+
+def test_writes_bump_revision_and_invalidate_local_cache(store):
+    store.get_or_create_conversation("c1")
+    before = store.get_conversation_revision("c1")
+    assert store.get_user_name("c1") is None  # Warms the local cache
+
+    store.set_user_name("c1", "Ada")
+
+    assert store.get_user_name("c1") == "Ada"
+    assert store.get_conversation_revision("c1") != before
+
+
+def test_summary_round_trip(store):
+    store.get_or_create_conversation("c1")
+    assert store.get_summary("c1") is None
+    assert store.get_summarized_through("c1") == 0.0
+
+    store.set_summary("c1", "User asked about plates", 1234.5)
+
+    assert store.get_summary("c1") == "User asked about plates"
+    assert store.get_summarized_through("c1") == 1234.5
+
+
+def test_keys_carry_the_conversation_ttl(store):
+    store.get_or_create_conversation("c1")
+    store.add_message("c1", message("hello"))
+
+    assert 0 < store.client.ttl(store._conv_key("c1")) <= 600
+    assert 0 < store.client.ttl(store._messages_key("c1")) <= 600
+
+
+def test_expired_conversation_is_gone(store):
+    store.get_or_create_conversation("c1")
+    store.add_message("c1", message("hello"))
+    store.client.delete(store._conv_key("c1"), store._messages_key("c1"))
+    store._invalidate("c1")
+
+    store.add_message("c1", message("late reply"))
+
+    assert store.get_full_conversation("c1") is None
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import vreg_app
+from vreg_app import SemanticResponseCache
+
+
+def unit(*values):
+    v = np.array(values, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+@pytest.mark.parametrize("query", [
+    "My VIN 1HGCM82633A004352 is not validating",
+    "TIN 12345678-0001 shows invalid",
+    "Where is the certificate for invoice INV-2024-0012?",
+    "email me at ada@example.com",
+    "I opened https://vreg.gov.ng/login and it failed",
+    "is www.vreg.gov.ng down",
+])
+def test_queries_with_identifiers_are_not_cacheable(query):
+    assert not SemanticResponseCache.is_cacheable(query)
+
+
+@pytest.mark.parametrize("query", ["How do I reset my password?", "Where is my certificate", ""])
+def test_generic_queries_are_cacheable(query):
+    assert SemanticResponseCache.is_cacheable(query)
+
+
+def test_answers_are_personalised_for_each_user():
+    cache = SemanticResponseCache(similarity_threshold=0.9)
+    cache.store(unit(1, 0), ["faq-1"], "digest", "Sure Ada, check your spam folder. Adam can help too.", "Ada")
+
+    assert cache.lookup(unit(1, 0), ["faq-1"], "digest", "Bola") == "Sure Bola, check your spam folder. Adam can help too."
+    assert cache.lookup(unit(1, 0), ["faq-1"], "digest") == "Sure there, check your spam folder. Adam can help too."
+
+
+def test_lookup_needs_a_similar_query_and_the_same_faqs_and_history():
+    cache = SemanticResponseCache(similarity_threshold=0.95)
+    cache.store(unit(1, 0), ["faq-1", "faq-2"], "digest", "answer")
+
+    assert cache.lookup(unit(1, 0.1), ["faq-2", "faq-1"], "digest") == "answer"
+    assert cache.lookup(unit(1, 1), ["faq-1", "faq-2"], "digest") is None
+    assert cache.lookup(unit(1, 0), ["faq-1"], "digest") is None
+    assert cache.lookup(unit(1, 0), ["faq-1", "faq-2"], "other") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 3
+
+
+def test_entries_expire_and_are_bounded(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(vreg_app.time, "time", lambda: now[0])
+    cache = SemanticResponseCache(max_entries=2, ttl_seconds=60)
+    for i in range(3):
+        cache.store(unit(1, 0), [f"faq-{i}"], "digest", f"answer {i}")
+
+    assert cache.stats()["size"] == 2
+    assert cache.lookup(unit(1, 0), ["faq-0"], "digest") is None
+    now[0] += 61
+    assert cache.lookup(unit(1, 0), ["faq-2"], "digest") is None
+    assert cache.stats()["size"] == 1
+
+
+def test_history_digest_ignores_the_users_name():
+    history = [{"role": "user", "content": "Hi, I'm Ada"}, {"role": "assistant", "content": "Hello Ada!"}]
+    other = [{"role": "user", "content": "Hi, I'm Bola"}, {"role": "assistant", "content": "Hello Bola!"}]
+
+    assert SemanticResponseCache.history_digest(history, "Ada") == SemanticResponseCache.history_digest(other, "Bola")
+    assert SemanticResponseCache.history_digest(history, "Ada") != SemanticResponseCache.history_digest(history, "Ada", summary="x")
@@ -0,0 +1,74 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+from vreg_app import ChromaFAQRetriever, NumpyFAQRetriever
+from vreg_index import EmbeddingEngine, build_vector_index, open_vector_index, vreg_faqs
+
+QUERIES = [
+    "I did not get my confirmation link",
+    "my TIN is invalid on the portal",
+    "how do I reset my password",
+    "payment failed but I was debited",
+    "where is my certificate",
+]
+
+
+class HashingModel:
+    """Deterministic bag-of-words stand-in for a SentenceTransformer"""
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False):
+        vectors = np.zeros((len(texts), 128), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % 128] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return EmbeddingEngine(model_name="hashing-test-model", model=HashingModel())
+
+
+@pytest.fixture(scope="module")
+def collection(engine, tmp_path_factory):
+    pytest.importorskip("chromadb")
+    path = str(tmp_path_factory.mktemp("index"))
+    build_vector_index(engine, path)
+    return open_vector_index(engine, path)
+
+
+def test_numpy_retriever_matches_chroma(engine, collection):
+    chroma = ChromaFAQRetriever(collection)
+    exact = NumpyFAQRetriever.from_collection(collection)
+    query_embeddings = engine.embed_documents(QUERIES)
+
+    assert len(exact) == len(vreg_faqs)
+    for chroma_hits, exact_hits in zip(chroma.search(query_embeddings, 3), exact.search(query_embeddings, 3)):
+        assert [faq_id for faq_id, _metadata, _score in exact_hits] == [faq_id for faq_id, _metadata, _score in chroma_hits]
+        assert [metadata for _faq_id, metadata, _score in exact_hits] == [metadata for _faq_id, metadata, _score in chroma_hits]
+        assert [score for _faq_id, _metadata, score in exact_hits] == pytest.approx(
+            [score for _faq_id, _metadata, score in chroma_hits], abs=1e-4
+        )
+
+
+def test_numpy_retriever_ranks_by_cosine_similarity():
+    embeddings = np.array([[1, 0], [0, 2], [1, 1]], dtype=np.float32)
+    retriever = NumpyFAQRetriever(["a", "b", "c"], embeddings, [{"n": 0}, {"n": 1}, {"n": 2}])
+
+    hits = retriever.search(np.array([[1, 0], [0, 1]], dtype=np.float32), 2)
+
+    assert [faq_id for faq_id, _metadata, _score in hits[0]] == ["a", "c"]
+    assert [faq_id for faq_id, _metadata, _score in hits[1]] == ["b", "c"]
+    assert hits[0][0][2] == pytest.approx(1.0)
+    assert hits[0][1][2] == pytest.approx(np.sqrt(0.5))
+
+
+def test_numpy_retriever_caps_results_at_the_corpus_size():
+    retriever = NumpyFAQRetriever(["a", "b"], np.eye(2, dtype=np.float32), [{}, {}])
+
+    assert len(retriever.search(np.array([1, 0], dtype=np.float32), 5)[0]) == 2
+    assert retriever.search(np.array([1, 0], dtype=np.float32), 0) == [[]]
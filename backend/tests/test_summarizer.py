@@ -0,0 +1,135 @@
+import itertools
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import vreg_app
+from vreg_app import (
+    CONVERSATION_HISTORY_SIZE,
+    ConversationManager,
+    ConversationSummarizer,
+    InMemoryConversationStore,
+    LLMDispatcher,
+)
+
+
+class FakeClient:
+    def __init__(self, text="User cannot find the confirmation link."):
+        self.text = text
+        self.calls = []
+        self.messages = self
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return SimpleNamespace(content=[SimpleNamespace(text=self.text)])
+
+
+def message(role, content, timestamp):
+    return {"role": role, "content": content, "html": None, "timestamp": timestamp}
+
+
+@pytest.fixture
+def store():
+    store = InMemoryConversationStore()
+    store.get_or_create_conversation("c1")
+    return store
+
+
+def test_local_fold_in_appends_first_sentences(store):
+    summarizer = ConversationSummarizer(store, mode="local")
+    summarizer.fold("c1", [
+        message("user", "I never got my link. I registered yesterday.", 1.0),
+        message("assistant", "Check your spam folder!  It may be there.", 2.0),
+    ])
+
+    assert store.get_summary("c1") == "User: I never got my link.\nAssistant: Check your spam folder!"
+    assert store.get_summarized_through("c1") == 2.0
+    assert summarizer.stats()["messages_folded"] == 2
+
+
+def test_messages_are_folded_only_once(store):
+    summarizer = ConversationSummarizer(store, mode="local")
+    first = [message("user", "First question.", 1.0)]
+    summarizer.fold("c1", first)
+    summarizer.fold("c1", first + [message("user", "Second question.", 2.0)])
+
+    assert store.get_summary("c1") == "User: First question.\nUser: Second question."
+
+
+def test_local_summary_keeps_the_newest_lines_within_max_chars():
+    messages = [message("user", f"Question number {i}.", float(i)) for i in range(10)]
+
+    summary = ConversationSummarizer.local_summary("Old line", messages, 60)
+
+    assert len(summary) <= 60
+    assert summary.endswith("User: Question number 9.")
+    assert "Old line" not in summary
+
+
+def test_llm_fold_in_merges_with_the_current_summary(store, monkeypatch):
+    monkeypatch.setattr(vreg_app, "llm_dispatcher", LLMDispatcher(max_in_flight=1, max_queued=0))
+    fake = FakeClient()
+    store.set_summary("c1", "User is registering a car.", 0.5)
+    summarizer = ConversationSummarizer(store, mode="llm", llm_client=fake)
+
+    summarizer.fold("c1", [message("user", "No link arrived.", 1.0)])
+
+    assert store.get_summary("c1") == fake.text
+    prompt = fake.calls[0]["messages"][0]["content"]
+    assert "User is registering a car." in prompt and "user: No link arrived." in prompt
+
+
+def test_busy_dispatcher_skips_claude_and_folds_locally(store, monkeypatch):
+    dispatcher = LLMDispatcher(max_in_flight=1, max_queued=5, queue_timeout_seconds=5)
+    monkeypatch.setattr(vreg_app, "llm_dispatcher", dispatcher)
+    fake = FakeClient()
+    summarizer = ConversationSummarizer(store, mode="llm", llm_client=fake)
+    acquired, release = threading.Event(), threading.Event()
+
+    def hold():
+        with dispatcher.slot():
+            acquired.set()
+            release.wait(5)
+
+    threading.Thread(target=hold, daemon=True).start()
+    acquired.wait(5)
+    try:
+        summarizer.fold("c1", [message("user", "No link arrived.", 1.0)])
+    finally:
+        release.set()
+
+    # Background work never queues behind chat requests
+    assert fake.calls == []
+    assert dispatcher.queued == 0
+    assert store.get_summary("c1") == "User: No link arrived."
+    assert summarizer.stats()["llm_failures"] == 1
+
+
+def test_worker_folds_submitted_messages(store):
+    summarizer = ConversationSummarizer(store, mode="local")
+    summarizer.start()
+    summarizer.submit("c1", [message("user", "Where is my certificate?", 1.0)])
+
+    for _ in range(500):
+        if store.get_summary("c1"):
+            break
+        threading.Event().wait(0.01)
+    assert store.get_summary("c1") == "User: Where is my certificate?"
+
+
+def test_messages_leaving_the_window_and_dropped_from_prompts_are_submitted(store, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(vreg_app.time, "time", lambda: float(next(clock)))
+    manager = ConversationManager(store=store)
+    # Not started, so submitted messages stay queued where the test can see them
+    manager.summarizer = summarizer = ConversationSummarizer(store, mode="local")
+    for i in range(CONVERSATION_HISTORY_SIZE + 1):
+        manager.add_message("c1", "user", f"message {i}")
+
+    assert [msg["content"] for msg in summarizer.pending["c1"]] == ["message 0"]
+
+    history = manager.get_conversation_history("c1")
+    manager.fold_unsent_history("c1", history, {"history_messages_dropped": 3})
+
+    assert [msg["content"] for msg in summarizer.pending["c1"]] == ["message 0", "message 1", "message 2", "message 3"]
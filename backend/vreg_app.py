@@ -1,401 +1,2167 @@
-from flask import Flask, request, jsonify, send_from_directory, session, send_file
+from flask import Flask, request, jsonify, send_from_directory, session, send_file, Response, stream_with_context
 import os
-from anthropic import Anthropic  # ✅ Changed from Groq
+from anthropic import Anthropic, APIConnectionError, APIStatusError  # ✅ Changed from Groq
 from flask_cors import CORS
 from dotenv import load_dotenv
-import chromadb
-from sentence_transformers import SentenceTransformer
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import uuid
 import re
 import time
-from threading import Lock
+import json
+import hashlib
+import heapq
+from collections import OrderedDict, deque
+import sys
+from threading import Lock, Thread, Event
+import threading
+import queue
+import sqlite3
+import signal
+import atexit
+import pickle
+import struct
+import zlib
+import math
+import random
+import itertools
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_for_futures
+from contextlib import contextmanager
+from vreg_index import (
+    VECTOR_INDEX_DIR,
+    EmbeddingEngine,
+    ensure_vector_index,
+    open_vector_index,
+    vector_index_path,
+    vreg_faqs,
+)
 
 # Load environment variables
 load_dotenv()
 anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")  # ✅ Changed
 print(f"API Key loaded: {'Yes' if anthropic_api_key else 'No'}")
-client = Anthropic(api_key=anthropic_api_key)  # ✅ Changed
+# Retries are handled by LLMResiliencePolicy, so the SDK's own retries are off
+client = Anthropic(api_key=anthropic_api_key, max_retries=0)  # ✅ Changed
 app = Flask(__name__)
 # 🔑 Secret key for Flask sessions
 app.secret_key = os.environ.get(
     "FLASK_SECRET_KEY",
     "dev-secret"  # fallback for local dev
 )
-CORS(app)
+CORS(app, expose_headers=["ETag", "Retry-After"])  # Let the frontend read ETags and back-off hints
+# Reject oversized request bodies (413) before they are read
+app.config["MAX_CONTENT_LENGTH"] = 64 * 1024
+
+# Bare domains whose links should point at a canonical https URL (JSON object)
+LINK_DOMAIN_REWRITES = json.loads(os.getenv(
+    "LINK_DOMAIN_REWRITES",
+    '{"www.vreg.gov.ng": "https://vreg.gov.ng", "www.trade.gov.ng": "https://trade.gov.ng"}'
+))
+
+# Claude configuration
+CLAUDE_MODEL = "claude-sonnet-4-5-20250929"
+CLAUDE_MAX_TOKENS = 300
+CLAUDE_TEMPERATURE = 0.7
+# Estimated input tokens per request: cached prefix, system prompt, FAQ context and question
+# first, then as much recent history as still fits
+CLAUDE_INPUT_TOKEN_BUDGET = int(os.getenv("CLAUDE_INPUT_TOKEN_BUDGET", "4500"))
+# The knowledge base joins the cached prompt prefix only while it fits in this many tokens;
+# larger corpora send just the retrieved FAQs with each question
+CLAUDE_CACHED_KB_MAX_TOKENS = int(os.getenv("CLAUDE_CACHED_KB_MAX_TOKENS", "2000"))
+# Claude ignores cache_control on prompt prefixes shorter than this (Sonnet models)
+CLAUDE_MIN_CACHEABLE_TOKENS = 1024
+# At most LLM_MAX_IN_FLIGHT Claude calls per process; up to LLM_MAX_QUEUED more wait for a slot
+# for LLM_QUEUE_TIMEOUT_SECONDS, anything beyond that gets 503 + Retry-After
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_MAX_QUEUED = int(os.getenv("LLM_MAX_QUEUED", "32"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+# Each Claude call must finish within the deadline; retryable failures are retried with jittered backoff
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "25"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+# Optional hedging: send a duplicate request once the first is slower than the recent p95,
+# for at most LLM_HEDGE_MAX_RATIO of calls
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.05"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "50"))
+# Circuit breaker: after this many consecutive failures or calls slower than the SLO, answer
+# from the top FAQ for LLM_BREAKER_OPEN_SECONDS, then let one probe call through
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_LATENCY_SLO_SECONDS = float(os.getenv("LLM_BREAKER_LATENCY_SLO_SECONDS", "10"))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+# Corpora up to this size are searched with the exact NumPy retriever instead of ChromaDB
+EXACT_RETRIEVER_MAX_FAQS = int(os.getenv("EXACT_RETRIEVER_MAX_FAQS", "5000"))
+
+# Query embedding cache configuration (TTL of 0 disables expiry)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "0"))
+
+# Semantic response cache configuration (max entries of 0 disables it)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+RESPONSE_CACHE_HISTORY_TURNS = int(os.getenv("RESPONSE_CACHE_HISTORY_TURNS", "2"))
+
+# Direct-answer fast path: answer straight from the top FAQ when it clearly wins
+DIRECT_ANSWER_ENABLED = os.getenv("DIRECT_ANSWER_ENABLED", "true").lower() == "true"
+DIRECT_ANSWER_MIN_SCORE = float(os.getenv("DIRECT_ANSWER_MIN_SCORE", "0.80"))
+DIRECT_ANSWER_MARGIN = float(os.getenv("DIRECT_ANSWER_MARGIN", "0.10"))
+
+
+# Number of striped locks guarding conversations
+CONVERSATION_LOCK_STRIPES = int(os.getenv("CONVERSATION_LOCK_STRIPES", "64"))
+
+# Idle conversations are expired in the background
+CONVERSATION_MAX_AGE_HOURS = float(os.getenv("CONVERSATION_MAX_AGE_HOURS", "24"))
+CONVERSATION_EXPIRY_INTERVAL_SECONDS = float(os.getenv("CONVERSATION_EXPIRY_INTERVAL_SECONDS", "60"))
+
+# Global memory budget for stored conversations, enforced by LRU eviction
+CONVERSATION_MEMORY_BUDGET_BYTES = int(float(os.getenv("CONVERSATION_MEMORY_BUDGET_MB", "256")) * 1024 * 1024)
+# Messages kept per conversation; how many are sent is decided by CLAUDE_INPUT_TOKEN_BUDGET
+CONVERSATION_HISTORY_SIZE = int(os.getenv("CONVERSATION_HISTORY_SIZE", "20"))
+# Per-conversation share of the budget; a conversation over it loses its own oldest messages
+CONVERSATION_MAX_BYTES = int(float(os.getenv("CONVERSATION_MAX_KB", "64")) * 1024)
+# Longest chat message accepted; longer ones are rejected with 413
+CHAT_MAX_MESSAGE_CHARS = int(os.getenv("CHAT_MAX_MESSAGE_CHARS", "4000"))
+
+# Approximate fixed costs used for byte accounting (see benchmarks/bench_conversation_memory.py)
+CONVERSATION_BASE_BYTES = 900
+MESSAGE_OVERHEAD_BYTES = 200
+
+# Conversation storage backend: "memory" (per process), "sqlite" (shared by workers on a node)
+# or "redis" (shared across nodes)
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "memory").lower()
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversations.db"))
+# In-memory conversations are snapshotted here on SIGTERM and restored on startup (empty disables)
+CONVERSATION_SNAPSHOT_PATH = os.getenv("CONVERSATION_SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversations.snapshot"))
 
+# Conversations idle this long are compressed and spilled to a local file, then rehydrated
+# on their next request (0 keeps everything resident)
+CONVERSATION_SPILL_IDLE_SECONDS = float(os.getenv("CONVERSATION_SPILL_IDLE_SECONDS", "900"))
+CONVERSATION_SPILL_PATH = os.getenv("CONVERSATION_SPILL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversations.spill"))
+# Spilled conversations past this size are dropped, least recently spilled first
+CONVERSATION_COLD_TIER_MAX_BYTES = int(float(os.getenv("CONVERSATION_COLD_TIER_MAX_MB", "512")) * 1024 * 1024)
+
+# Rolling summary of messages that leave the history window: "off", "llm" (Claude) or "local"
+CONVERSATION_SUMMARY_MODE = os.getenv("CONVERSATION_SUMMARY_MODE", "off").lower()
+CONVERSATION_SUMMARY_MAX_CHARS = int(os.getenv("CONVERSATION_SUMMARY_MAX_CHARS", "1200"))
+CONVERSATION_SUMMARY_MAX_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_MAX_TOKENS", "200"))
+
+# Redis-protocol backend for sharing conversations across nodes
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_KEY_PREFIX = os.getenv("REDIS_KEY_PREFIX", "vreg")
+REDIS_LOCAL_CACHE_SIZE = int(os.getenv("REDIS_LOCAL_CACHE_SIZE", "1024"))
+REDIS_LOCAL_CACHE_TTL_SECONDS = float(os.getenv("REDIS_LOCAL_CACHE_TTL_SECONDS", "2"))
+# How long the SQLite writer waits to group concurrent writes into one transaction
+SQLITE_BATCH_WINDOW_MS = float(os.getenv("SQLITE_BATCH_WINDOW_MS", "2"))
+# Idle SQLite read connections kept open for reuse; extra concurrent readers get a short-lived one
+SQLITE_READER_POOL_SIZE = int(os.getenv("SQLITE_READER_POOL_SIZE", "8"))
 
 # In-memory conversation store
 conversations = {}
 conversations_lock = Lock()
 
-class ConversationManager:
-    """Manage conversation state including user names and message history"""
+class ExpiryWheel:
+    """Hashed timing wheel of conversation ids bucketed by last-activity time
+
+    Touching a conversation drops its id into the bucket for the current
+    tick; ids left in older buckets are simply re-checked when those buckets
+    come due, so both touching and expiring are amortized O(1).
+    """
     
-    def __init__(self):
+    def __init__(self, tick_seconds: float):
+        self.tick_seconds = max(tick_seconds, 0.001)
+        self.buckets = {}  # tick -> set of conversation ids
+        self.ticks = []  # min-heap of ticks that have a bucket
+        self.lock = Lock()
+    
+    def touch(self, conversation_id: str, timestamp: float):
+        tick = int(timestamp // self.tick_seconds)
+        with self.lock:
+            bucket = self.buckets.get(tick)
+            if bucket is None:
+                bucket = self.buckets[tick] = set()
+                heapq.heappush(self.ticks, tick)
+            bucket.add(conversation_id)
+    
+    def pop_due(self, cutoff: float) -> set:
+        """Remove and return ids from every bucket that ends before cutoff"""
+        due = set()
+        with self.lock:
+            while self.ticks and (self.ticks[0] + 1) * self.tick_seconds <= cutoff:
+                due |= self.buckets.pop(heapq.heappop(self.ticks))
+        return due
+
+class Message:
+    """One stored chat message"""
+    
+    __slots__ = ('role', 'content', 'html', 'timestamp')
+    
+    def __init__(self, role: str, content: str, html: str, timestamp: float):
+        self.role = sys.intern(role)  # Only a handful of distinct roles, so share the strings
+        self.content = content
+        self.html = html
+        self.timestamp = timestamp
+    
+    def to_dict(self) -> Dict:
+        return {
+            'role': self.role,
+            'content': self.content,
+            'html': self.html,
+            'timestamp': self.timestamp
+        }
+
+class Conversation:
+    """Compact per-conversation state with a fixed-capacity message ring buffer"""
+    
+    __slots__ = ('user_name', 'created_at', 'last_activity', 'messages', 'version', 'bytes', 'summary', 'summarized_through')
+    
+    def __init__(self, created_at: float, history_size: int = CONVERSATION_HISTORY_SIZE):
+        self.user_name = None
+        self.created_at = created_at
+        self.last_activity = created_at
+        # 🆕 Added: Store conversation history; the deque drops the oldest message itself
+        self.messages = deque(maxlen=history_size)
+        self.version = 0  # Bumped on every change, used for ETags
+        self.bytes = 0
+        self.summary = None  # Rolling summary of messages that left the window
+        self.summarized_through = 0.0  # Timestamp of the newest message folded into the summary
+
+class ConversationSnapshot:
+    """Versioned binary snapshot of in-memory conversations
+
+    Layout: a fixed header (magic, format version, record count, index
+    offset), one zlib-compressed record per conversation, then a compressed
+    index of (conversation_id, offset, length). Opening a snapshot reads only
+    the header; the index and individual records are read on demand, so boot
+    time does not depend on snapshot size. Files with another format version
+    are skipped.
+
+    Every process writes its own file (path.<pid>), and on start a process
+    claims files by renaming them, so with several workers sharing a path
+    no snapshot is overwritten and each is restored by exactly one worker.
+    """
+    
+    MAGIC = b"VREGSNAP"
+    FORMAT_VERSION = 1
+    HEADER = struct.Struct(">8sHIQ")
+    
+    def __init__(self, path: str, record_count: int, index_offset: int):
+        self.path = path
+        self.record_count = record_count
+        self.index_offset = index_offset
+        self.index = None  # conversation_id -> (offset, length), loaded lazily
+        self.lock = Lock()
+    
+    @staticmethod
+    def encode_conversation(conv: Conversation) -> bytes:
+        record = (
+            conv.user_name,
+            conv.created_at,
+            conv.last_activity,
+            conv.version,
+            [(m.role, m.content, m.html, m.timestamp) for m in conv.messages],
+            conv.summary,
+            conv.summarized_through
+        )
+        return zlib.compress(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL))
+    
+    @staticmethod
+    def decode_conversation(blob: bytes, history_size: int = CONVERSATION_HISTORY_SIZE) -> Conversation:
+        record = pickle.loads(zlib.decompress(blob))
+        user_name, created_at, last_activity, version, messages = record[:5]
+        conv = Conversation(created_at, history_size)
+        # Records written before summaries existed have no sixth or seventh field
+        conv.summary = record[5] if len(record) > 5 else None
+        conv.summarized_through = record[6] if len(record) > 6 else 0.0
+        conv.user_name = user_name
+        conv.last_activity = last_activity
+        conv.version = version
+        conv.messages.extend(Message(*fields) for fields in messages)
+        return conv
+    
+    @classmethod
+    def write(cls, path: str, records) -> int:
+        """Atomically write (conversation_id, encoded record) pairs to path"""
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        index = []
+        with open(tmp_path, "wb") as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.FORMAT_VERSION, 0, 0))
+            for conversation_id, blob in records:
+                index.append((conversation_id, f.tell(), len(blob)))
+                f.write(blob)
+            index_offset = f.tell()
+            f.write(zlib.compress(pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)))
+            # Fill in the header now that the index position is known
+            f.seek(0)
+            f.write(cls.HEADER.pack(cls.MAGIC, cls.FORMAT_VERSION, len(index), index_offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return len(index)
+    
+    @classmethod
+    def open(cls, path: str):
+        """Open a snapshot by reading its header; returns None if missing or incompatible"""
+        try:
+            with open(path, "rb") as f:
+                header = f.read(cls.HEADER.size)
+        except FileNotFoundError:
+            return None
+        if len(header) != cls.HEADER.size:
+            print(f"⚠️ Ignoring truncated conversation snapshot {path}")
+            return None
+        magic, version, record_count, index_offset = cls.HEADER.unpack(header)
+        if magic != cls.MAGIC or version != cls.FORMAT_VERSION:
+            print(f"⚠️ Skipping conversation snapshot {path} (format {version}, expected {cls.FORMAT_VERSION})")
+            return None
+        return cls(path, record_count, index_offset)
+    
+    @classmethod
+    def claim(cls, path: str) -> List["ConversationSnapshot"]:
+        """Take ownership of every snapshot written for path, newest first"""
+        directory, name = os.path.split(os.path.abspath(path))
+        # path itself is the pre-per-worker layout; path.<pid> is one worker's snapshot
+        pattern = re.compile(re.escape(name) + r"(\.\d+)?")
+        try:
+            candidates = [os.path.join(directory, entry) for entry in os.listdir(directory) if pattern.fullmatch(entry)]
+        except FileNotFoundError:
+            return []
+        claimed = []
+        for source in candidates:
+            target = f"{source}.restoring-{os.getpid()}"
+            try:
+                os.rename(source, target)
+            except FileNotFoundError:
+                continue  # Another worker claimed it first
+            snapshot = cls.open(target)
+            if snapshot is None:
+                # Leave incompatible files where they were for whichever version can read them
+                os.rename(target, source)
+                continue
+            claimed.append((os.path.getmtime(target), snapshot))
+        claimed.sort(key=lambda item: item[0], reverse=True)
+        return [snapshot for _, snapshot in claimed]
+    
+    def discard(self):
+        """Delete a claimed snapshot once everything in it has been restored"""
+        # Under the lock, so a lookup that already took a record still gets to read it
+        with self.lock:
+            self.index = {}
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+    
+    def _load_index(self) -> Dict:
+        with self.lock:
+            if self.index is None:
+                with open(self.path, "rb") as f:
+                    f.seek(self.index_offset)
+                    entries = pickle.loads(zlib.decompress(f.read()))
+                self.index = {conversation_id: (offset, length) for conversation_id, offset, length in entries}
+            return self.index
+    
+    def _read_at(self, offset: int, length: int) -> bytes:
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+    
+    def take(self, conversation_id: str) -> bytes:
+        """Read a record and remove it from the pending index so it is restored only once"""
+        self._load_index()
+        with self.lock:
+            location = self.index.pop(conversation_id, None)
+            return self._read_at(*location) if location else None
+    
+    def pending_ids(self) -> List[str]:
+        self._load_index()
+        with self.lock:
+            return list(self.index)
+    
+    def pending_records(self):
+        """Yield (conversation_id, encoded record) for everything not yet restored"""
+        for conversation_id in self.pending_ids():
+            with self.lock:
+                location = self.index.get(conversation_id)
+                blob = self._read_at(*location) if location else None
+            if blob is not None:
+                yield conversation_id, blob
+
+class ColdConversationTier:
+    """Append-only spill file for idle conversations with an in-memory offset index
+
+    Records use the snapshot encoding. Rehydrating or re-spilling a
+    conversation leaves its old record behind as garbage, and the file is
+    rewritten once garbage outweighs live data. Offsets are only meaningful to
+    the process that wrote them, so every process gets its own file, created
+    exclusively next to path with the pid in its name. On POSIX the file is
+    unlinked as soon as it is open, so it disappears however the process exits.
+    
+    Live records are capped at max_bytes: past it the least recently spilled
+    conversations are dropped, so memory over budget cannot turn into an
+    unbounded file (which on tmpfs is memory again).
+    """
+    
+    COMPACT_MIN_BYTES = 8 * 1024 * 1024
+    
+    def __init__(self, path: str, max_bytes: int = CONVERSATION_COLD_TIER_MAX_BYTES):
+        self.base_path = path
+        self.max_bytes = max_bytes
+        self.file, self.path = self._create_file()
+        self.index = {}  # conversation_id -> (offset, length, last_activity), least recently spilled first
+        self.lock = Lock()
+        self.live_bytes = 0
+        self.garbage_bytes = 0
+        self.compactions = 0
+        self.evictions = 0
+    
+    def __len__(self) -> int:
+        return len(self.index)
+    
+    def _create_file(self):
+        """Open a new spill file private to this process; returns (file, path or None if already unlinked)"""
+        directory, name = os.path.split(os.path.abspath(self.base_path))
+        fd, path = tempfile.mkstemp(prefix=f"{name}.{os.getpid()}.", dir=directory)
+        spill_file = os.fdopen(fd, "w+b")
+        if os.name == "posix":
+            os.unlink(path)
+            path = None
+        return spill_file, path
+    
+    def _drop(self, conversation_id: str):
+        entry = self.index.pop(conversation_id, None)
+        if entry is not None:
+            self.live_bytes -= entry[1]
+            self.garbage_bytes += entry[1]
+        return entry
+    
+    def _read(self, entry: Tuple[int, int, float]) -> bytes:
+        self.file.seek(entry[0])
+        return self.file.read(entry[1])
+    
+    def put(self, conversation_id: str, blob: bytes, last_activity: float):
+        with self.lock:
+            self._drop(conversation_id)
+            self.file.seek(0, os.SEEK_END)
+            self.index[conversation_id] = (self.file.tell(), len(blob), last_activity)
+            self.file.write(blob)
+            self.live_bytes += len(blob)
+            while self.live_bytes > self.max_bytes and len(self.index) > 1:
+                self._drop(next(iter(self.index)))
+                self.evictions += 1
+            self._compact_if_needed()
+    
+    def take(self, conversation_id: str) -> bytes:
+        """Read a conversation's record and remove it from the tier"""
+        with self.lock:
+            entry = self._drop(conversation_id)
+            return self._read(entry) if entry is not None else None
+    
+    def discard_idle(self, conversation_id: str, cutoff: float) -> bool:
+        """Drop a spilled conversation if it was last active before cutoff"""
+        with self.lock:
+            entry = self.index.get(conversation_id)
+            if entry is None or entry[2] >= cutoff:
+                return False
+            self._drop(conversation_id)
+            return True
+    
+    def records(self):
+        """Yield (conversation_id, encoded record) for every spilled conversation"""
+        with self.lock:
+            conversation_ids = list(self.index)
+        for conversation_id in conversation_ids:
+            with self.lock:
+                entry = self.index.get(conversation_id)
+                blob = self._read(entry) if entry is not None else None
+            if blob is not None:
+                yield conversation_id, blob
+    
+    def maybe_compact(self) -> bool:
+        """Rewrite the file without garbage once garbage outweighs live records"""
+        with self.lock:
+            return self._compact_if_needed()
+    
+    def _compact_if_needed(self) -> bool:
+        if self.garbage_bytes < max(self.live_bytes, self.COMPACT_MIN_BYTES):
+            return False
+        compacted, compacted_path = self._create_file()
+        index = {}
+        for conversation_id, entry in self.index.items():
+            index[conversation_id] = (compacted.tell(), entry[1], entry[2])
+            compacted.write(self._read(entry))
+        compacted.flush()
+        self._close_file()
+        self.file, self.path = compacted, compacted_path
+        self.index = index
+        self.garbage_bytes = 0
+        self.compactions += 1
+        return True
+    
+    def stats(self) -> Dict:
+        return {
+            "conversations": len(self.index),
+            "live_bytes": self.live_bytes,
+            "file_bytes": self.live_bytes + self.garbage_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "compactions": self.compactions
+        }
+    
+    def _close_file(self):
+        self.file.close()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+    
+    def close(self):
+        with self.lock:
+            self._close_file()
+
+class ConversationStore:
+    """Storage backend interface behind ConversationManager
+
+    Backends hold conversation state; ConversationManager adds message
+    rendering and background expiry on top.
+    """
+    
+    backend_name = "base"
+    
+    def get_or_create_conversation(self, conversation_id: str) -> Conversation:
+        """Get or create a conversation, marking it active"""
+        raise NotImplementedError
+    
+    def set_user_name(self, conversation_id: str, name: str):
+        """Set user name for an existing conversation"""
+        raise NotImplementedError
+    
+    def get_user_name(self, conversation_id: str) -> str:
+        """Get user name for a conversation"""
+        raise NotImplementedError
+    
+    def add_message(self, conversation_id: str, message: Message):
+        """Append a message, keeping only the most recent history window"""
+        raise NotImplementedError
+    
+    def get_conversation_revision(self, conversation_id: str) -> str:
+        """Get a string that changes whenever the conversation does, or None if it does not exist"""
+        raise NotImplementedError
+    
+    def get_conversation_history(self, conversation_id: str, max_messages: int = CONVERSATION_HISTORY_SIZE) -> List[Dict]:
+        """Get the most recent messages as dicts, oldest first"""
+        raise NotImplementedError
+    
+    def get_full_conversation(self, conversation_id: str) -> Dict:
+        """Get full conversation data including all messages, or None"""
+        raise NotImplementedError
+    
+    def cleanup_old_conversations(self, max_age_hours: float) -> int:
+        """Remove conversations idle for longer than max_age_hours; returns how many were removed"""
+        raise NotImplementedError
+    
+    def count(self) -> int:
+        """Number of stored conversations"""
+        raise NotImplementedError
+    
+    def lock_stats(self) -> Dict:
+        return {}
+    
+    def memory_stats(self) -> Dict:
+        return {"live_conversations": self.count()}
+    
+    def get_summary(self, conversation_id: str) -> str:
+        raise NotImplementedError
+    
+    def get_summarized_through(self, conversation_id: str) -> float:
+        """Timestamp of the newest message already folded into the summary (0 if none)"""
+        raise NotImplementedError
+    
+    def set_summary(self, conversation_id: str, summary: str, summarized_through: float = 0.0):
+        """Store the rolling summary; does not count as conversation activity"""
+        raise NotImplementedError
+    
+    def spill_idle_conversations(self, idle_seconds: float) -> int:
+        """Move conversations idle for idle_seconds out of memory; returns how many moved"""
+        return 0
+    
+    def attach_snapshot(self, path: str):
+        """Restore conversations from a snapshot; persistent backends don't need one"""
+    
+    def save_snapshot(self, path: str) -> int:
+        """Write live conversations to a snapshot; returns how many were written"""
+        return 0
+    
+    def close(self):
+        """Flush pending writes and release resources"""
+
+class InMemoryConversationStore(ConversationStore):
+    """Per-process conversation store
+
+    Each conversation is guarded by one of a fixed set of striped locks, so
+    traffic on one conversation does not serialize everyone else. The
+    registry lock is only taken to add or remove conversations.
+
+    Approximate memory use is tracked per conversation; when the total goes
+    over the memory budget the least recently active conversations are evicted.
+    A single conversation over max_conversation_bytes loses its own oldest
+    messages instead, so one heavy client cannot push everyone else out.
+    With a spill path, idle and over-budget conversations are compressed into
+    a ColdConversationTier instead and rehydrated on their next access.
+    """
+    
+    backend_name = "memory"
+    
+    def __init__(self, lock_stripes: int = CONVERSATION_LOCK_STRIPES,
+                 expiry_interval_seconds: float = CONVERSATION_EXPIRY_INTERVAL_SECONDS,
+                 memory_budget_bytes: int = CONVERSATION_MEMORY_BUDGET_BYTES,
+                 spill_path: str = None,
+                 max_conversation_bytes: int = CONVERSATION_MAX_BYTES,
+                 cold_tier_max_bytes: int = CONVERSATION_COLD_TIER_MAX_BYTES):
         self.conversations = {}
+        self.registry_lock = Lock()
+        self.expiry_wheel = ExpiryWheel(expiry_interval_seconds)
+        self.stripes = [Lock() for _ in range(max(1, lock_stripes))]
+        # Per-stripe counters, only updated while holding that stripe's lock
+        self.lock_acquisitions = [0] * len(self.stripes)
+        self.lock_contentions = [0] * len(self.stripes)
+        # Recency order and byte totals for the memory budget
+        self.memory_budget_bytes = memory_budget_bytes
+        self.max_conversation_bytes = max_conversation_bytes
+        self.recency = OrderedDict()  # conversation_id -> None, least recently active first
+        self.recency_lock = Lock()
+        self.total_bytes = 0
+        self.lru_evictions = 0
+        # Disk tier for idle conversations
+        self.cold = ColdConversationTier(spill_path, cold_tier_max_bytes) if spill_path else None
+        self.spilled = 0
+        # Snapshots left by previous processes, restored lazily
+        self.snapshots = []
+        self.restored = {"snapshot": 0, "cold": 0}
+    
+    @contextmanager
+    def _locked(self, conversation_id: str):
+        """Hold the stripe lock for a conversation, counting contended acquisitions"""
+        index = hash(conversation_id) % len(self.stripes)
+        lock = self.stripes[index]
+        contended = not lock.acquire(blocking=False)
+        if contended:
+            lock.acquire()
+        try:
+            self.lock_acquisitions[index] += 1
+            if contended:
+                self.lock_contentions[index] += 1
+            yield
+        finally:
+            lock.release()
+    
+    def lock_stats(self) -> Dict:
+        """Lock striping counters for monitoring contention"""
+        acquisitions = sum(self.lock_acquisitions)
+        contentions = sum(self.lock_contentions)
+        return {
+            "stripes": len(self.stripes),
+            "acquisitions": acquisitions,
+            "contended": contentions,
+            "contention_rate": round(contentions / acquisitions, 4) if acquisitions else 0.0
+        }
+    
+    @staticmethod
+    def _message_bytes(message: Message) -> int:
+        """Rough resident size of a stored message"""
+        return MESSAGE_OVERHEAD_BYTES + len(message.content) + len(message.html or '')
+    
+    def _touch(self, conversation_id: str, timestamp: float, delta_bytes: int = 0):
+        """Record activity for expiry and LRU order, and account for size changes"""
+        self.expiry_wheel.touch(conversation_id, timestamp)
+        with self.recency_lock:
+            self.recency[conversation_id] = None
+            self.recency.move_to_end(conversation_id)
+            self.total_bytes += delta_bytes
+    
+    def _forget(self, conversation_id: str):
+        """Remove a conversation; caller must hold the registry lock"""
+        conv = self.conversations.pop(conversation_id, None)
+        with self.recency_lock:
+            self.recency.pop(conversation_id, None)
+            if conv is not None:
+                self.total_bytes -= conv.bytes
+        return conv
+    
+    def _enforce_memory_budget(self, keep_id: str = None):
+        """Evict least recently active conversations until usage fits the budget"""
+        while self.total_bytes > self.memory_budget_bytes:
+            with self.recency_lock:
+                victim = next((cid for cid in self.recency if cid != keep_id), None)
+            if victim is None:
+                return
+            if self.cold is not None and self._spill(victim):
+                continue
+            with self.registry_lock:
+                if self._forget(victim) is not None:
+                    self.lru_evictions += 1
+    
+    def _spill(self, conversation_id: str, cutoff: float = None) -> bool:
+        """Move a conversation to the disk tier, optionally only if idle since cutoff"""
+        with self._locked(conversation_id):
+            conv = self.conversations.get(conversation_id)
+            if conv is None or (cutoff is not None and conv.last_activity >= cutoff):
+                return False
+            try:
+                self.cold.put(conversation_id, ConversationSnapshot.encode_conversation(conv), conv.last_activity)
+            except Exception as e:
+                print(f"❌ Error spilling conversation to disk: {e}")
+                return False
+            with self.registry_lock:
+                self._forget(conversation_id)
+            self.spilled += 1
+        return True
+    
+    def spill_idle_conversations(self, idle_seconds: float) -> int:
+        if self.cold is None or idle_seconds <= 0:
+            return 0
+        cutoff = time.time() - idle_seconds
+        with self.recency_lock:
+            candidates = list(self.recency)
+        spilled = 0
+        # Recency order is least recently active first, so stop at the first active conversation
+        for conversation_id in candidates:
+            conv = self.conversations.get(conversation_id)
+            if conv is not None and conv.last_activity >= cutoff:
+                break
+            if self._spill(conversation_id, cutoff):
+                spilled += 1
+        self.cold.maybe_compact()
+        return spilled
+        
+    def _lookup(self, conversation_id: str) -> Conversation:
+        """Find a live conversation, restoring it from the pending snapshot if needed"""
+        conv = self.conversations.get(conversation_id)
+        if conv is None and self.cold is not None:
+            conv = self._restore(conversation_id, self.cold, "cold")
+        for snapshot in self.snapshots:
+            if conv is not None:
+                break
+            conv = self._restore(conversation_id, snapshot, "snapshot")
+        return conv
+    
+    def _current(self, conversation_id: str, conv: Conversation) -> Conversation:
+        """Re-check a looked-up conversation under its stripe lock; it may have been spilled since"""
+        current = self.conversations.get(conversation_id)
+        if current is None and self.cold is not None:
+            current = self._restore(conversation_id, self.cold, "cold", enforce_budget=False)
+        return current if current is not None else conv
+    
+    def _restore(self, conversation_id: str, source, kind: str, enforce_budget: bool = True) -> Conversation:
+        """Bring a conversation back from the disk tier or a snapshot"""
+        if source is None:
+            return None
+        try:
+            blob = source.take(conversation_id)
+            if blob is None:
+                return None
+            restored = ConversationSnapshot.decode_conversation(blob)
+        except Exception as e:
+            print(f"❌ Error restoring conversation from {kind}: {e}")
+            return None
+        restored.bytes = (
+            CONVERSATION_BASE_BYTES + len(conversation_id) + len(restored.user_name or '') + len(restored.summary or '')
+            + sum(self._message_bytes(m) for m in restored.messages)
+        )
+        with self.registry_lock:
+            conv = self.conversations.get(conversation_id)
+            if conv is not None:
+                return conv
+            self.conversations[conversation_id] = restored
+            self._touch(conversation_id, restored.last_activity, restored.bytes)
+            self.restored[kind] += 1
+        if enforce_budget:
+            self._enforce_memory_budget(keep_id=conversation_id)
+        return restored
+    
+    def attach_snapshot(self, path: str):
+        """Serve conversations from previous snapshots, hydrating them in the background"""
+        snapshots = ConversationSnapshot.claim(path)
+        if not snapshots:
+            return
+        self.snapshots = snapshots
+        print(f"📂 Restoring {sum(s.record_count for s in snapshots)} conversations from {len(snapshots)} snapshot(s) in the background")
+        
+        def hydrate():
+            try:
+                for snapshot in snapshots:
+                    # The newest snapshot wins when a conversation appears in several
+                    for conversation_id in snapshot.pending_ids():
+                        self._restore(conversation_id, snapshot, "snapshot")
+                    snapshot.discard()
+            except Exception as e:
+                print(f"❌ Error hydrating conversation snapshot: {e}")
+            finally:
+                self.snapshots = []
+        
+        Thread(target=hydrate, name="conversation-snapshot-restore", daemon=True).start()
+    
+    def save_snapshot(self, path: str) -> int:
+        """Write this process's conversations to path.<pid>"""
+        with self.registry_lock:
+            items = list(self.conversations.items())
+        records = []
+        for conversation_id, conv in items:
+            with self._locked(conversation_id):
+                records.append((conversation_id, ConversationSnapshot.encode_conversation(conv)))
+        if self.cold is not None:
+            records.extend(self.cold.records())
+        # Carry over anything from claimed snapshots that was never restored
+        known = {conversation_id for conversation_id, _ in records}
+        for snapshot in self.snapshots:
+            for item in snapshot.pending_records():
+                if item[0] not in known:
+                    known.add(item[0])
+                    records.append(item)
+        written = ConversationSnapshot.write(f"{path}.{os.getpid()}", records)
+        for snapshot in self.snapshots:
+            snapshot.discard()
+        return written
+    
+    def get_or_create_conversation(self, conversation_id: str) -> Conversation:
+        conv = self._lookup(conversation_id)
+        if conv is None:
+            with self.registry_lock:
+                conv = self.conversations.get(conversation_id)
+                if conv is None:
+                    conv = Conversation(time.time())
+                    conv.bytes = CONVERSATION_BASE_BYTES + len(conversation_id)
+                    self.conversations[conversation_id] = conv
+                    self._touch(conversation_id, conv.last_activity, conv.bytes)
+            self._enforce_memory_budget(keep_id=conversation_id)
+            return conv
+        with self._locked(conversation_id):
+            conv = self._current(conversation_id, conv)
+            conv.last_activity = time.time()
+        self._touch(conversation_id, conv.last_activity)
+        return conv
+    
+    def set_user_name(self, conversation_id: str, name: str):
+        conv = self._lookup(conversation_id)
+        if conv is None:
+            return
+        with self._locked(conversation_id):
+            conv = self._current(conversation_id, conv)
+            delta = len(name) - len(conv.user_name or '')
+            conv.user_name = name
+            conv.last_activity = time.time()
+            conv.version += 1
+            conv.bytes += delta
+        self._touch(conversation_id, conv.last_activity, delta)
+    
+    def get_user_name(self, conversation_id: str) -> str:
+        conv = self._lookup(conversation_id)
+        return conv.user_name if conv else None
+    
+    def get_summary(self, conversation_id: str) -> str:
+        conv = self._lookup(conversation_id)
+        return conv.summary if conv else None
+    
+    def get_summarized_through(self, conversation_id: str) -> float:
+        conv = self._lookup(conversation_id)
+        return conv.summarized_through if conv else 0.0
+    
+    def set_summary(self, conversation_id: str, summary: str, summarized_through: float = 0.0):
+        conv = self._lookup(conversation_id)
+        if conv is None:
+            return
+        with self._locked(conversation_id):
+            conv = self._current(conversation_id, conv)
+            delta = len(summary or '') - len(conv.summary or '')
+            conv.summary = summary
+            conv.summarized_through = summarized_through
+            conv.bytes += delta
+        with self.recency_lock:
+            self.total_bytes += delta
+    
+    def add_message(self, conversation_id: str, message: Message):
+        conv = self._lookup(conversation_id)
+        if conv is None:
+            return
+        with self._locked(conversation_id):
+            conv = self._current(conversation_id, conv)
+            delta = self._message_bytes(message)
+            # Only the last CONVERSATION_HISTORY_SIZE messages are kept to avoid token limits
+            if len(conv.messages) == conv.messages.maxlen:
+                delta -= self._message_bytes(conv.messages[0])
+            conv.messages.append(message)
+            while conv.bytes + delta > self.max_conversation_bytes and len(conv.messages) > 1:
+                delta -= self._message_bytes(conv.messages.popleft())
+            conv.last_activity = time.time()
+            conv.version += 1
+            conv.bytes += delta
+        self._touch(conversation_id, conv.last_activity, delta)
+        if delta > 0:
+            self._enforce_memory_budget(keep_id=conversation_id)
+    
+    def get_conversation_revision(self, conversation_id: str) -> str:
+        conv = self._lookup(conversation_id)
+        if conv is None:
+            return None
+        with self._locked(conversation_id):
+            return f"{conv.created_at}:{conv.version}"
+    
+    def get_conversation_history(self, conversation_id: str, max_messages: int = CONVERSATION_HISTORY_SIZE) -> List[Dict]:
+        conv = self._lookup(conversation_id)
+        if conv is None:
+            return []
+        with self._locked(conversation_id):
+            recent = list(conv.messages)[-max_messages:] if max_messages > 0 else []
+        return [message.to_dict() for message in recent]
+    
+    def get_full_conversation(self, conversation_id: str) -> Dict:
+        conv = self._lookup(conversation_id)
+        if conv is None:
+            return None
+        with self._locked(conversation_id):
+            messages = list(conv.messages)
+            data = {
+                'user_name': conv.user_name,
+                'created_at': conv.created_at,
+                'last_activity': conv.last_activity,
+                'revision': f"{conv.created_at}:{conv.version}"
+            }
+        data['messages'] = [message.to_dict() for message in messages]
+        return data
+    
+    def cleanup_old_conversations(self, max_age_hours: float) -> int:
+        max_age = max_age_hours * 3600
+        current_time = time.time()
+        removed = 0
+        # Only conversations whose last touch fell in a bucket that is now due can be expired
+        for conv_id in self.expiry_wheel.pop_due(current_time - max_age):
+            with self.registry_lock:
+                conv_data = self.conversations.get(conv_id)
+                if conv_data is not None and current_time - conv_data.last_activity > max_age:
+                    self._forget(conv_id)
+                    removed += 1
+                    continue
+            # Spilled conversations stay on the wheel and expire from the disk tier
+            if conv_data is None and self.cold is not None and self.cold.discard_idle(conv_id, current_time - max_age):
+                removed += 1
+        return removed
+    
+    def count(self) -> int:
+        return len(self.conversations) + (len(self.cold) if self.cold is not None else 0)
+    
+    def memory_stats(self) -> Dict:
+        """Approximate memory usage of the conversation store"""
+        live = len(self.conversations)
+        return {
+            "live_conversations": live,
+            "approx_bytes": self.total_bytes,
+            "budget_bytes": self.memory_budget_bytes,
+            "max_conversation_bytes": self.max_conversation_bytes,
+            "utilization": round(self.total_bytes / self.memory_budget_bytes, 4) if self.memory_budget_bytes else 0.0,
+            "avg_bytes_per_conversation": self.total_bytes // live if live else 0,
+            "lru_evictions": self.lru_evictions,
+            "restored_from_snapshot": self.restored["snapshot"],
+            "snapshot_restore_pending": bool(self.snapshots),
+            "spilled_to_disk": self.spilled,
+            "rehydrated_from_disk": self.restored["cold"],
+            "disk_tier": self.cold.stats() if self.cold is not None else None
+        }
+    
+    def close(self):
+        if self.cold is not None:
+            self.cold.close()
+
+class SQLiteConversationStore(ConversationStore):
+    """Conversation store in a SQLite database in WAL mode, shared by every worker on a node
+
+    Writes are queued to a single writer thread and committed together in one
+    transaction per batch (group commit); callers wait for their batch to
+    commit, so reads always see their own writes. Reads check a connection
+    out of a small pool, so its statement cache keeps the fixed SQL below
+    prepared across requests whatever thread serves them.
+    """
+    
+    backend_name = "sqlite"
+    
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS conversations (
+            conversation_id TEXT PRIMARY KEY,
+            user_name TEXT,
+            created_at REAL NOT NULL,
+            last_activity REAL NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            summary TEXT,
+            summarized_through REAL NOT NULL DEFAULT 0
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_conversations_last_activity ON conversations (last_activity)",
+        """CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            html TEXT,
+            timestamp REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id)",
+    ]
+    
+    SQL_GET_CONVERSATION = "SELECT user_name, created_at, last_activity, version FROM conversations WHERE conversation_id = ?"
+    SQL_CREATE_CONVERSATION = "INSERT OR IGNORE INTO conversations (conversation_id, user_name, created_at, last_activity, version) VALUES (?, NULL, ?, ?, 0)"
+    SQL_TOUCH_CONVERSATION = "UPDATE conversations SET last_activity = MAX(last_activity, ?) WHERE conversation_id = ?"
+    SQL_SET_USER_NAME = "UPDATE conversations SET user_name = ?, last_activity = ?, version = version + 1 WHERE conversation_id = ?"
+    SQL_BUMP_CONVERSATION = "UPDATE conversations SET last_activity = ?, version = version + 1 WHERE conversation_id = ?"
+    SQL_INSERT_MESSAGE = "INSERT INTO messages (conversation_id, role, content, html, timestamp) SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM conversations WHERE conversation_id = ?)"
+    SQL_TRIM_MESSAGES = """DELETE FROM messages WHERE conversation_id = ? AND id <= (
+        SELECT id FROM messages WHERE conversation_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)"""
+    SQL_RECENT_MESSAGES = "SELECT role, content, html, timestamp FROM messages WHERE conversation_id = ? ORDER BY id DESC LIMIT ?"
+    SQL_EXPIRE_MESSAGES = "DELETE FROM messages WHERE conversation_id IN (SELECT conversation_id FROM conversations WHERE last_activity < ?)"
+    SQL_EXPIRE_CONVERSATIONS = "DELETE FROM conversations WHERE last_activity < ?"
+    SQL_COUNT = "SELECT COUNT(*) FROM conversations"
+    SQL_GET_SUMMARY = "SELECT summary, summarized_through FROM conversations WHERE conversation_id = ?"
+    SQL_SET_SUMMARY = "UPDATE conversations SET summary = ?, summarized_through = ? WHERE conversation_id = ?"
+    
+    def __init__(self, path: str = CONVERSATION_DB_PATH,
+                 history_size: int = CONVERSATION_HISTORY_SIZE,
+                 batch_window_ms: float = SQLITE_BATCH_WINDOW_MS,
+                 batch_max_ops: int = 256,
+                 reader_pool_size: int = SQLITE_READER_POOL_SIZE):
+        self.path = path
+        self.history_size = history_size
+        self.batch_window = batch_window_ms / 1000.0
+        self.batch_max_ops = batch_max_ops
+        self.reader_pool_size = reader_pool_size
+        self.idle_readers = []
+        self.readers_lock = Lock()
+        self.readers_opened = 0
+        self.closed = False
+        self.write_queue = queue.Queue()
+        self.batches_committed = 0
+        self.ops_committed = 0
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        # WAL lets readers in every worker proceed while one writer commits
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            # Databases created before summaries existed need the columns added
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(conversations)")}
+            if "summary" not in columns:
+                conn.execute("ALTER TABLE conversations ADD COLUMN summary TEXT")
+            if "summarized_through" not in columns:
+                conn.execute("ALTER TABLE conversations ADD COLUMN summarized_through REAL NOT NULL DEFAULT 0")
+        conn.close()
+        
+        self.writer = Thread(target=self._writer_loop, name="sqlite-conversation-writer", daemon=True)
+        self.writer.start()
+    
+    def _connect(self) -> sqlite3.Connection:
+        # Pooled readers move between request threads, one at a time
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=64,
+                               check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+    
+    @contextmanager
+    def _reader(self):
+        """Check a read connection out of the pool, opening one if none is idle"""
+        with self.readers_lock:
+            conn = self.idle_readers.pop() if self.idle_readers else None
+            if conn is None:
+                self.readers_opened += 1
+        if conn is None:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            with self.readers_lock:
+                if not self.closed and len(self.idle_readers) < self.reader_pool_size:
+                    self.idle_readers.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+    
+    def _write(self, operations: List[Tuple[str, tuple]], wait: bool = True):
+        """Queue statements to run in the next batch, optionally waiting for the commit"""
+        done = Event() if wait else None
+        item = {"operations": operations, "done": done, "error": None}
+        self.write_queue.put(item)
+        if wait:
+            done.wait()
+            if item["error"] is not None:
+                raise item["error"]
+    
+    def _writer_loop(self):
+        conn = self._connect()
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            # Gather whatever else arrives within the batch window
+            deadline = time.time() + self.batch_window
+            stop = False
+            while len(batch) < self.batch_max_ops:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    extra = self.write_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if extra is None:
+                    stop = True
+                    break
+                batch.append(extra)
+            
+            self._commit_batch(conn, batch)
+            if stop:
+                break
+        conn.close()
+    
+    def _commit_batch(self, conn: sqlite3.Connection, batch: List[Dict]):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for item in batch:
+                for sql, params in item["operations"]:
+                    conn.execute(sql, params)
+            conn.execute("COMMIT")
+            self.batches_committed += 1
+            self.ops_committed += len(batch)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            if len(batch) > 1:
+                # Retry one by one so a bad write only fails its own caller
+                for item in batch:
+                    self._commit_batch(conn, [item])
+                return
+            print(f"❌ Error writing conversation batch: {e}")
+            batch[0]["error"] = e
+        for item in batch:
+            if item["done"] is not None:
+                item["done"].set()
+    
+    def get_or_create_conversation(self, conversation_id: str) -> Conversation:
+        now = time.time()
+        with self._reader() as conn:
+            row = conn.execute(self.SQL_GET_CONVERSATION, (conversation_id,)).fetchone()
+        if row is None:
+            self._write([(self.SQL_CREATE_CONVERSATION, (conversation_id, now, now))])
+            with self._reader() as conn:
+                row = conn.execute(self.SQL_GET_CONVERSATION, (conversation_id,)).fetchone()
+        else:
+            # Activity bumps don't need to be durable before we carry on
+            self._write([(self.SQL_TOUCH_CONVERSATION, (now, conversation_id))], wait=False)
+        conv = Conversation(row[1], self.history_size)
+        conv.user_name = row[0]
+        conv.last_activity = max(row[2], now)
+        conv.version = row[3]
+        return conv
+    
+    def set_user_name(self, conversation_id: str, name: str):
+        self._write([(self.SQL_SET_USER_NAME, (name, time.time(), conversation_id))])
+    
+    def get_user_name(self, conversation_id: str) -> str:
+        with self._reader() as conn:
+            row = conn.execute(self.SQL_GET_CONVERSATION, (conversation_id,)).fetchone()
+        return row[0] if row else None
+    
+    def get_summary(self, conversation_id: str) -> str:
+        with self._reader() as conn:
+            row = conn.execute(self.SQL_GET_SUMMARY, (conversation_id,)).fetchone()
+        return row[0] if row else None
+    
+    def get_summarized_through(self, conversation_id: str) -> float:
+        with self._reader() as conn:
+            row = conn.execute(self.SQL_GET_SUMMARY, (conversation_id,)).fetchone()
+        return row[1] if row else 0.0
+    
+    def set_summary(self, conversation_id: str, summary: str, summarized_through: float = 0.0):
+        self._write([(self.SQL_SET_SUMMARY, (summary, summarized_through, conversation_id))])
+    
+    def add_message(self, conversation_id: str, message: Message):
+        self._write([
+            (self.SQL_INSERT_MESSAGE, (conversation_id, message.role, message.content, message.html, message.timestamp, conversation_id)),
+            (self.SQL_TRIM_MESSAGES, (conversation_id, conversation_id, self.history_size)),
+            (self.SQL_BUMP_CONVERSATION, (message.timestamp, conversation_id)),
+        ])
+    
+    def get_conversation_revision(self, conversation_id: str) -> str:
+        with self._reader() as conn:
+            row = conn.execute(self.SQL_GET_CONVERSATION, (conversation_id,)).fetchone()
+        return f"{row[1]}:{row[3]}" if row else None
+    
+    def _recent_messages(self, conn: sqlite3.Connection, conversation_id: str, limit: int) -> List[Dict]:
+        rows = conn.execute(self.SQL_RECENT_MESSAGES, (conversation_id, limit)).fetchall()
+        return [
+            {'role': role, 'content': content, 'html': html, 'timestamp': timestamp}
+            for role, content, html, timestamp in reversed(rows)
+        ]
+    
+    def get_conversation_history(self, conversation_id: str, max_messages: int = CONVERSATION_HISTORY_SIZE) -> List[Dict]:
+        if max_messages <= 0:
+            return []
+        with self._reader() as conn:
+            return self._recent_messages(conn, conversation_id, max_messages)
+    
+    def get_full_conversation(self, conversation_id: str) -> Dict:
+        with self._reader() as conn:
+            # One read transaction so the row and its messages are consistent
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute(self.SQL_GET_CONVERSATION, (conversation_id,)).fetchone()
+                if row is None:
+                    return None
+                messages = self._recent_messages(conn, conversation_id, self.history_size)
+            finally:
+                conn.execute("COMMIT")
+        return {
+            'user_name': row[0],
+            'created_at': row[1],
+            'last_activity': row[2],
+            'revision': f"{row[1]}:{row[3]}",
+            'messages': messages
+        }
+    
+    def cleanup_old_conversations(self, max_age_hours: float) -> int:
+        cutoff = time.time() - max_age_hours * 3600
+        before = self.count()
+        self._write([
+            (self.SQL_EXPIRE_MESSAGES, (cutoff,)),
+            (self.SQL_EXPIRE_CONVERSATIONS, (cutoff,)),
+        ])
+        return max(0, before - self.count())
+    
+    def count(self) -> int:
+        with self._reader() as conn:
+            return conn.execute(self.SQL_COUNT).fetchone()[0]
+    
+    def memory_stats(self) -> Dict:
+        """Storage usage of the SQLite database"""
+        size = 0
+        for suffix in ("", "-wal"):
+            try:
+                size += os.path.getsize(self.path + suffix)
+            except OSError:
+                pass
+        return {
+            "live_conversations": self.count(),
+            "database_bytes": size,
+            "reader_connections_opened": self.readers_opened,
+            "write_batches": self.batches_committed,
+            "writes": self.ops_committed,
+            "avg_writes_per_batch": round(self.ops_committed / self.batches_committed, 2) if self.batches_committed else 0.0
+        }
+    
+    def close(self):
+        self.write_queue.put(None)
+        self.writer.join(timeout=5)
+        with self.readers_lock:
+            self.closed = True
+            idle, self.idle_readers = self.idle_readers, []
+        for conn in idle:
+            conn.close()
+
+class RedisConversationStore(ConversationStore):
+    """Conversation store on a Redis-protocol server, shared across nodes
+
+    Each conversation is a hash plus a list of JSON-encoded messages. Writes
+    are pipelined, the list is trimmed to the history window with LTRIM and
+    both keys carry a TTL of the conversation max age, so Redis does the
+    expiry. Writes to an existing conversation WATCH its hash, so a
+    conversation that expired in the meantime is not recreated half-empty.
+    A small local read-through cache with a short TTL absorbs repeated
+    reads; local writes invalidate it.
+
+    Any redis-py compatible client (for example fakeredis in tests) can be
+    passed as ``client``.
+    """
+    
+    backend_name = "redis"
+    
+    def __init__(self, url: str = REDIS_URL, client=None,
+                 key_prefix: str = REDIS_KEY_PREFIX,
+                 history_size: int = CONVERSATION_HISTORY_SIZE,
+                 ttl_seconds: float = CONVERSATION_MAX_AGE_HOURS * 3600,
+                 local_cache_size: int = REDIS_LOCAL_CACHE_SIZE,
+                 local_cache_ttl_seconds: float = REDIS_LOCAL_CACHE_TTL_SECONDS):
+        if client is None:
+            import redis  # Only needed when this backend is selected
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.key_prefix = key_prefix
+        self.history_size = history_size
+        self.ttl_seconds = max(1, int(ttl_seconds))
+        self.local_cache_size = local_cache_size
+        self.local_cache_ttl_seconds = local_cache_ttl_seconds
+        self.local_cache = OrderedDict()  # conversation_id -> (fetched_at, full conversation or None)
+        self.local_cache_lock = Lock()
+        self.local_hits = 0
+        self.local_misses = 0
+        self.cached_count = (0.0, 0)
+    
+    def _conv_key(self, conversation_id: str) -> str:
+        return f"{self.key_prefix}:conv:{conversation_id}"
+    
+    def _messages_key(self, conversation_id: str) -> str:
+        return f"{self.key_prefix}:conv:{conversation_id}:messages"
+    
+    @staticmethod
+    def _decode(value):
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+    
+    def _invalidate(self, conversation_id: str):
+        with self.local_cache_lock:
+            self.local_cache.pop(conversation_id, None)
+    
+    def _expire(self, pipe, conversation_id: str):
+        pipe.expire(self._conv_key(conversation_id), self.ttl_seconds)
+        pipe.expire(self._messages_key(conversation_id), self.ttl_seconds)
+    
+    def _update_existing(self, conversation_id: str, queue_writes) -> bool:
+        """Run queue_writes(pipe) in a transaction only if the conversation exists; returns whether it did"""
+        from redis.exceptions import WatchError
+        key = self._conv_key(conversation_id)
+        with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    if not pipe.exists(key):
+                        return False
+                    pipe.multi()
+                    queue_writes(pipe)
+                    self._expire(pipe, conversation_id)
+                    pipe.execute()
+                    break
+                except WatchError:
+                    continue  # Changed or expired under us; check again
+        self._invalidate(conversation_id)
+        return True
+    
+    def _to_full(self, fields: Dict, raw_messages: List) -> Dict:
+        if not fields:
+            return None
+        fields = {self._decode(k): self._decode(v) for k, v in fields.items()}
+        messages = [json.loads(self._decode(raw)) for raw in raw_messages]
+        created_at = float(fields.get('created_at', 0))
+        version = int(fields.get('version', 0))
+        return {
+            'user_name': fields.get('user_name') or None,
+            'created_at': created_at,
+            'last_activity': float(fields.get('last_activity', created_at)),
+            'revision': f"{created_at}:{version}",
+            'summary': fields.get('summary') or None,
+            'summarized_through': float(fields.get('summarized_through', 0)),
+            'messages': messages
+        }
+    
+    def _load(self, conversation_id: str) -> Dict:
+        """Full conversation through the local read-through cache"""
+        now = time.time()
+        with self.local_cache_lock:
+            entry = self.local_cache.get(conversation_id)
+            if entry is not None and now - entry[0] <= self.local_cache_ttl_seconds:
+                self.local_cache.move_to_end(conversation_id)
+                self.local_hits += 1
+                return entry[1]
+            self.local_misses += 1
+        
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(self._conv_key(conversation_id))
+        pipe.lrange(self._messages_key(conversation_id), 0, -1)
+        fields, raw_messages = pipe.execute()
+        data = self._to_full(fields, raw_messages)
+        
+        if self.local_cache_size > 0:
+            with self.local_cache_lock:
+                self.local_cache[conversation_id] = (now, data)
+                self.local_cache.move_to_end(conversation_id)
+                while len(self.local_cache) > self.local_cache_size:
+                    self.local_cache.popitem(last=False)
+        return data
+    
+    def get_or_create_conversation(self, conversation_id: str) -> Conversation:
+        now = time.time()
+        key = self._conv_key(conversation_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hsetnx(key, 'created_at', now)
+        pipe.hsetnx(key, 'version', 0)
+        pipe.hset(key, 'last_activity', now)
+        self._expire(pipe, conversation_id)
+        pipe.hgetall(key)
+        fields = pipe.execute()[-1]
+        self._invalidate(conversation_id)
+        
+        fields = {self._decode(k): self._decode(v) for k, v in fields.items()}
+        conv = Conversation(float(fields['created_at']), self.history_size)
+        conv.user_name = fields.get('user_name') or None
+        conv.last_activity = float(fields['last_activity'])
+        conv.version = int(fields['version'])
+        return conv
+    
+    def set_user_name(self, conversation_id: str, name: str):
+        key = self._conv_key(conversation_id)
+        
+        def queue_writes(pipe):
+            pipe.hset(key, mapping={'user_name': name, 'last_activity': time.time()})
+            pipe.hincrby(key, 'version', 1)
+        
+        self._update_existing(conversation_id, queue_writes)
+    
+    def get_user_name(self, conversation_id: str) -> str:
+        data = self._load(conversation_id)
+        return data['user_name'] if data else None
+    
+    def get_summary(self, conversation_id: str) -> str:
+        data = self._load(conversation_id)
+        return data['summary'] if data else None
+    
+    def get_summarized_through(self, conversation_id: str) -> float:
+        data = self._load(conversation_id)
+        return data['summarized_through'] if data else 0.0
+    
+    def set_summary(self, conversation_id: str, summary: str, summarized_through: float = 0.0):
+        key = self._conv_key(conversation_id)
+        self._update_existing(
+            conversation_id,
+            lambda pipe: pipe.hset(key, mapping={'summary': summary or '', 'summarized_through': summarized_through})
+        )
+    
+    def add_message(self, conversation_id: str, message: Message):
+        key = self._conv_key(conversation_id)
+        messages_key = self._messages_key(conversation_id)
+        
+        def queue_writes(pipe):
+            pipe.rpush(messages_key, json.dumps(message.to_dict()))
+            # Native trimming keeps only the history window
+            pipe.ltrim(messages_key, -self.history_size, -1)
+            pipe.hset(key, 'last_activity', message.timestamp)
+            pipe.hincrby(key, 'version', 1)
+        
+        self._update_existing(conversation_id, queue_writes)
+    
+    def get_conversation_revision(self, conversation_id: str) -> str:
+        data = self._load(conversation_id)
+        return data['revision'] if data else None
+    
+    def get_conversation_history(self, conversation_id: str, max_messages: int = CONVERSATION_HISTORY_SIZE) -> List[Dict]:
+        data = self._load(conversation_id)
+        if not data or max_messages <= 0:
+            return []
+        return data['messages'][-max_messages:]
+    
+    def get_full_conversation(self, conversation_id: str) -> Dict:
+        data = self._load(conversation_id)
+        return dict(data, messages=list(data['messages'])) if data else None
+    
+    def cleanup_old_conversations(self, max_age_hours: float) -> int:
+        # Key TTLs expire idle conversations inside Redis; just drop stale local entries
+        cutoff = time.time() - self.local_cache_ttl_seconds
+        with self.local_cache_lock:
+            for conversation_id in [cid for cid, (fetched_at, _) in self.local_cache.items() if fetched_at < cutoff]:
+                del self.local_cache[conversation_id]
+        return 0
+    
+    def count(self) -> int:
+        # SCAN is O(keys), so refresh the count at most every 30 seconds
+        counted_at, total = self.cached_count
+        if time.time() - counted_at > 30:
+            pattern = f"{self.key_prefix}:conv:*"
+            total = sum(1 for key in self.client.scan_iter(match=pattern, count=1000)
+                        if not self._decode(key).endswith(":messages"))
+            self.cached_count = (time.time(), total)
+        return total
+    
+    def memory_stats(self) -> Dict:
+        lookups = self.local_hits + self.local_misses
+        return {
+            "live_conversations": self.count(),
+            "local_cache_size": len(self.local_cache),
+            "local_cache_hits": self.local_hits,
+            "local_cache_misses": self.local_misses,
+            "local_cache_hit_rate": round(self.local_hits / lookups, 4) if lookups else 0.0
+        }
+    
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+class ConversationSummarizer:
+    """Folds messages that are no longer sent to Claude into a rolling summary, off the request path
+
+    Messages are queued per conversation and a worker thread merges them into
+    the stored summary, either with Claude ("llm") or with a local extractive
+    stand-in ("local"). The store remembers the timestamp of the newest folded
+    message, so a message queued twice (or by two workers) is folded once. A
+    failed Claude call falls back to the local summary so nothing is lost.
+    """
+    
+    SYSTEM_PROMPT = (
+        "You maintain a running summary of a VREG vehicle registration support chat. "
+        "Merge the earlier messages into the current summary. Keep the user's problem, "
+        "what they already tried, and any advice given. Plain text, at most 5 short lines."
+    )
+    
+    def __init__(self, store: ConversationStore, mode: str = CONVERSATION_SUMMARY_MODE,
+                 max_chars: int = CONVERSATION_SUMMARY_MAX_CHARS,
+                 max_pending: int = 10000, llm_client=None):
+        self.store = store
+        self.mode = mode
+        self.max_chars = max_chars
+        self.max_pending = max_pending
+        self.llm_client = llm_client
+        self.pending = OrderedDict()  # conversation_id -> messages waiting to be folded
         self.lock = Lock()
+        self.wakeup = Event()
+        self.worker = None
+        self.folded = 0
+        self.dropped = 0
+        self.llm_failures = 0
+    
+    def start(self):
+        if self.worker is None:
+            self.worker = Thread(target=self._run, name="conversation-summarizer", daemon=True)
+            self.worker.start()
+    
+    def submit(self, conversation_id: str, messages: List[Dict]):
+        """Queue messages, oldest first, that are no longer sent with prompts"""
+        with self.lock:
+            queued = self.pending.setdefault(conversation_id, [])
+            for message in messages:
+                if not queued or message['timestamp'] > queued[-1]['timestamp']:
+                    queued.append(message)
+            if len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            self.wakeup.set()
+    
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                if not self.pending:
+                    self.wakeup.clear()
+                    continue
+                conversation_id, messages = self.pending.popitem(last=False)
+            try:
+                self.fold(conversation_id, messages)
+            except Exception as e:
+                print(f"❌ Error summarizing conversation: {e}")
+    
+    def fold(self, conversation_id: str, messages: List[Dict]):
+        """Merge messages into the conversation's stored summary"""
+        summarized_through = self.store.get_summarized_through(conversation_id)
+        messages = [msg for msg in messages if msg['timestamp'] > summarized_through]
+        if not messages:
+            return
+        summary = self.store.get_summary(conversation_id)
+        updated = None
+        if self.mode == "llm":
+            try:
+                updated = self._llm_summary(summary, messages)
+            except Exception as e:
+                self.llm_failures += 1
+                print(f"⚠️ LLM summary failed, using local summary: {e}")
+        if not updated:
+            updated = self.local_summary(summary, messages, self.max_chars)
+        self.store.set_summary(conversation_id, updated, messages[-1]['timestamp'])
+        self.folded += len(messages)
+    
+    def _llm_summary(self, summary: str, messages: List[Dict]) -> str:
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        # Background work only takes a free LLM slot, never a place in the queue
+        with llm_dispatcher.slot(wait=False):
+            response = llm_resilience.call(lambda timeout: (self.llm_client or client).messages.create(
+                model=CLAUDE_MODEL,
+                max_tokens=CONVERSATION_SUMMARY_MAX_TOKENS,
+                temperature=0,
+                system=self.SYSTEM_PROMPT,
+                messages=[{
+                    "role": "user",
+                    "content": f"Current summary:\n{summary or '(none)'}\n\nEarlier messages:\n{transcript}"
+                }],
+                timeout=timeout
+            ), hedge=False)
+        return response.content[0].text.strip()[:self.max_chars]
+    
+    @staticmethod
+    def local_summary(summary: str, messages: List[Dict], max_chars: int) -> str:
+        """Extractive summary: the first sentence of each message, keeping the newest lines"""
+        lines = summary.split("\n") if summary else []
+        for msg in messages:
+            first_sentence = re.split(r"(?<=[.!?])\s", " ".join(msg['content'].split()), maxsplit=1)[0]
+            speaker = "User" if msg['role'] == "user" else "Assistant"
+            lines.append(f"{speaker}: {first_sentence[:200]}")
+        while len(lines) > 1 and sum(len(line) + 1 for line in lines) > max_chars:
+            lines.pop(0)
+        return "\n".join(lines)[:max_chars]
+    
+    def stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "pending_conversations": len(self.pending),
+            "messages_folded": self.folded,
+            "dropped": self.dropped,
+            "llm_failures": self.llm_failures
+        }
+
+class ConversationManager:
+    """Manage conversation state including user names and message history
+
+    State lives in a pluggable ConversationStore; the manager renders
+    message HTML and runs background expiry on top of it.
+    """
+    
+    def __init__(self, store: ConversationStore = None,
+                 max_age_hours: float = CONVERSATION_MAX_AGE_HOURS,
+                 expiry_interval_seconds: float = CONVERSATION_EXPIRY_INTERVAL_SECONDS,
+                 spill_idle_seconds: float = CONVERSATION_SPILL_IDLE_SECONDS,
+                 summary_mode: str = CONVERSATION_SUMMARY_MODE):
+        self.store = store if store is not None else create_conversation_store()
+        self.summarizer = None
+        if summary_mode in ("llm", "local"):
+            self.summarizer = ConversationSummarizer(self.store, summary_mode)
+            self.summarizer.start()
+        elif summary_mode != "off":
+            print(f"⚠️ Unknown CONVERSATION_SUMMARY_MODE '{summary_mode}', summaries disabled")
+        self.max_age_hours = max_age_hours
+        self.expiry_interval_seconds = expiry_interval_seconds
+        self.spill_idle_seconds = spill_idle_seconds
+        self.evictions = 0
+        self.expiry_thread = None
+        self.expiry_stop = Event()
+        self.snapshot_path = None
+        self.shutdown_requested = Event()
+        self.snapshot_saved = Event()
         
-    def get_or_create_conversation(self, conversation_id: str) -> Dict:
+    def get_or_create_conversation(self, conversation_id: str) -> Conversation:
         """Get or create a conversation"""
-        with self.lock:
-            if conversation_id not in self.conversations:
-                self.conversations[conversation_id] = {
-                    'user_name': None,
-                    'created_at': time.time(),
-                    'last_activity': time.time(),
-                    'messages': []  # 🆕 Added: Store conversation history
-                }
-            else:
-                self.conversations[conversation_id]['last_activity'] = time.time()
-            return self.conversations[conversation_id]
+        return self.store.get_or_create_conversation(conversation_id)
     
     def set_user_name(self, conversation_id: str, name: str):
         """Set user name for a conversation"""
-        with self.lock:
-            if conversation_id in self.conversations:
-                self.conversations[conversation_id]['user_name'] = name
-                self.conversations[conversation_id]['last_activity'] = time.time()
+        self.store.set_user_name(conversation_id, name)
     
     def get_user_name(self, conversation_id: str) -> str:
         """Get user name for a conversation"""
-        with self.lock:
-            conv = self.conversations.get(conversation_id)
-            return conv['user_name'] if conv else None
+        return self.store.get_user_name(conversation_id)
     
     def add_message(self, conversation_id: str, role: str, content: str):
         """🆕 Added: Add a message to conversation history"""
-        with self.lock:
-            if conversation_id in self.conversations:
-                self.conversations[conversation_id]['messages'].append({
-                    'role': role,
-                    'content': content,
-                    'timestamp': time.time()
-                })
-                # Keep only last 10 messages to avoid token limits
-                if len(self.conversations[conversation_id]['messages']) > 10:
-                    self.conversations[conversation_id]['messages'] = \
-                        self.conversations[conversation_id]['messages'][-10:]
-                self.conversations[conversation_id]['last_activity'] = time.time()
+        # Render hyperlinks once at write time so reads can reuse the HTML
+        html = HyperlinkProcessor.convert_to_hyperlinks(content)
+        if self.summarizer is not None:
+            # The oldest message is about to leave the window; fold it into the summary
+            window = self.store.get_conversation_history(conversation_id, CONVERSATION_HISTORY_SIZE)
+            if len(window) >= CONVERSATION_HISTORY_SIZE:
+                self.summarizer.submit(conversation_id, window[:1])
+        self.store.add_message(conversation_id, Message(role, content, html, time.time()))
+    
+    def fold_unsent_history(self, conversation_id: str, conversation_history: List[Dict], token_usage: Dict = None):
+        """Summarize the older turns a prompt had to leave out to fit the token budget"""
+        if self.summarizer is None or not token_usage:
+            return
+        dropped = token_usage.get("history_messages_dropped", 0)
+        if dropped > 0:
+            self.summarizer.submit(conversation_id, conversation_history[:dropped])
     
-    def get_conversation_history(self, conversation_id: str, max_messages: int = 10) -> List[Dict]:
+    def get_summary(self, conversation_id: str) -> str:
+        """Rolling summary of messages no longer sent with prompts, if summaries are enabled"""
+        if self.summarizer is None:
+            return None
+        return self.store.get_summary(conversation_id)
+    
+    def get_conversation_revision(self, conversation_id: str) -> str:
+        """Get a string that changes whenever the conversation does, or None if it does not exist"""
+        return self.store.get_conversation_revision(conversation_id)
+    
+    def get_conversation_history(self, conversation_id: str, max_messages: int = CONVERSATION_HISTORY_SIZE) -> List[Dict]:
         """🆕 Added: Get conversation history"""
-        with self.lock:
-            conv = self.conversations.get(conversation_id)
-            if conv and 'messages' in conv:
-                return conv['messages'][-max_messages:]
-            return []
+        return self.store.get_conversation_history(conversation_id, max_messages)
     
     def get_full_conversation(self, conversation_id: str) -> Dict:
         """🆕 NEW: Get full conversation data including all messages"""
-        with self.lock:
-            conv = self.conversations.get(conversation_id)
-            if conv:
-                return {
-                    'user_name': conv.get('user_name'),
-                    'messages': conv.get('messages', []),
-                    'created_at': conv.get('created_at'),
-                    'last_activity': conv.get('last_activity')
-                }
-            return None
+        return self.store.get_full_conversation(conversation_id)
     
-    def cleanup_old_conversations(self, max_age_hours: int = 24):
-        """Clean up conversations older than max_age_hours"""
-        with self.lock:
-            current_time = time.time()
-            to_remove = []
-            for conv_id, conv_data in self.conversations.items():
-                if current_time - conv_data['last_activity'] > max_age_hours * 3600:
-                    to_remove.append(conv_id)
-            
-            for conv_id in to_remove:
-                del self.conversations[conv_id]
+    def cleanup_old_conversations(self, max_age_hours: float = None) -> int:
+        """Evict conversations idle for longer than max_age_hours; returns how many were removed"""
+        removed = self.store.cleanup_old_conversations(
+            max_age_hours if max_age_hours is not None else self.max_age_hours
+        )
+        self.evictions += removed
+        return removed
+    
+    def start_expiry_thread(self):
+        """Run expiry and spilling of idle conversations every expiry interval in a daemon thread"""
+        if self.expiry_thread is not None:
+            return
+        
+        def run():
+            while not self.expiry_stop.wait(self.expiry_interval_seconds):
+                try:
+                    removed = self.cleanup_old_conversations()
+                    if removed:
+                        print(f"🧹 Expired {removed} idle conversations")
+                    self.store.spill_idle_conversations(self.spill_idle_seconds)
+                except Exception as e:
+                    print(f"❌ Error expiring conversations: {e}")
+        
+        self.expiry_thread = Thread(target=run, name="conversation-expiry", daemon=True)
+        self.expiry_thread.start()
+    
+    def stop_expiry_thread(self):
+        self.expiry_stop.set()
+    
+    def save_snapshot(self, path: str = None) -> int:
+        """Write live conversations to the snapshot file"""
+        path = path or self.snapshot_path
+        if not path:
+            return 0
+        started = time.time()
+        written = self.store.save_snapshot(path)
+        if written:
+            print(f"💾 Saved {written} conversations to {path} in {time.time() - started:.2f}s")
+        return written
+    
+    def enable_snapshots(self, path: str):
+        """Restore from path now (lazily) and snapshot to it on SIGTERM
+
+        The handler only wakes a snapshot thread: it runs on the main thread,
+        which may be holding the store's (non-reentrant) locks at that moment.
+        Exit waits for the snapshot to finish.
+        """
+        self.snapshot_path = path
+        self.store.attach_snapshot(path)
+        
+        try:
+            previous = signal.getsignal(signal.SIGTERM)
+        except ValueError:
+            return
+        if previous == signal.SIG_IGN:
+            return  # SIGTERM doesn't stop this process, so there is nothing to save for
+        
+        def save_on_shutdown():
+            self.shutdown_requested.wait()
+            try:
+                self.save_snapshot()
+            except Exception as e:
+                print(f"❌ Error saving conversation snapshot: {e}")
+            finally:
+                self.snapshot_saved.set()
+        
+        def handle_sigterm(signum, frame):
+            self.shutdown_requested.set()
+            # Hand over to whatever was handling SIGTERM before (e.g. gunicorn's graceful shutdown)
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                raise SystemExit(128 + signum)
+        
+        try:
+            signal.signal(signal.SIGTERM, handle_sigterm)
+        except ValueError:
+            # Not the main thread; snapshots can still be saved explicitly
+            print("⚠️ Could not install SIGTERM snapshot handler outside the main thread")
+            return
+        Thread(target=save_on_shutdown, name="conversation-snapshot-save", daemon=True).start()
+        atexit.register(self.wait_for_snapshot)
+    
+    def wait_for_snapshot(self, timeout: float = 30.0) -> bool:
+        """Block until a snapshot requested by SIGTERM has been written"""
+        if not self.shutdown_requested.is_set():
+            return True
+        return self.snapshot_saved.wait(timeout)
+    
+    def expiry_stats(self) -> Dict:
+        """Expiry metrics: live conversations and total evictions"""
+        return {
+            "live_conversations": self.store.count(),
+            "evictions": self.evictions,
+            "max_age_hours": self.max_age_hours,
+            "interval_seconds": self.expiry_interval_seconds
+        }
+    
+    def lock_stats(self) -> Dict:
+        return self.store.lock_stats()
+    
+    def memory_stats(self) -> Dict:
+        stats = self.store.memory_stats()
+        stats["backend"] = self.store.backend_name
+        stats["summaries"] = self.summarizer.stats() if self.summarizer is not None else None
+        return stats
+
+def create_conversation_store(backend: str = CONVERSATION_BACKEND) -> ConversationStore:
+    """Build the conversation store selected by CONVERSATION_BACKEND"""
+    if backend == "sqlite":
+        return SQLiteConversationStore(CONVERSATION_DB_PATH)
+    if backend == "redis":
+        return RedisConversationStore(REDIS_URL)
+    if backend != "memory":
+        print(f"⚠️ Unknown CONVERSATION_BACKEND '{backend}', using in-memory store")
+    spill_path = CONVERSATION_SPILL_PATH if CONVERSATION_SPILL_IDLE_SECONDS > 0 else None
+    return InMemoryConversationStore(spill_path=spill_path)
 
 # 🔧 FIX #1: Initialize the ConversationManager
 conversation_manager = ConversationManager()
+conversation_manager.start_expiry_thread()
+if CONVERSATION_SNAPSHOT_PATH:
+    conversation_manager.enable_snapshots(CONVERSATION_SNAPSHOT_PATH)
 
-# Initialize SentenceTransformer
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-
-# VREG Knowledge Base
-vreg_faqs = [
-    {
-        "question": 'I am not getting my confirmation link after registration',
-        "answer": 'Check your spam folder or confirm if you used the correct email address in creating a VREG account.',
-        "category": 'registration'
-    },
-    {
-        "question": 'After inputting my TIN on the portal, it brought out an Invalid statement',
-        "answer": 'Go to www.trade.gov.ng, click on Agencies then FIRS to validate your TIN',
-        "category": 'registration'
-    },
-    {
-        "question": 'I cannot access my dashboard because I forgot the password',
-        "answer": 'Please visit www.vreg.gov.ng and click on “Login.”\nNext, select “Forgot Password” and enter the email address you used during registration.\nA password recovery link will be sent to your email — simply click on the link and follow the instructions to create a new password.',
-        "category": 'registration'
-    },
-    {
-        "question": 'I tried to register for VREG but after inputting my TIN/Agency code it says TIN/Agency code has been taken',
-        "answer": 'Your agency already has an account created with VREG, kindly confirm the email address used during the registration and reset your password to be able to login successfully.',
-        "category": 'registration'
-    },
-    {
-      "question": 'How much is registeration',
-        "answer": 'Registration fees differ per vehicle. Kindly contact our customer service desk for an accurate fee',
-        "category":'registration'  
-    },
-    {
-        "question": "The portal is not recognizing my VIN, showing 'Warning! This is a non-standard VIN'",
-        "answer": 'This VIN appears to be non-standard and requires manual validation.\nPlease enter the HS code and VIN number, then click “Submit.”\nWhen the prompt appears, select “Decode Manually,” enter the vehicle details, and click “Submit” again.\nAfter submission, kindly wait while the VIN is being validated.',
-        "category": 'vin_validation'
-    },
-    {
-        "question": "I submitted my VIN for validation and it's showing on the Pending tab",
-        "answer": 'Your VIN has been validated manually, kindly generate an invoice and proceed to make payment.',
-        "category": 'vin_validation'
-    },
-    {
-        "question": 'I submitted a wrong VIN for manual validation, how can I cancel it?',
-        "answer": 'The VIN will automatically be erased from your dashboard once the due date elapses.',
-        "category": 'vin_validation'
-    },
-    {
-        "question": 'SGD Portal is telling me VREG does not exist',
-        "answer": 'Take a screenshot of the error message and attach the affected VREG certificate and send it to support@vreg.gov.ng',
-        "category": 'transmission'
-    },
-    {
-        "question": 'My VREG certificate information was not transmitted to customs ESGD platform',
-        "answer": 'This is a transmission case where VREG certificate information failed to reach customs. Please contact support@vreg.gov.ng with your certificate details and error screenshots.',
-        "category": 'transmission'
-    },
-    {
-        "question": 'I made a payment for a VREG certificate but no certificate was generated',
-        "answer": 'Send the invoice number, payment proof and the date payment were made to payments@vreg.gov.ng',
-        "category": 'payment'
-    },
-    {
-        "question": 'How can I get access to the certificate which I generated on the VREG portal?',
-        "answer": 'Login to your dashboard, click on certificate and then enter either the invoice number or VIN for the vehicle on the search tab to be able to view the certificate.',
-        "category": 'payment'
-    },
-    {
-        "question": 'My VIN is generating multiple invoices. Can I make the payment?',
-        "answer": 'Select a single Invoice number and proceed to initiate payment for the VIN.',
-        "category": 'payment'
-    },
-    {
-        "question": 'My payment is under investigation',
-        "answer": 'Kindly note that this issue is under investigation. Once the payment has been confirmed successful, the VREG certificate will be generated. Endeavor to check your payment status occasionally.',
-        "category": 'payment'
-    },
-    {
-        "question": 'My payment transaction was unsuccessful',
-        "answer": 'Kindly note that your payment transaction was unsuccessful on this invoice. Reach out or contact your bank to log a complaint or seek a reversal.',
-        "category": 'payment'
-    },
-    {
-        "question": 'How do I request a refund?',
-        "answer": 'Kindly fill in your details to process your refund: Full Name, Email Address, Phone Number, Excess Amount Paid, Invoice Number, Proof of Payment, Account Number, Account Name, Transaction Date, Bank Name. Your refund will be processed within 3-7 working days.',
-        "category": 'payment'
-    },
-    {
-        "question": 'The Agency we used for capturing has been blocked. I want to change to another',
-        "answer": 'The consignee should write a letter of cancellation of VREG certificate addressing it to the managing director of VREG, and attach the bill of lading, VREG certificate and a CAC certificate (if consignee is a company) or a Valid means of identification (if consignee is an individual) and send it to support@vreg.gov.ng',
-        "category": 'agency'
-    },
-    {
-        "question": 'A wrong consignee TIN was used in generating a VREG certificate',
-        "answer": 'The agency should write a letter of cancellation of the VREG certificate addressing it to the managing director of VREG, and attach the bill of lading and VREG certificate.',
-        "category": 'agency'
-    },
-    {
-        "question": "I cannot access the Vehicle on Custom portal because it says the company's code on VREG is different from that on ESGD",
-        "answer": "Kindly enter the correct consignee's TIN that was used in generating the VREG certificate to be able to access the Vehicle on customs portal.",
-        "category": 'agency'
-    },
-    {
-        "question": "After entering my correct login details an error message pop up saying 'this field is required'",
-        "answer": 'Ensure you have a good network connection and then try to login again.',
-        "category": 'technical'
-    },
-    {
-        "question": 'What is VREG?',
-        "answer": 'The National Vehicle Registry (VREG) is the centralized database for all vehicles in Nigeria through unique Vehicle Identification Numbers (VIN). It stores detailed vehicular information such as specifications, ownership, and history of each vehicle in Nigeria.',
-        "category": 'general'
-    },
-    {
-        "question": 'What is the purpose of VREG?',
-        "answer": 'VREG was created by the Federal Ministry of Finance as a solution to customs duty evasion, vehicle theft, vehicle-related crimes, and ineffective vehicle insurance coverage. All vehicle owners are required to register their vehicles using the VIN on the VREG portal.',
-        "category": 'general'
-    },
-    {
-        "question": 'What documents do I need for VREG registration?',
-        "answer": "You'll need: Valid ID/Passport, Vehicle purchase receipt, Customs clearance certificate, Insurance certificate, Vehicle inspection report, and your Tax Identification Number (TIN).",
-        "category": 'general'
-    },
-    {
-        "question": 'How can I contact VREG support?',
-        "answer": 'You can contact VREG support via: Email: support@vreg.gov.ng, Payment issues: payments@vreg.gov.ng, Phone: Contact helpdesk, Visit: Physical walk-in support, Website: www.vreg.gov.ng',
-        "category": 'general'
-    }
-]
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+
+def normalize_query_text(text: str) -> str:
+    """Casefold, strip punctuation and collapse whitespace so equivalent questions share a key"""
+    text = _PUNCTUATION_RE.sub(" ", text.casefold())
+    return " ".join(text.split())
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# Fixed per-message cost for role and formatting tokens
+MESSAGE_TOKEN_OVERHEAD = 4
+# Stand-in user turn for a history window that opens with the assistant (e.g. the name greeting)
+HISTORY_OPENER = "(Start of our conversation)"
+
+def estimate_tokens(text: str) -> int:
+    """Cheap local token estimate: one token per punctuation mark or short word, more for long words
+
+    Tends to overestimate slightly compared with Claude's tokenizer, which
+    keeps requests under budget.
+    """
+    return sum(1 + len(piece) // 6 for piece in _TOKEN_RE.findall(text or ''))
+
+def select_history_window(history: List[Dict], token_budget: int) -> Tuple[List[Dict], int, int]:
+    """Pick the newest contiguous run of messages whose estimated tokens fit the budget
+
+    Returns the messages oldest-first, the tokens they use and how many older
+    messages were left out. The window always starts with a user message, as
+    the Messages API expects; one that would open with an assistant turn gets
+    HISTORY_OPENER in front of it rather than losing that turn.
+    """
+    history = history or []
+    opener_cost = estimate_tokens(HISTORY_OPENER) + MESSAGE_TOKEN_OVERHEAD
+    selected = []
+    used = 0
+    for msg in reversed(history):
+        cost = estimate_tokens(msg['content']) + MESSAGE_TOKEN_OVERHEAD
+        # An assistant turn only fits if the opener it may need fits too
+        reserve = opener_cost if msg['role'] != "user" else 0
+        if used + cost + reserve > token_budget:
+            break
+        selected.append(msg)
+        used += cost
+    selected.reverse()
+    dropped = len(history) - len(selected)
+    if selected and selected[0]['role'] != "user":
+        selected.insert(0, {"role": "user", "content": HISTORY_OPENER})
+        used += opener_cost
+    return selected, used, dropped
+
+class QueryEmbeddingCache:
+    """Bounded LRU cache (with optional TTL) of query embeddings keyed on normalized text"""
+    
+    def __init__(self, max_size: int = 2048, ttl_seconds: float = 0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # key -> (embedding, stored_at)
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str):
+        """Return the cached embedding for key, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl_seconds and time.time() - entry[1] > self.ttl_seconds:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key: str, embedding: np.ndarray):
+        """Store an embedding, evicting the least recently used entry when full"""
+        if self.max_size <= 0:
+            return
+        # Cached arrays are shared between requests, so make them immutable
+        embedding.flags.writeable = False
+        with self.lock:
+            self.entries[key] = (embedding, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class SemanticResponseCache:
+    """Bounded, TTL-limited cache of LLM answers matched by query similarity
+
+    Entries are grouped by the retrieved FAQ ids and a digest of the recent
+    history; within a group, a query whose embedding is within the cosine
+    similarity threshold of a cached one reuses its answer.
+
+    Queries carrying identifiers (numbers, emails, URLs) are never cached:
+    two of them embed almost identically, and the answer often echoes the
+    identifier back, so one user would see another's invoice number or VIN.
+    """
+    
+    NAME_PLACEHOLDER = "\x00USER_NAME\x00"
+    IDENTIFIER_RE = re.compile(r"\d|\S@\S|https?://|www\.|\b[\w-]+\.[a-z]{2,}\b", re.IGNORECASE)
+    
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, similarity_threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict()  # entry_id -> (group_key, embedding, template, stored_at)
+        self.groups = {}  # group_key -> set of entry_ids
+        self.next_entry_id = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @classmethod
+    def _factor_out_name(cls, text: str, user_name: str = None) -> str:
+        if not user_name:
+            return text
+        return re.sub(rf"\b{re.escape(user_name)}\b", cls.NAME_PLACEHOLDER, text)
+    
+    @classmethod
+    def is_cacheable(cls, user_query: str) -> bool:
+        """Whether answers to this query may be shared with other users"""
+        return not cls.IDENTIFIER_RE.search(user_query or '')
+    
+    @classmethod
+    def history_digest(cls, conversation_history: List[Dict], user_name: str = None, turns: int = 2,
+                       summary: str = None) -> str:
+        """Short digest of the last few turns (and any rolling summary), with the user's name factored out"""
+        parts = [f"summary:{normalize_query_text(cls._factor_out_name(summary, user_name))}"] if summary else []
+        for msg in (conversation_history or [])[-turns:]:
+            content = cls._factor_out_name(msg['content'], user_name)
+            parts.append(f"{msg['role']}:{normalize_query_text(content)}")
+        return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()[:16]
+    
+    def _remove(self, entry_id: int):
+        group_key = self.entries.pop(entry_id)[0]
+        members = self.groups.get(group_key)
+        if members is not None:
+            members.discard(entry_id)
+            if not members:
+                del self.groups[group_key]
+    
+    def lookup(self, query_embedding: np.ndarray, faq_ids: List[str], history_digest: str, user_name: str = None):
+        """Return a cached answer personalised for user_name, or None"""
+        group_key = (tuple(sorted(faq_ids)), history_digest)
+        now = time.time()
+        with self.lock:
+            best_id, best_score = None, self.similarity_threshold
+            for entry_id in list(self.groups.get(group_key, ())):
+                _, embedding, _, stored_at = self.entries[entry_id]
+                if self.ttl_seconds and now - stored_at > self.ttl_seconds:
+                    self._remove(entry_id)
+                    continue
+                score = float(np.dot(query_embedding, embedding))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best_id)
+            self.hits += 1
+            template = self.entries[best_id][2]
+        return template.replace(self.NAME_PLACEHOLDER, user_name or "there")
+    
+    def store(self, query_embedding: np.ndarray, faq_ids: List[str], history_digest: str, response: str, user_name: str = None):
+        """Cache an answer, storing the user's name as a placeholder"""
+        if self.max_entries <= 0:
+            return
+        template = self._factor_out_name(response, user_name)
+        group_key = (tuple(sorted(faq_ids)), history_digest)
+        with self.lock:
+            entry_id = self.next_entry_id
+            self.next_entry_id += 1
+            self.entries[entry_id] = (group_key, query_embedding, template, time.time())
+            self.groups.setdefault(group_key, set()).add(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+    
+    def invalidate(self):
+        """Drop every cached answer (called whenever the knowledge base changes)"""
+        with self.lock:
+            self.entries.clear()
+            self.groups.clear()
+    
+    def stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+# Initialize the shared embedding engine (one model per process)
+embedding_engine = EmbeddingEngine()
 
 class HyperlinkProcessor:
     """Class to handle hyperlink processing for VREG responses"""
     
-    @staticmethod
-    def convert_to_hyperlinks(text: str) -> str:
-        """Convert URLs and email addresses to HTML hyperlinks"""
-        # Use placeholders to prevent nested conversions
-        placeholders = {}
-        placeholder_counter = [0]
-        
-        def create_placeholder(content):
-            placeholder = f"___PLACEHOLDER_{placeholder_counter[0]}___"
-            placeholders[placeholder] = content
-            placeholder_counter[0] += 1
-            return placeholder
-        
-        # STEP 1: Convert email addresses to mailto links with placeholders
-        email_pattern = r'([a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})'
-        
-        def email_replacer(match):
-            email = match.group(1)
-            link = f'<a href="mailto:{email}" style="color: #0066cc; text-decoration: underline; font-weight: 500;">{email}</a>'
-            return create_placeholder(link)
-        
-        result = re.sub(email_pattern, email_replacer, text)
-        
-        # STEP 2: Convert URLs to hyperlinks (emails are now placeholders, so won't be affected)
-        url_pattern = r'((?:https?://)?(?:www\.)?[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}(?:/[^\s]*)?)'
-        
-        def url_replacer(match):
-            url = match.group(1)
-            # Skip if it's a placeholder
-            if '___PLACEHOLDER_' in url:
-                return url
-            
-            # Handle specific domain mappings
-            href = url
-            if not url.startswith('http'):
-                if 'www.vreg.gov.ng' in url:
-                    href = url.replace('www.vreg.gov.ng', 'https://vreg.gov.ng')
-                elif 'www.trade.gov.ng' in url:
-                    href = url.replace('www.trade.gov.ng', 'https://trade.gov.ng')
-                elif url.startswith('www.'):
-                    href = f'https://{url[4:]}'
-                else:
-                    href = f'https://{url}'
-            
-            link = f'<a href="{href}" target="_blank" rel="noopener noreferrer" style="color: #0066cc; text-decoration: underline; font-weight: 500;">{url}</a>'
-            return create_placeholder(link)
-        
-        result = re.sub(url_pattern, url_replacer, result)
-        
-        # STEP 3: Replace placeholders with actual HTML
-        for placeholder, content in placeholders.items():
-            result = result.replace(placeholder, content)
-        
-        return result
+    # Emails and URLs in one alternation; emails are tried first at each position
+    LINK_PATTERN = re.compile(
+        r'(?P<email>[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,})'
+        r'|(?P<url>(?:https?://)?(?:www\.)?[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}(?:/[^\s]*)?)'
+    )
+    LINK_STYLE = "color: #0066cc; text-decoration: underline; font-weight: 500;"
+    # Bare domains rewritten to a canonical href, checked in order
+    DOMAIN_REWRITES = LINK_DOMAIN_REWRITES
+    
+    @classmethod
+    def url_to_href(cls, url: str) -> str:
+        """Turn a matched URL into an absolute href"""
+        if url.startswith('http'):
+            return url
+        for domain, target in cls.DOMAIN_REWRITES.items():
+            if domain in url:
+                return url.replace(domain, target)
+        if url.startswith('www.'):
+            return f'https://{url[4:]}'
+        return f'https://{url}'
+    
+    @classmethod
+    def _link_replacer(cls, match) -> str:
+        email = match.group('email')
+        if email is not None:
+            return f'<a href="mailto:{email}" style="{cls.LINK_STYLE}">{email}</a>'
+        url = match.group('url')
+        return f'<a href="{cls.url_to_href(url)}" target="_blank" rel="noopener noreferrer" style="{cls.LINK_STYLE}">{url}</a>'
+    
+    @classmethod
+    def convert_to_hyperlinks(cls, text: str) -> str:
+        """Convert URLs and email addresses to HTML hyperlinks in a single pass"""
+        return cls.LINK_PATTERN.sub(cls._link_replacer, text)
+    
     @staticmethod
     def process_faq_answer(answer: str) -> str:
         """Process FAQ answer to include hyperlinks"""
         return HyperlinkProcessor.convert_to_hyperlinks(answer)
 
-class VREGRAGSystem:
+class IncrementalHyperlinker:
+    """Linkify streamed text chunk by chunk
+
+    URLs and email addresses never contain whitespace, so everything up to the
+    last whitespace seen can be converted and emitted immediately; only the
+    trailing token, which may still grow into a link, is held back.
+    """
+    
     def __init__(self):
-        self.collection_name = "vreg_faqs"
-        # Initialize ChromaDB client as instance attribute
-        self.chroma_client = chromadb.Client()
-        self.hyperlink_processor = HyperlinkProcessor()
-        self.setup_vector_database()
+        self.pending = ""
     
-    def setup_vector_database(self):
-        """Initialize ChromaDB collection with VREG FAQs"""
-        try:
-            # Delete existing collection if it exists
-            try:
-                self.chroma_client.delete_collection(name=self.collection_name)
-            except:
-                pass
-            
-            # Create new collection
-            self.collection = self.chroma_client.create_collection(
-                name=self.collection_name,
-                metadata={"hnsw:space": "cosine"}
-            )
-            
-            # Prepare documents for embedding
-            documents = []
-            metadatas = []
-            ids = []
-            
-            for i, faq in enumerate(vreg_faqs):
-                # Combine question and answer for better context
-                doc_text = f"Question: {faq['question']}\nAnswer: {faq['answer']}"
-                documents.append(doc_text)
-                metadatas.append({
-                    "category": faq['category'],
-                    "question": faq['question'],
-                    "answer": faq['answer']
-                })
-                ids.append(str(uuid.uuid4()))
-            
-            # Add documents to collection
-            self.collection.add(
-                documents=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-            
-            print(f"✅ Vector database initialized with {len(vreg_faqs)} FAQs")
-            
-        except Exception as e:
-            print(f"❌ Error setting up vector database: {e}")
+    def feed(self, chunk: str) -> str:
+        """Add a chunk of text and return the HTML that is now safe to emit"""
+        self.pending += chunk
+        cut = max(self.pending.rfind(ws) for ws in (" ", "\n", "\t", "\r"))
+        if cut < 0:
+            return ""
+        ready, self.pending = self.pending[:cut + 1], self.pending[cut + 1:]
+        return HyperlinkProcessor.convert_to_hyperlinks(ready)
+    
+    def flush(self) -> str:
+        """Emit whatever is still held back at the end of the stream"""
+        ready, self.pending = self.pending, ""
+        return HyperlinkProcessor.convert_to_hyperlinks(ready) if ready else ""
+
+class ChromaFAQRetriever:
+    """Approximate nearest-neighbour retrieval through the ChromaDB collection"""
     
-    def retrieve_relevant_faqs(self, query: str, n_results: int = 3) -> List[Dict]:
-        """Retrieve most relevant FAQs based on user query"""
-        try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results
-            )
-            
-            relevant_faqs = []
-            if results['metadatas'] and len(results['metadatas'][0]) > 0:
-                for metadata in results['metadatas'][0]:
-                    relevant_faqs.append({
-                        "question": metadata['question'],
-                        "answer": metadata['answer'],
-                        "category": metadata['category']
-                    })
-            
-            return relevant_faqs
-            
-        except Exception as e:
-            print(f"❌ Error retrieving FAQs: {e}")
-            return []
+    def __init__(self, collection):
+        self.collection = collection
     
-    def generate_rag_response(self, user_query: str, user_name: str = None, conversation_history: List[Dict] = None) -> Dict:
-        """Generate response using RAG with conversation context"""
-        try:
-            # Step 1: Retrieve relevant FAQs
-            relevant_faqs = self.retrieve_relevant_faqs(user_query, n_results=3)
-            
-            # Step 2: Build context from relevant FAQs
-            context = ""
-            if relevant_faqs:
-                context = "Here are relevant FAQs that might help answer the question:\n\n"
-                for i, faq in enumerate(relevant_faqs, 1):
-                    context += f"FAQ {i}:\nQ: {faq['question']}\nA: {faq['answer']}\n\n"
-            
-            # Step 3: Create system prompt with user context
-            user_context = f"The user's name is {user_name}." if user_name else ""
-            
-            # ✅ UPDATED: Friendly but concise system prompt
-            system_prompt = f"""You are a friendly VREG support assistant helping users with vehicle registration in Nigeria. {user_context}
+    def search(self, query_embeddings: np.ndarray, n_results: int) -> List[List[Tuple[str, Dict, float]]]:
+        """Return (faq_id, metadata, cosine similarity) hits for each query, best first"""
+        results = self.collection.query(
+            query_embeddings=query_embeddings.tolist(),
+            n_results=n_results,
+            include=["metadatas", "distances"]
+        )
+        batches = []
+        for ids, metadatas, distances in zip(results['ids'] or [], results['metadatas'] or [], results['distances'] or []):
+            # Collection uses cosine distance, so similarity is 1 - distance
+            batches.append([
+                (faq_id, metadata, 1.0 - distance)
+                for faq_id, metadata, distance in zip(ids, metadatas, distances)
+            ])
+        return batches
+
+class NumpyFAQRetriever:
+    """Exact brute-force retrieval over a contiguous, normalized float32 matrix"""
+    
+    def __init__(self, ids: List[str], embeddings: np.ndarray, metadatas: List[Dict]):
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.matrix = matrix / norms
+        self.ids = ids
+        self.metadatas = metadatas
+    
+    @classmethod
+    def from_collection(cls, collection) -> "NumpyFAQRetriever":
+        """Load stored embeddings from a Chroma collection without re-embedding"""
+        data = collection.get(include=["embeddings", "metadatas"])
+        return cls(list(data['ids']), np.asarray(data['embeddings'], dtype=np.float32), list(data['metadatas']))
+    
+    def __len__(self) -> int:
+        return len(self.metadatas)
+    
+    def search(self, query_embeddings: np.ndarray, n_results: int) -> List[List[Tuple[str, Dict, float]]]:
+        """Return (faq_id, metadata, cosine similarity) hits for each query, best first"""
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        k = min(n_results, len(self.metadatas))
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+        
+        # One matrix product scores every FAQ against every query
+        scores = queries @ self.matrix.T
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        
+        batches = []
+        for row, candidates in zip(scores, top):
+            ranked = candidates[np.argsort(-row[candidates])]
+            batches.append([(self.ids[i], self.metadatas[i], float(row[i])) for i in ranked])
+        return batches
+
+# ✅ UPDATED: Friendly but concise system prompt. Together with the FAQ knowledge base it forms
+# a prefix that is identical for every request, sent with cache_control so the provider reuses it;
+# per-user context follows in its own block.
+VREG_SYSTEM_PROMPT = """You are a friendly VREG support assistant helping users with vehicle registration in Nigeria.
 
 TONE & STYLE - THIS IS CRITICAL:
 - Be warm, helpful, and show you care about their issue
@@ -435,65 +2201,901 @@ CONTACT INFO (use when relevant):
 - Payments: payments@vreg.gov.ng
 - Website: www.vreg.gov.ng
 - TIN validation: www.trade.gov.ng (Agencies > FIRS)"""
+
+class LLMOverloadedError(Exception):
+    """No LLM slot became available; retry_after is a back-off hint in seconds"""
+    
+    def __init__(self, retry_after: int):
+        super().__init__(f"LLM dispatcher overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class LLMDispatcher:
+    """Admission control for Claude calls: bounded concurrency plus a bounded, deadline-limited wait queue
+
+    Callers hold a slot for the whole call (including streaming). When every
+    slot is busy they wait up to queue_timeout_seconds; when the queue itself
+    is full they are rejected immediately with LLMOverloadedError.
+    """
+    
+    def __init__(self, max_in_flight: int = LLM_MAX_IN_FLIGHT, max_queued: int = LLM_MAX_QUEUED,
+                 queue_timeout_seconds: float = LLM_QUEUE_TIMEOUT_SECONDS):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued = max(0, max_queued)
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait_seconds = 0.0
+        self.recent_waits = deque(maxlen=1000)
+        self.avg_call_seconds = 2.0  # EWMA of how long a slot is held
+    
+    def is_full(self) -> bool:
+        """True when a new caller would be rejected without waiting"""
+        return self.in_flight >= self.max_in_flight and self.queued >= self.max_queued
+    
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained"""
+        backlog = (self.queued + 1) / self.max_in_flight
+        return max(1, math.ceil(self.avg_call_seconds * backlog))
+    
+    def _acquire(self, wait: bool):
+        started = time.time()
+        with self.condition:
+            if self.in_flight >= self.max_in_flight or self.queued:
+                if not wait or self.queued >= self.max_queued:
+                    self.rejected += 1
+                    raise LLMOverloadedError(self.retry_after())
+                self.queued += 1
+                self.peak_queued = max(self.peak_queued, self.queued)
+                deadline = started + self.queue_timeout_seconds
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.timed_out += 1
+                            raise LLMOverloadedError(self.retry_after())
+                        self.condition.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            waited = time.time() - started
+            self.total_wait_seconds += waited
+            self.recent_waits.append(waited)
+        return time.time()
+    
+    def _release(self, acquired_at: float):
+        with self.condition:
+            self.in_flight -= 1
+            self.avg_call_seconds = 0.9 * self.avg_call_seconds + 0.1 * (time.time() - acquired_at)
+            self.condition.notify()
+    
+    @contextmanager
+    def slot(self, wait: bool = True):
+        """Hold an LLM slot for the duration of the block; wait=False never queues"""
+        acquired_at = self._acquire(wait)
+        try:
+            yield
+        finally:
+            self._release(acquired_at)
+    
+    def stats(self) -> Dict:
+        with self.condition:
+            waits = sorted(self.recent_waits)
+        return self._stats(waits)
+    
+    def _stats(self, waits: List[float]) -> Dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "max_queued": self.max_queued,
+            "peak_queue_depth": self.peak_queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(1000 * self.total_wait_seconds / self.admitted, 2) if self.admitted else 0.0,
+            "p95_wait_ms": round(1000 * waits[int(0.95 * (len(waits) - 1))], 2) if waits else 0.0,
+            "avg_call_ms": round(1000 * self.avg_call_seconds, 2)
+        }
+
+llm_dispatcher = LLMDispatcher()
+
+class LLMDeadlineExceeded(Exception):
+    """A Claude call (including retries and hedges) ran past its deadline"""
+
+class LLMResiliencePolicy:
+    """Deadline, retry and hedging policy for Claude calls
+
+    Every call gets an overall deadline, passed down as the SDK timeout.
+    Retryable failures (connection errors, timeouts, 408/409/429/5xx) are
+    retried with full-jitter exponential backoff while attempts and time
+    remain. With hedging on, a duplicate request goes out if the first one
+    is slower than the recent p95 and whichever succeeds first wins; hedges
+    run in a dispatcher slot of their own, taken without queueing, and are
+    capped at hedge_max_ratio of calls.
+    """
+    
+    RETRYABLE_STATUS = {408, 409, 429}
+    
+    def __init__(self, deadline_seconds: float = LLM_DEADLINE_SECONDS,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 base_delay_seconds: float = LLM_RETRY_BASE_DELAY_SECONDS,
+                 hedge_enabled: bool = LLM_HEDGE_ENABLED,
+                 hedge_max_ratio: float = LLM_HEDGE_MAX_RATIO,
+                 hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+                 dispatcher: LLMDispatcher = None):
+        self.deadline_seconds = deadline_seconds
+        self.max_retries = max(0, max_retries)
+        self.base_delay_seconds = base_delay_seconds
+        self.hedge_enabled = hedge_enabled
+        self.hedge_max_ratio = hedge_max_ratio
+        self.hedge_min_samples = hedge_min_samples
+        self.dispatcher = dispatcher
+        # Room for every slot's primary plus a hedge, so no request waits for a thread.
+        # Created on first sync hedge; the async server hedges with tasks instead.
+        self.hedge_pool_size = 2 * (dispatcher.max_in_flight if dispatcher is not None else LLM_MAX_IN_FLIGHT)
+        self.hedge_pool = None
+        self.lock = Lock()
+        self.latencies = deque(maxlen=500)  # Recent successful call durations
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+    
+    def start(self) -> float:
+        """Begin a call; returns its monotonic deadline"""
+        with self.lock:
+            self.calls += 1
+        return time.monotonic() + self.deadline_seconds
+    
+    def remaining(self, deadline: float) -> float:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            with self.lock:
+                self.deadline_exceeded += 1
+            raise LLMDeadlineExceeded(f"Claude call exceeded its {self.deadline_seconds:.0f}s deadline")
+        return remaining
+    
+    @classmethod
+    def is_retryable(cls, error: Exception) -> bool:
+        if isinstance(error, APIConnectionError):  # Includes timeouts
+            return True
+        if isinstance(error, APIStatusError):
+            return error.status_code in cls.RETRYABLE_STATUS or error.status_code >= 500
+        return False
+    
+    def retry_delay(self, attempt: int, error: Exception, deadline: float, streamed: bool = False):
+        """Backoff before the next attempt, or None if the error should be raised
+
+        A stream that already sent text is never retried, since the retry would repeat it.
+        """
+        if streamed or attempt >= self.max_retries or not self.is_retryable(error):
+            return None
+        delay = random.uniform(0, self.base_delay_seconds * (2 ** attempt))
+        # Honour the server's Retry-After when it asks for longer
+        response = getattr(error, "response", None)
+        try:
+            delay = max(delay, float(response.headers.get("retry-after", 0)))
+        except (AttributeError, TypeError, ValueError):
+            pass
+        if time.monotonic() + delay >= deadline:
+            return None
+        with self.lock:
+            self.retries += 1
+        print(f"🔁 Retrying Claude call in {delay:.2f}s after: {error}")
+        return delay
+    
+    def backoff(self, attempt: int, error: Exception, deadline: float) -> float:
+        """Like retry_delay, but re-raises error when it should not be retried"""
+        delay = self.retry_delay(attempt, error, deadline)
+        if delay is None:
+            raise error
+        return delay
+    
+    def record_latency(self, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+    
+    def record_hedge_win(self):
+        with self.lock:
+            self.hedge_wins += 1
+    
+    def hedge_delay(self):
+        """p95 of recent latencies, or None when hedging is off or there is too little data"""
+        if not self.hedge_enabled or len(self.latencies) < self.hedge_min_samples:
+            return None
+        with self.lock:
+            latencies = sorted(self.latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+    
+    def try_reserve_hedge(self) -> bool:
+        """Take one hedge from the budget if the dispatcher looks to have a free slot for it"""
+        dispatcher = self.dispatcher
+        if dispatcher is not None and dispatcher.in_flight >= dispatcher.max_in_flight:
+            return False
+        with self.lock:
+            if self.hedges + 1 > self.hedge_max_ratio * self.calls:
+                return False
+            self.hedges += 1
+            return True
+    
+    def _hedge(self, request, timeout: float):
+        """Run a hedge in a dispatcher slot of its own; raises LLMOverloadedError rather than queueing"""
+        if self.dispatcher is None:
+            return request(timeout)
+        with self.dispatcher.slot(wait=False):
+            return request(timeout)
+    
+    def finished_request(self, error: Exception, is_primary: bool, started: float, first_error: Exception):
+        """Account for one finished request of a hedged attempt
+
+        Returns (won, error to raise if every request fails).
+        """
+        if error is None:
+            if not is_primary:
+                self.record_hedge_win()
+            self.record_latency(time.monotonic() - started)
+            return True, first_error
+        # A hedge that found no free slot simply never ran
+        if is_primary or not isinstance(error, LLMOverloadedError):
+            return False, error
+        return False, first_error
+    
+    def call(self, request, hedge: bool = True):
+        """Run request(timeout) under the deadline with retries and optional hedging"""
+        deadline = self.start()
+        for attempt in itertools.count():
+            try:
+                return self._attempt(request, deadline, hedge)
+            except Exception as e:
+                time.sleep(self.backoff(attempt, e, deadline))
+    
+    def _hedge_pool(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.hedge_pool is None:
+                self.hedge_pool = ThreadPoolExecutor(max_workers=self.hedge_pool_size, thread_name_prefix="llm-hedge")
+            return self.hedge_pool
+    
+    def _attempt(self, request, deadline: float, hedge: bool):
+        started = time.monotonic()
+        hedge_delay = self.hedge_delay() if hedge else None
+        if hedge_delay is None:
+            result = request(self.remaining(deadline))
+            self.record_latency(time.monotonic() - started)
+            return result
+        
+        hedge_pool = self._hedge_pool()
+        primary = hedge_pool.submit(request, self.remaining(deadline))
+        pending = {primary}
+        done, _ = wait_for_futures(pending, timeout=min(hedge_delay, self.remaining(deadline)))
+        if not done and self.try_reserve_hedge():
+            pending.add(hedge_pool.submit(self._hedge, request, self.remaining(deadline)))
+        error = None
+        while pending:
+            done, pending = wait_for_futures(pending, timeout=self.remaining(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                self.remaining(deadline)  # Raises LLMDeadlineExceeded
+            for future in done:
+                won, error = self.finished_request(future.exception(), future is primary, started, error)
+                if won:
+                    # The losing request can't be cancelled mid-flight; its result is dropped
+                    return future.result()
+        raise error
+    
+    def stats(self) -> Dict:
+        with self.lock:
+            latencies = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "deadline_exceeded": self.deadline_exceeded,
+            "hedging": self.hedge_enabled,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p50_latency_ms": round(1000 * latencies[len(latencies) // 2], 2) if latencies else 0.0,
+            "p95_latency_ms": round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 2) if latencies else 0.0
+        }
+
+llm_resilience = LLMResiliencePolicy(dispatcher=llm_dispatcher)
+
+class LLMCircuitBreaker:
+    """Circuit breaker for Claude calls
+
+    Closed: calls go through; consecutive failures and calls slower than the
+    latency SLO are counted. At the threshold the breaker opens and callers
+    are told to answer without Claude. After open_seconds it goes half-open
+    and lets a single probe through: success closes it, failure re-opens it.
+    A probe that never reports back is replaced after another open_seconds.
+    """
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+                 latency_slo_seconds: float = LLM_BREAKER_LATENCY_SLO_SECONDS,
+                 open_seconds: float = LLM_BREAKER_OPEN_SECONDS):
+        self.failure_threshold = max(1, failure_threshold)
+        self.latency_slo_seconds = latency_slo_seconds
+        self.open_seconds = open_seconds
+        self.lock = Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_started_at = None
+        self.trips = 0
+        self.short_circuited = 0
+    
+    def allow_request(self) -> bool:
+        """Whether to call Claude now; False means answer in degraded mode"""
+        now = time.monotonic()
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and now - self.opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self.probe_started_at = None
+            if self.state == self.HALF_OPEN and (
+                    self.probe_started_at is None or now - self.probe_started_at >= self.open_seconds):
+                self.probe_started_at = now
+                print("🔌 Circuit breaker half-open, probing Claude")
+                return True
+            self.short_circuited += 1
+            return False
+    
+    def record_success(self, latency_seconds: float):
+        if latency_seconds > self.latency_slo_seconds:
+            # Too slow to be useful counts against the upstream
+            self.record_failure()
+            return
+        with self.lock:
+            if self.state != self.CLOSED:
+                print("✅ Circuit breaker closed, Claude is healthy again")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.probe_started_at = None
+    
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold):
+                if self.state == self.CLOSED:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probe_started_at = None
+                print(f"🔌 Circuit breaker open after {self.consecutive_failures} failures, answering from FAQs")
+    
+    def record_rejected(self):
+        """A call Claude rejected as malformed says nothing about its health; just free the probe"""
+        with self.lock:
+            self.probe_started_at = None
+    
+    @staticmethod
+    def counts_as_failure(error: Exception) -> bool:
+        """Only errors that point at the upstream (retryable statuses, timeouts) count toward opening"""
+        return isinstance(error, LLMDeadlineExceeded) or LLMResiliencePolicy.is_retryable(error)
+    
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "trips": self.trips,
+            "short_circuited": self.short_circuited,
+            "failure_threshold": self.failure_threshold,
+            "latency_slo_seconds": self.latency_slo_seconds,
+            "open_seconds": self.open_seconds
+        }
+
+llm_breaker = LLMCircuitBreaker()
+
+class LLMUsageTracker:
+    """Running totals of Claude token usage, including prompt-cache reads and writes"""
+    
+    def __init__(self):
+        self.lock = Lock()
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.cache_creation_input_tokens = 0
+    
+    def record(self, usage):
+        if usage is None:
+            return
+        with self.lock:
+            self.requests += 1
+            self.input_tokens += getattr(usage, "input_tokens", 0) or 0
+            self.output_tokens += getattr(usage, "output_tokens", 0) or 0
+            self.cache_read_input_tokens += getattr(usage, "cache_read_input_tokens", 0) or 0
+            self.cache_creation_input_tokens += getattr(usage, "cache_creation_input_tokens", 0) or 0
+    
+    def stats(self) -> Dict:
+        # input_tokens only counts tokens that were neither read from nor written to the cache
+        prompt_tokens = self.input_tokens + self.cache_read_input_tokens + self.cache_creation_input_tokens
+        return {
+            "requests": self.requests,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_read_input_tokens": self.cache_read_input_tokens,
+            "cache_creation_input_tokens": self.cache_creation_input_tokens,
+            "cache_read_ratio": round(self.cache_read_input_tokens / prompt_tokens, 4) if prompt_tokens else 0.0
+        }
+
+class VREGRAGSystem:
+    def __init__(self, embedding_engine: EmbeddingEngine, index_dir: str = VECTOR_INDEX_DIR):
+        self.embedding_engine = embedding_engine
+        self.index_dir = index_dir
+        self.index_path = vector_index_path(embedding_engine.model_name, index_dir)
+        self.collection = None
+        self.hyperlink_processor = HyperlinkProcessor()
+        self.query_cache = QueryEmbeddingCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS)
+        self.response_cache = SemanticResponseCache(
+            RESPONSE_CACHE_MAX_ENTRIES,
+            RESPONSE_CACHE_TTL_SECONDS,
+            RESPONSE_CACHE_SIMILARITY
+        )
+        self.llm_usage = LLMUsageTracker()
+        # The static prompt alone is too short to be cached, so a small knowledge base rides along.
+        # faq_numbers maps index ids (see build_vector_index) to FAQ numbers in the prefix.
+        self.cached_system_prompt, self.faq_numbers = self.build_cached_prefix(vreg_faqs)
+        self.system_prompt_tokens = estimate_tokens(self.cached_system_prompt)
+        if not self.faq_numbers:
+            print(f"⚠️ Knowledge base is over CLAUDE_CACHED_KB_MAX_TOKENS={CLAUDE_CACHED_KB_MAX_TOKENS}; "
+                  f"only the system prompt is cached")
+        if self.system_prompt_tokens < CLAUDE_MIN_CACHEABLE_TOKENS:
+            print(f"⚠️ Cached prompt prefix is only ~{self.system_prompt_tokens} tokens; Claude will not cache it")
+        self.setup_vector_database()
+        self.retriever = self._select_retriever()
+        self.direct_answers = self._render_direct_answers()
+    
+    def setup_vector_database(self):
+        """Open the prebuilt vector index, building it only when the knowledge base changed"""
+        # Cached answers were generated against the previous knowledge base
+        self.response_cache.invalidate()
+        try:
+            prebuilt = os.path.isdir(self.index_path)
+            ensure_vector_index(self.embedding_engine, self.index_dir)
+            self.collection = open_vector_index(self.embedding_engine, self.index_path)
+            if prebuilt:
+                print(f"✅ Loaded vector index {os.path.basename(self.index_path)} with {self.collection.count()} FAQs")
+            else:
+                print(f"✅ Vector database initialized with {len(vreg_faqs)} FAQs")
             
-            # Step 4: Build conversation messages with history
-            # ✅ UPDATED: Changed to Anthropic format
-            messages = []
-            
-            # Add conversation history if available (last 6 messages)
-            if conversation_history:
-                for msg in conversation_history[-6:]:
-                    messages.append({
-                        "role": "user" if msg['role'] == "user" else "assistant",
-                        "content": msg['content']
-                    })
+        except Exception as e:
+            print(f"❌ Error setting up vector database: {e}")
+    
+    def _select_retriever(self):
+        """Pick the exact NumPy retriever for small corpora, ChromaDB otherwise"""
+        if self.collection is None:
+            return None
+        if self.collection.count() <= EXACT_RETRIEVER_MAX_FAQS:
+            try:
+                retriever = NumpyFAQRetriever.from_collection(self.collection)
+                print(f"⚡ Using exact NumPy retriever over {len(retriever)} FAQs")
+                return retriever
+            except Exception as e:
+                print(f"⚠️ Could not load exact retriever, falling back to ChromaDB: {e}")
+        return ChromaFAQRetriever(self.collection)
+    
+    @staticmethod
+    def _format_faq(metadata: Dict, score: float = None) -> Dict:
+        faq = {
+            "question": metadata['question'],
+            "answer": metadata['answer'],
+            "category": metadata['category']
+        }
+        if score is not None:
+            faq["score"] = round(score, 4)
+        return faq
+    
+    def _render_direct_answers(self) -> Dict[str, Tuple[str, str]]:
+        """Pre-render a friendly (raw, hyperlinked) reply for every FAQ, keyed by FAQ id"""
+        if self.collection is None:
+            return {}
+        try:
+            data = self.collection.get(include=["metadatas"])
+        except Exception as e:
+            print(f"⚠️ Could not pre-render direct answers: {e}")
+            return {}
+        
+        rendered = {}
+        for faq_id, metadata in zip(data['ids'], data['metadatas']):
+            answer = metadata['answer'].strip()
+            if not answer.endswith(('.', '!', '?')):
+                answer += "."
+            reply = f"Sure thing! {answer} Anything else I can help with? 😊"
+            rendered[faq_id] = (reply, self.hyperlink_processor.convert_to_hyperlinks(reply))
+        return rendered
+    
+    def select_direct_answer(self, scored_faqs: List[Tuple[str, Dict, float]], prior_history: List[Dict] = None):
+        """Return the pre-rendered answer when the top FAQ is a confident, unambiguous match
+
+        An answer the user has already been given is never repeated: a follow-up
+        like "I checked spam, still nothing" goes to Claude for alternatives.
+        """
+        if not DIRECT_ANSWER_ENABLED or not scored_faqs:
+            return None
+        top_id, _top_faq, top_score = scored_faqs[0]
+        runner_up = scored_faqs[1][2] if len(scored_faqs) > 1 else 0.0
+        if top_score < DIRECT_ANSWER_MIN_SCORE or top_score - runner_up < DIRECT_ANSWER_MARGIN:
+            return None
+        direct_answer = self.direct_answers.get(top_id)
+        if direct_answer is not None and any(
+                msg['role'] == "assistant" and msg['content'] == direct_answer[0] for msg in prior_history or ()):
+            return None
+        return direct_answer
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed a user query, reusing cached embeddings for repeated questions"""
+        key = normalize_query_text(query)
+        embedding = self.query_cache.get(key)
+        if embedding is None:
+            embedding = self.embedding_engine.embed_query(query)
+            self.query_cache.put(key, embedding)
+        return embedding
+    
+    def retrieve_scored_faqs(self, query_embedding: np.ndarray, n_results: int = 3) -> List[Tuple[str, Dict, float]]:
+        """Retrieve (faq_id, faq, cosine similarity) hits for an embedded query"""
+        try:
+            hits = self.retriever.search(query_embedding[np.newaxis, :], n_results)[0]
+            return [(faq_id, self._format_faq(metadata, score), score) for faq_id, metadata, score in hits]
             
-            # Step 5: Add current user query with context
-            if context:
-                current_prompt = f"{context}\n\nUser Question: {user_query}\n\nProvide a friendly, concise response based on the FAQ context and conversation history. Remember: be warm but brief!"
-            else:
-                current_prompt = f"User Question: {user_query}\n\nProvide a friendly, concise response about VREG processes."
+        except Exception as e:
+            print(f"❌ Error retrieving FAQs: {e}")
+            return []
+    
+    def retrieve_relevant_faqs(self, query: str, n_results: int = 3) -> List[Dict]:
+        """Retrieve most relevant FAQs based on user query"""
+        try:
+            query_embedding = self.embed_query(query)
+        except Exception as e:
+            print(f"❌ Error retrieving FAQs: {e}")
+            return []
+        return [faq for _faq_id, faq, _score in self.retrieve_scored_faqs(query_embedding, n_results)]
+    
+    def retrieve_relevant_faqs_batch(self, queries: List[str], n_results: int = 3) -> List[List[Dict]]:
+        """Retrieve relevant FAQs for several queries with one embedding and search call"""
+        try:
+            query_embeddings = self.embedding_engine.embed_documents(queries)
+            return [
+                [self._format_faq(metadata, score) for _faq_id, metadata, score in hits]
+                for hits in self.retriever.search(query_embeddings, n_results)
+            ]
+        except Exception as e:
+            print(f"❌ Error retrieving FAQs: {e}")
+            return [[] for _ in queries]
+    
+    @staticmethod
+    def build_cached_prefix(faqs: List[Dict], max_kb_tokens: int = CLAUDE_CACHED_KB_MAX_TOKENS) -> Tuple[str, Dict[str, int]]:
+        """(prefix, faq_numbers): the system prompt plus every FAQ if they fit in max_kb_tokens
+
+        A knowledge base over the limit is left out entirely and faq_numbers
+        is empty, so prompts carry the full text of the retrieved FAQs instead.
+        """
+        articles = "\n\n".join(
+            f"FAQ {i}:\nQ: {faq['question']}\nA: {faq['answer']}" for i, faq in enumerate(faqs, 1)
+        )
+        if not faqs or estimate_tokens(articles) > max_kb_tokens:
+            return VREG_SYSTEM_PROMPT, {}
+        faq_numbers = {f"faq-{i}": i + 1 for i in range(len(faqs))}
+        return f"{VREG_SYSTEM_PROMPT}\n\nFAQ KNOWLEDGE BASE (base your answers on these):\n\n{articles}", faq_numbers
+    
+    def build_system_prompt(self, user_name: str = None, conversation_summary: str = None) -> List[Dict]:
+        """System prompt blocks: the cached prompt and knowledge base, then any per-user context"""
+        blocks = [{"type": "text", "text": self.cached_system_prompt, "cache_control": {"type": "ephemeral"}}]
+        user_context = []
+        if user_name:
+            user_context.append(f"The user's name is {user_name}.")
+        # Older turns that no longer fit the history window arrive as a summary
+        if conversation_summary:
+            user_context.append(f"SUMMARY OF EARLIER CONVERSATION:\n{conversation_summary}")
+        if user_context:
+            blocks.append({"type": "text", "text": "\n\n".join(user_context)})
+        return blocks
+    
+    def prepare_rag_request(self, user_query: str, user_name: str = None, conversation_history: List[Dict] = None,
+                            conversation_summary: str = None) -> Dict:
+        """Retrieve FAQs and either answer locally or build the Claude request"""
+        # Step 1: Retrieve relevant FAQs
+        query_embedding = self.embed_query(user_query)
+        scored_faqs = self.retrieve_scored_faqs(query_embedding, n_results=3)
+        relevant_faqs = [faq for _faq_id, faq, _score in scored_faqs]
+        # History ends with the current user message, which the embedding already covers
+        prior_history = (conversation_history or [])[:-1]
+        
+        # Near-exact FAQ match: answer directly without calling Claude
+        direct_answer = self.select_direct_answer(scored_faqs, prior_history)
+        if direct_answer is not None:
+            return {"result": {
+                "response": direct_answer[0],
+                "response_with_links": direct_answer[1],
+                "relevant_faqs": relevant_faqs,
+                "context_used": True,
+                "cached": False,
+                "response_path": "direct_answer"
+            }}
+        
+        # Serve a cached answer for the same question against the same FAQs and recent history
+        faq_ids = [faq_id for faq_id, _faq, _score in scored_faqs]
+        history_digest = SemanticResponseCache.history_digest(
+            prior_history, user_name, RESPONSE_CACHE_HISTORY_TURNS, conversation_summary
+        )
+        cacheable = SemanticResponseCache.is_cacheable(user_query)
+        cached_response = self.response_cache.lookup(query_embedding, faq_ids, history_digest, user_name) if cacheable else None
+        if cached_response is not None:
+            return {"result": {
+                "response": cached_response,
+                "response_with_links": self.hyperlink_processor.convert_to_hyperlinks(cached_response),
+                "relevant_faqs": relevant_faqs,
+                "context_used": bool(relevant_faqs),
+                "cached": True,
+                "response_path": "response_cache"
+            }}
+        
+        # Step 2: Point Claude at the most relevant FAQs; FAQs outside the cached knowledge base go in full
+        context = ""
+        if relevant_faqs:
+            context = "The most relevant FAQs for this question are:\n"
+            for faq_id, faq, _score in scored_faqs:
+                number = self.faq_numbers.get(faq_id)
+                if number is not None:
+                    context += f"- FAQ {number}: {faq['question']}\n"
+                else:
+                    context += f"- Q: {faq['question']}\n  A: {faq['answer']}\n"
+        
+        # Step 3: Cached system prompt and knowledge base plus a small per-user block
+        system_prompt = self.build_system_prompt(user_name, conversation_summary)
+        
+        # Step 4: Add current user query with context
+        if context:
+            current_prompt = f"{context}\nUser Question: {user_query}\n\nProvide a friendly, concise response based on the FAQ context and conversation history. Remember: be warm but brief!"
+        else:
+            current_prompt = f"User Question: {user_query}\n\nProvide a friendly, concise response about VREG processes."
+        
+        # Step 5: Fill the rest of the input-token budget with recent history, newest first.
+        # The budget covers the whole prompt, cached prefix included.
+        # ✅ UPDATED: Changed to Anthropic format
+        system_tokens = estimate_tokens(system_prompt[1]["text"] if len(system_prompt) > 1 else '')
+        prompt_tokens = estimate_tokens(current_prompt) + MESSAGE_TOKEN_OVERHEAD
+        history_window, history_tokens, history_dropped = select_history_window(
+            prior_history, CLAUDE_INPUT_TOKEN_BUDGET - self.system_prompt_tokens - system_tokens - prompt_tokens
+        )
+        messages = [
+            {"role": "user" if msg['role'] == "user" else "assistant", "content": msg['content']}
+            for msg in history_window
+        ]
+        messages.append({"role": "user", "content": current_prompt})
+        
+        return {
+            "system": system_prompt,
+            "messages": messages,
+            "relevant_faqs": relevant_faqs,
+            "context_used": bool(context),
+            "query_embedding": query_embedding,
+            "faq_ids": faq_ids,
+            "history_digest": history_digest,
+            "cacheable": cacheable,
+            "user_name": user_name,
+            "token_usage": {
+                "budget": CLAUDE_INPUT_TOKEN_BUDGET,
+                "cached_prefix": self.system_prompt_tokens,
+                "system": system_tokens,
+                "summary": estimate_tokens(conversation_summary),
+                "prompt": prompt_tokens,
+                "history": history_tokens,
+                "history_messages": len(history_window),
+                "history_messages_dropped": history_dropped,
+                "estimated_input": self.system_prompt_tokens + system_tokens + prompt_tokens + history_tokens
+            }
+        }
+    
+    def finish_rag_response(self, rag_request: Dict, raw_response: str, usage=None) -> Dict:
+        """Cache and hyperlink a completed Claude answer"""
+        self.llm_usage.record(usage)
+        if rag_request["cacheable"]:
+            self.response_cache.store(
+                rag_request["query_embedding"],
+                rag_request["faq_ids"],
+                rag_request["history_digest"],
+                raw_response,
+                rag_request["user_name"]
+            )
+        
+        # Step 7: Process response to add hyperlinks
+        processed_response = self.hyperlink_processor.convert_to_hyperlinks(raw_response)
+        
+        # Step 8: Return both versions
+        return {
+            "response": raw_response,
+            "response_with_links": processed_response,
+            "relevant_faqs": rag_request["relevant_faqs"],
+            "context_used": rag_request["context_used"],
+            "cached": False,
+            "response_path": "llm",
+            "token_usage": dict(
+                rag_request["token_usage"],
+                input=getattr(usage, "input_tokens", None),
+                output=getattr(usage, "output_tokens", None),
+                cache_read=getattr(usage, "cache_read_input_tokens", None),
+                cache_creation=getattr(usage, "cache_creation_input_tokens", None)
+            )
+        }
+    
+    def degraded_response(self, rag_request: Dict) -> Dict:
+        """Answer straight from the top retrieved FAQ while Claude is unavailable"""
+        relevant_faqs = rag_request["relevant_faqs"]
+        if relevant_faqs:
+            answer = relevant_faqs[0]['answer'].strip()
+            if not answer.endswith(('.', '!', '?')):
+                answer += "."
+            reply = f"Here's what I found that should help: {answer} If that doesn't cover it, reach out to support@vreg.gov.ng."
+        else:
+            reply = "I can't look that up right now. Please reach out to support@vreg.gov.ng and the team will help you out!"
+        return {
+            "response": reply,
+            "response_with_links": self.hyperlink_processor.convert_to_hyperlinks(reply),
+            "relevant_faqs": relevant_faqs,
+            "context_used": bool(relevant_faqs),
+            "cached": False,
+            "response_path": "degraded_faq"
+        }
+    
+    def overloaded_response(self, retry_after: int) -> Dict:
+        busy_message = "We're getting a lot of questions right now. Please try again in a few seconds!"
+        return {
+            "response": busy_message,
+            "response_with_links": busy_message,
+            "relevant_faqs": [],
+            "context_used": False,
+            "cached": False,
+            "response_path": "overloaded",
+            "retry_after": retry_after
+        }
+    
+    def error_response(self) -> Dict:
+        error_message = "Oops! I'm having a moment here. Can you try again, or reach out to support@vreg.gov.ng?"
+        return {
+            "response": error_message,
+            "response_with_links": self.hyperlink_processor.convert_to_hyperlinks(error_message),
+            "relevant_faqs": [],
+            "context_used": False,
+            "cached": False,
+            "response_path": "error"
+        }
+    
+    @staticmethod
+    def claude_params(rag_request: Dict) -> Dict:
+        """Arguments for messages.create / messages.stream, apart from the timeout"""
+        # ✅ UPDATED: Changed to Anthropic API format
+        return {
+            "model": CLAUDE_MODEL,  # ✅ Using Claude Sonnet 4.5
+            "max_tokens": CLAUDE_MAX_TOKENS,  # ✅ Limit for concise responses
+            "temperature": CLAUDE_TEMPERATURE,  # ✅ Natural, conversational tone
+            "system": rag_request["system"],  # ✅ System prompt separate in Anthropic
+            "messages": rag_request["messages"]
+        }
+    
+    def short_circuit_response(self, rag_request: Dict) -> Dict:
+        """While Claude is failing, an immediate FAQ answer; None when the breaker lets the call through"""
+        return None if llm_breaker.allow_request() else self.degraded_response(rag_request)
+    
+    def llm_success_response(self, rag_request: Dict, raw_response: str, usage, latency_seconds: float) -> Dict:
+        """Record a completed Claude call with the circuit breaker and finish its answer"""
+        llm_breaker.record_success(latency_seconds)
+        return self.finish_rag_response(rag_request, raw_response, usage)
+    
+    def llm_failure_response(self, rag_request: Dict, error: Exception, streamed: bool = False) -> Dict:
+        """Record a failed Claude call and pick the answer to send instead
+
+        Re-raises error when part of a streamed answer has already reached the client.
+        Errors caused by our own request (400/401/404...) leave the breaker alone.
+        """
+        if not llm_breaker.counts_as_failure(error):
+            llm_breaker.record_rejected()
+            if streamed:
+                raise error
+            print(f"❌ Claude rejected the request: {error}")
+            return self.error_response()
+        llm_breaker.record_failure()
+        if streamed:
+            raise error
+        print(f"❌ Claude call failed, answering from FAQs: {error}")
+        return self.degraded_response(rag_request)
+    
+    def generate_rag_response(self, user_query: str, user_name: str = None, conversation_history: List[Dict] = None,
+                              conversation_summary: str = None) -> Dict:
+        """Generate response using RAG with conversation context"""
+        try:
+            rag_request = self.prepare_rag_request(user_query, user_name, conversation_history, conversation_summary)
+            if "result" in rag_request:
+                return rag_request["result"]
             
-            messages.append({"role": "user", "content": current_prompt})
+            # While Claude is failing, answer from the FAQs in milliseconds instead of waiting
+            short_circuit = self.short_circuit_response(rag_request)
+            if short_circuit is not None:
+                return short_circuit
             
             # Step 6: Generate response using Claude
-            # ✅ UPDATED: Changed to Anthropic API format
-            response = client.messages.create(
-                model="claude-sonnet-4-5-20250929",  # ✅ Using Claude Sonnet 4.5
-                max_tokens=300,  # ✅ Limit for concise responses
-                temperature=0.7,  # ✅ Natural, conversational tone
-                system=system_prompt,  # ✅ System prompt separate in Anthropic
-                messages=messages
-            )
+            with llm_dispatcher.slot():
+                started = time.monotonic()
+                try:
+                    response = llm_resilience.call(
+                        lambda timeout: client.messages.create(**self.claude_params(rag_request), timeout=timeout)
+                    )
+                except Exception as e:
+                    return self.llm_failure_response(rag_request, e)
             
             raw_response = response.content[0].text  # ✅ Extract text from Claude response
+            return self.llm_success_response(
+                rag_request, raw_response, getattr(response, "usage", None), time.monotonic() - started
+            )
+        
+        except LLMOverloadedError as e:
+            print(f"⏳ {e}")
+            return self.overloaded_response(e.retry_after)
+        except Exception as e:
+            print(f"❌ Error generating RAG response: {e}")
+            return self.error_response()
+    
+    def stream_rag_response(self, user_query: str, user_name: str = None, conversation_history: List[Dict] = None,
+                            conversation_summary: str = None):
+        """Stream a RAG response, yielding ("delta", text) events then a final ("done", response_data)"""
+        try:
+            rag_request = self.prepare_rag_request(user_query, user_name, conversation_history, conversation_summary)
+            if "result" in rag_request:
+                yield "done", rag_request["result"]
+                return
             
-            # Step 7: Process response to add hyperlinks
-            processed_response = self.hyperlink_processor.convert_to_hyperlinks(raw_response)
+            short_circuit = self.short_circuit_response(rag_request)
+            if short_circuit is not None:
+                yield "done", short_circuit
+                return
             
-            # Step 8: Return both versions
-            return {
-                "response": raw_response,
-                "response_with_links": processed_response,
-                "relevant_faqs": relevant_faqs,
-                "context_used": bool(context)
-            }
+            chunks = []
+            deadline = llm_resilience.start()
+            with llm_dispatcher.slot():
+                for attempt in itertools.count():
+                    started = time.monotonic()
+                    first_token_seconds = None
+                    try:
+                        with client.messages.stream(
+                            **self.claude_params(rag_request), timeout=llm_resilience.remaining(deadline)
+                        ) as stream:
+                            for text in stream.text_stream:
+                                if first_token_seconds is None:
+                                    first_token_seconds = time.monotonic() - started
+                                chunks.append(text)
+                                yield "delta", text
+                            usage = stream.get_final_message().usage
+                        break
+                    except Exception as e:
+                        delay = llm_resilience.retry_delay(attempt, e, deadline, streamed=bool(chunks))
+                        if delay is None:
+                            yield "done", self.llm_failure_response(rag_request, e, streamed=bool(chunks))
+                            return
+                        time.sleep(delay)
             
+            llm_resilience.record_latency(time.monotonic() - started)
+            # Streams are judged on time to first token, which is what the user waits for
+            yield "done", self.llm_success_response(rag_request, "".join(chunks), usage, first_token_seconds or 0.0)
+        
+        except LLMOverloadedError as e:
+            print(f"⏳ {e}")
+            yield "done", self.overloaded_response(e.retry_after)
         except Exception as e:
-            print(f"❌ Error generating RAG response: {e}")
-            error_message = "Oops! I'm having a moment here. Can you try again, or reach out to support@vreg.gov.ng?"
-            return {
-                "response": error_message,
-                "response_with_links": self.hyperlink_processor.convert_to_hyperlinks(error_message),
-                "relevant_faqs": [],
-                "context_used": False
-            }
+            print(f"❌ Error streaming RAG response: {e}")
+            yield "done", self.error_response()
 
 # Initialize RAG system
-rag_system = VREGRAGSystem()
-
-# Initialize conversation manager
-conversation_manager = ConversationManager()
+rag_system = VREGRAGSystem(embedding_engine)
 
 def extract_name_from_message(message: str) -> str:
     """Extract name from user message"""
@@ -545,101 +3147,205 @@ def extract_name_from_message(message: str) -> str:
     
     return None
 
-@app.route("/chat", methods=["POST"])
-def chat():
-    user_input = request.json.get("message")
-    conversation_id = request.json.get("conversation_id")
+def handle_name_capture(conversation_id: str, user_input: str):
+    """Handle the turns before we know the user's name
+
+    Returns (reply_payload, user_name); reply_payload is None once the
+    message should go through the RAG pipeline.
+    """
+    # Get or create conversation
+    conversation = conversation_manager.get_or_create_conversation(conversation_id)
+    user_name = conversation.user_name
+    if user_name:
+        return None, user_name
+    
+    # If no name in conversation, first check if this is a name response
+    extracted_name = extract_name_from_message(user_input)
+    if extracted_name:
+        conversation_manager.set_user_name(conversation_id, extracted_name)
+        user_name = extracted_name
+        # Acknowledge the name and ask how to help
+        response = f"Hello {user_name}! Nice to meet you 😊 How can I help you with VREG today?"
+        processed_response = rag_system.hyperlink_processor.convert_to_hyperlinks(response)
+        
+        # 🆕 Store the bot's greeting in history
+        conversation_manager.add_message(conversation_id, "assistant", response)
+        
+        return {
+            "reply": processed_response,
+            "raw_reply": response,
+            "relevant_faqs": [],
+            "context_used": False,
+            "name_captured": True,
+            "conversation_id": conversation_id
+        }, user_name
+    
+    # Ask for name if not provided and not in conversation
+    # Don't treat greetings as requests for help
+    greeting_words = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening']
+    if any(greeting in user_input.lower() for greeting in greeting_words):
+        response = "Hello! May I know your name?"
+    else:
+        response = "May I know your name?"
+    conversation_manager.add_message(conversation_id, "assistant", response)
+    return {
+        "reply": response,
+        "raw_reply": response,
+        "relevant_faqs": [],
+        "context_used": False,
+        "asking_for_name": True,
+        "conversation_id": conversation_id
+    }, None
+
+def start_chat_turn(conversation_id: str, user_input: str):
+    """Capture the user's name or gather the history the RAG pipeline answers from
+
+    Returns (early_reply, user_name, conversation_history, conversation_summary);
+    early_reply is set when the turn is answered without the RAG pipeline.
+    """
+    early_reply, user_name = handle_name_capture(conversation_id, user_input)
+    if early_reply:
+        return early_reply, user_name, None, None
+    
+    # 🆕 Get conversation history, ending with the new message. The message is
+    # stored by finish_chat_turn, so a turn shed with a 503 leaves no trace.
+    conversation_history = conversation_manager.get_conversation_history(conversation_id, CONVERSATION_HISTORY_SIZE - 1)
+    conversation_history.append({"role": "user", "content": user_input, "html": None, "timestamp": time.time()})
+    return None, user_name, conversation_history, conversation_manager.get_summary(conversation_id)
+
+def finish_chat_turn(conversation_id: str, conversation_history: List[Dict], response_data: Dict):
+    """Store the user's message and the assistant's answer, and summarize any history the prompt left out"""
+    # 🆕 Store user message and bot response in history
+    conversation_manager.add_message(conversation_id, "user", conversation_history[-1]["content"])
+    conversation_manager.add_message(conversation_id, "assistant", response_data["response"])
+    conversation_manager.fold_unsent_history(conversation_id, conversation_history, response_data.get("token_usage"))
+
+def build_chat_reply(response_data: Dict, user_name: str, conversation_id: str) -> Dict:
+    """Shape a RAG response into the /chat reply payload"""
+    return {
+        "reply": response_data["response_with_links"],  # Send processed response with links
+        "raw_reply": response_data["response"],  # Also include raw response
+        "relevant_faqs": response_data["relevant_faqs"],
+        "context_used": response_data["context_used"],
+        "cached": response_data["cached"],
+        "response_path": response_data["response_path"],
+        "token_usage": response_data.get("token_usage"),
+        "user_name": user_name,
+        "conversation_id": conversation_id
+    }
+
+def overloaded_reply(retry_after: int):
+    """503 telling the client when to retry"""
+    response = jsonify({"error": "Service busy, please retry shortly", "retry_after": retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+def parse_chat_request(body):
+    """(message, conversation_id, error) from a chat request body; error is (payload, status) or None"""
+    if not isinstance(body, dict):
+        return None, None, ({"error": "Request body must be a JSON object"}, 400)
+    user_input = body.get("message")
+    conversation_id = body.get("conversation_id")
     
     # 🔧 FIX #2: Generate unique conversation_id if not provided
     if not conversation_id or conversation_id == "default":
         conversation_id = str(uuid.uuid4())
         print(f"🆕 Generated new conversation_id: {conversation_id}")
     
-    if not user_input:
-        return jsonify({"error": "No message received"}), 400
+    if not user_input or not isinstance(user_input, str):
+        return None, conversation_id, ({"error": "No message received"}, 400)
+    if len(user_input) > CHAT_MAX_MESSAGE_CHARS:
+        return None, conversation_id, ({"error": f"Message too long (max {CHAT_MAX_MESSAGE_CHARS} characters)"}, 413)
+    return user_input, conversation_id, None
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    user_input, conversation_id, error = parse_chat_request(request.get_json(silent=True))
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    # Shed load before touching the conversation when the LLM queue is already full
+    if llm_dispatcher.is_full():
+        return overloaded_reply(llm_dispatcher.retry_after())
     
     try:
-        # Get or create conversation
-        conversation = conversation_manager.get_or_create_conversation(conversation_id)
-        user_name = conversation.get('user_name')
-        
-        # If no name in conversation, first check if this is a name response
-        if not user_name:
-            extracted_name = extract_name_from_message(user_input)
-            if extracted_name:
-                conversation_manager.set_user_name(conversation_id, extracted_name)
-                user_name = extracted_name
-                # Acknowledge the name and ask how to help
-                response = f"Hello {user_name}! Nice to meet you 😊 How can I help you with VREG today?"
-                processed_response = rag_system.hyperlink_processor.convert_to_hyperlinks(response)
-                
-                # 🆕 Store the bot's greeting in history
-                conversation_manager.add_message(conversation_id, "assistant", response)
-                
-                return jsonify({
-                    "reply": processed_response,
-                    "raw_reply": response,
-                    "relevant_faqs": [],
-                    "context_used": False,
-                    "name_captured": True,
-                    "conversation_id": conversation_id
-                })
-            else:
-                # Ask for name if not provided and not in conversation
-                # Don't treat greetings as requests for help
-                greeting_words = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening']
-                if any(greeting in user_input.lower() for greeting in greeting_words):
-                    response = "Hello! May I know your name?"
-                    conversation_manager.add_message(conversation_id, "assistant", response)
-                    return jsonify({
-                        "reply": response,
-                        "raw_reply": response,
-                        "relevant_faqs": [],
-                        "context_used": False,
-                        "asking_for_name": True,
-                        "conversation_id": conversation_id
-                    })
-                else:
-                    response = "May I know your name?"
-                    conversation_manager.add_message(conversation_id, "assistant", response)
-                    return jsonify({
-                        "reply": response,
-                        "raw_reply": response,
-                        "relevant_faqs": [],
-                        "context_used": False,
-                        "asking_for_name": True,
-                        "conversation_id": conversation_id
-                    })
-        
-        # 🆕 Store user message in history
-        conversation_manager.add_message(conversation_id, "user", user_input)
-        
-        # 🆕 Get conversation history
-        conversation_history = conversation_manager.get_conversation_history(conversation_id)
+        early_reply, user_name, conversation_history, conversation_summary = start_chat_turn(conversation_id, user_input)
+        if early_reply:
+            return jsonify(early_reply)
         
         # Generate response using RAG with user name and conversation history
         response_data = rag_system.generate_rag_response(
             user_input, 
             user_name,
-            conversation_history  # 🆕 Pass conversation history
+            conversation_history,  # 🆕 Pass conversation history
+            conversation_summary
         )
+        if response_data["response_path"] == "overloaded":
+            return overloaded_reply(response_data["retry_after"])
         
-        # 🆕 Store bot response in history
-        conversation_manager.add_message(conversation_id, "assistant", response_data["response"])
+        finish_chat_turn(conversation_id, conversation_history, response_data)
         
-        return jsonify({
-            "reply": response_data["response_with_links"],  # Send processed response with links
-            "raw_reply": response_data["response"],  # Also include raw response
-            "relevant_faqs": response_data["relevant_faqs"],
-            "context_used": response_data["context_used"],
-            "user_name": user_name,
-            "conversation_id": conversation_id
-        })
+        return jsonify(build_chat_reply(response_data, user_name, conversation_id))
     
     except Exception as e:
         print(f"❌ Error in chat endpoint: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+def sse_event(event: str, data: Dict) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Streaming variant of /chat that forwards Claude's token deltas as Server-Sent Events"""
+    user_input, conversation_id, error = parse_chat_request(request.get_json(silent=True))
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    if llm_dispatcher.is_full():
+        return overloaded_reply(llm_dispatcher.retry_after())
+    
+    def generate():
+        try:
+            early_reply, user_name, conversation_history, conversation_summary = start_chat_turn(conversation_id, user_input)
+            if early_reply:
+                yield sse_event("done", early_reply)
+                return
+            
+            linkifier = IncrementalHyperlinker()
+            for event, data in rag_system.stream_rag_response(user_input, user_name, conversation_history, conversation_summary):
+                if event == "delta":
+                    yield sse_event("delta", {"text": data, "html": linkifier.feed(data)})
+                else:
+                    if data["response_path"] == "overloaded":
+                        # Headers are already sent, so the back-off hint travels in the event
+                        yield sse_event("error", {"error": "Service busy, please retry shortly", "retry_after": data["retry_after"]})
+                        return
+                    tail = linkifier.flush()
+                    if tail:
+                        yield sse_event("delta", {"text": "", "html": tail})
+                    # Persist the complete answer once the stream has finished
+                    finish_chat_turn(conversation_id, conversation_history, data)
+                    yield sse_event("done", build_chat_reply(data, user_name, conversation_id))
+        
+        except Exception as e:
+            print(f"❌ Error in chat stream endpoint: {e}")
+            yield sse_event("error", {"error": "Internal server error"})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Stop proxies from buffering the stream
+        }
+    )
+
+def conversation_etag(conversation_id: str, revision: str) -> str:
+    """ETag for a conversation at a given revision"""
+    return hashlib.sha1(f"{conversation_id}:{revision}".encode("utf-8")).hexdigest()
+
 # 🆕 NEW ENDPOINT: Get conversation history for persistence
 @app.route("/get-conversation", methods=["POST"])
 def get_conversation():
@@ -650,13 +3356,24 @@ def get_conversation():
         return jsonify({"error": "No conversation_id provided"}), 400
     
     try:
+        # Answer conditional requests before building the body
+        revision = conversation_manager.get_conversation_revision(conversation_id)
+        if revision is not None:
+            etag = conversation_etag(conversation_id, revision)
+            if request.if_none_match.contains(etag):
+                not_modified = Response(status=304)
+                not_modified.set_etag(etag)
+                return not_modified
+        
         conversation_data = conversation_manager.get_full_conversation(conversation_id)
         
         if conversation_data:
-            # Process messages to add hyperlinks
+            # Hyperlinked HTML is rendered once when the message is stored
             processed_messages = []
             for msg in conversation_data.get('messages', []):
-                processed_content = rag_system.hyperlink_processor.convert_to_hyperlinks(msg['content'])
+                processed_content = msg.get('html')
+                if processed_content is None:
+                    processed_content = rag_system.hyperlink_processor.convert_to_hyperlinks(msg['content'])
                 processed_messages.append({
                     'role': msg['role'],
                     'content': processed_content,
@@ -664,7 +3381,7 @@ def get_conversation():
                     'timestamp': msg.get('timestamp')
                 })
             
-            return jsonify({
+            response = jsonify({
                 "success": True,
                 "conversation_id": conversation_id,
                 "user_name": conversation_data.get('user_name'),
@@ -672,6 +3389,8 @@ def get_conversation():
                 "created_at": conversation_data.get('created_at'),
                 "last_activity": conversation_data.get('last_activity')
             })
+            response.set_etag(conversation_etag(conversation_id, conversation_data['revision']))
+            return response
         else:
             return jsonify({
                 "success": False,
@@ -711,10 +3430,9 @@ def search_faqs():
         print(f"❌ Error in search endpoint: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route("/health", methods=["GET"])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
+def health_payload(dispatcher: LLMDispatcher, resilience: LLMResiliencePolicy) -> Dict:
+    """Health and cache metrics, reporting the given LLM dispatcher and resilience policy"""
+    return {
         "status": "healthy",
         "rag_system": "operational",
         "model": "claude-sonnet-4-5",
@@ -722,7 +3440,29 @@ def health_check():
         "hyperlink_processing": "enabled",
         "session_support": "enabled",
         "conversation_memory": "enabled",
-        "conversation_persistence": "enabled"  # 🆕 NEW
+        "conversation_persistence": "enabled",  # 🆕 NEW
+        "query_embedding_cache": rag_system.query_cache.stats(),
+        "response_cache": rag_system.response_cache.stats(),
+        "llm_usage": rag_system.llm_usage.stats(),
+        "llm_dispatcher": dispatcher.stats(),
+        "llm_resilience": resilience.stats(),
+        "llm_circuit_breaker": llm_breaker.stats(),
+        "conversation_locks": conversation_manager.lock_stats(),
+        "conversation_expiry": conversation_manager.expiry_stats()
+    }
+
+@app.route("/health", methods=["GET"])
+def health_check():
+    """Health check endpoint"""
+    return jsonify(health_payload(llm_dispatcher, llm_resilience))
+
+@app.route("/conversation-stats", methods=["GET"])
+def conversation_stats():
+    """Introspection endpoint for conversation store memory, expiry and locking"""
+    return jsonify({
+        "memory": conversation_manager.memory_stats(),
+        "expiry": conversation_manager.expiry_stats(),
+        "locks": conversation_manager.lock_stats()
     })
 
 @app.route("/process-text", methods=["POST"])
@@ -0,0 +1,365 @@
+"""ASGI serving mode for the VREG chatbot
+
+Serves the same routes as vreg_app.py. /chat, /chat/stream and /health are
+async handlers that await Claude through AsyncAnthropic, so a chat waiting
+on the model holds no OS thread; embedding, retrieval and conversation
+storage run in a bounded thread pool. Every other route is served by the
+Flask app through a WSGI adapter.
+
+Run it with uvicorn (one event loop per worker):
+    uvicorn vreg_asgi:app --host 0.0.0.0 --port 8083
+"""
+import asyncio
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Dict, List
+
+from a2wsgi import WSGIMiddleware
+from anthropic import AsyncAnthropic
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from vreg_app import (
+    IncrementalHyperlinker,
+    LLMDispatcher,
+    LLMOverloadedError,
+    LLMResiliencePolicy,
+    LLM_QUEUE_TIMEOUT_SECONDS,
+    anthropic_api_key,
+    app as flask_app,
+    build_chat_reply,
+    conversation_manager,
+    finish_chat_turn,
+    health_payload,
+    parse_chat_request,
+    rag_system,
+    sse_event,
+    start_chat_turn,
+)
+
+# Threads for embedding, retrieval and conversation storage; waiting on Claude uses none
+ASGI_WORKER_THREADS = int(os.getenv("ASGI_WORKER_THREADS", "8"))
+# Waiting calls are cheap here, so the limits are much higher than in the threaded server
+ASGI_LLM_MAX_IN_FLIGHT = int(os.getenv("ASGI_LLM_MAX_IN_FLIGHT", "256"))
+ASGI_LLM_MAX_QUEUED = int(os.getenv("ASGI_LLM_MAX_QUEUED", "1024"))
+
+async_client = AsyncAnthropic(api_key=anthropic_api_key, max_retries=0)  # Retries come from resilient_call
+executor = ThreadPoolExecutor(max_workers=ASGI_WORKER_THREADS, thread_name_prefix="vreg-asgi")
+
+async def run_blocking(func, *args):
+    """Run blocking work (embedding, retrieval, storage) in the worker pool"""
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args))
+
+class AsyncLLMDispatcher(LLMDispatcher):
+    """LLMDispatcher for the event loop: queued callers suspend instead of blocking a thread"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.condition = asyncio.Condition()
+
+    async def _acquire_async(self, wait: bool) -> float:
+        started = time.time()
+        async with self.condition:
+            if self.in_flight >= self.max_in_flight or self.queued:
+                if not wait or self.queued >= self.max_queued:
+                    self.rejected += 1
+                    raise LLMOverloadedError(self.retry_after())
+                self.queued += 1
+                self.peak_queued = max(self.peak_queued, self.queued)
+                deadline = started + self.queue_timeout_seconds
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.timed_out += 1
+                            raise LLMOverloadedError(self.retry_after())
+                        try:
+                            await asyncio.wait_for(self.condition.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                finally:
+                    self.queued -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            waited = time.time() - started
+            self.total_wait_seconds += waited
+            self.recent_waits.append(waited)
+        return time.time()
+
+    async def _release_async(self, acquired_at: float):
+        async with self.condition:
+            self.in_flight -= 1
+            self.avg_call_seconds = 0.9 * self.avg_call_seconds + 0.1 * (time.time() - acquired_at)
+            self.condition.notify()
+
+    @asynccontextmanager
+    async def slot(self, wait: bool = True):
+        acquired_at = await self._acquire_async(wait)
+        try:
+            yield
+        finally:
+            await self._release_async(acquired_at)
+
+    def stats(self) -> Dict:
+        # Counters only change on the event loop thread
+        return self._stats(sorted(self.recent_waits))
+
+dispatcher = AsyncLLMDispatcher(ASGI_LLM_MAX_IN_FLIGHT, ASGI_LLM_MAX_QUEUED, LLM_QUEUE_TIMEOUT_SECONDS)
+resilience = LLMResiliencePolicy(dispatcher=dispatcher)
+
+async def resilient_call(request, hedge: bool = True):
+    """Async counterpart of LLMResiliencePolicy.call; request(timeout) returns a coroutine"""
+    deadline = resilience.start()
+    for attempt in itertools.count():
+        try:
+            return await _resilient_attempt(request, deadline, hedge)
+        except Exception as e:
+            await asyncio.sleep(resilience.backoff(attempt, e, deadline))
+
+async def _hedge(request, timeout: float):
+    """Run a hedge in a dispatcher slot of its own; raises LLMOverloadedError rather than queueing"""
+    async with dispatcher.slot(wait=False):
+        return await request(timeout)
+
+async def _resilient_attempt(request, deadline: float, hedge: bool):
+    started = time.monotonic()
+    hedge_delay = resilience.hedge_delay() if hedge else None
+    primary = asyncio.ensure_future(request(resilience.remaining(deadline)))
+    tasks = {primary}
+    try:
+        if hedge_delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=min(hedge_delay, resilience.remaining(deadline)))
+            if not done and resilience.try_reserve_hedge():
+                tasks.add(asyncio.ensure_future(_hedge(request, resilience.remaining(deadline))))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=resilience.remaining(deadline), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                resilience.remaining(deadline)  # Raises LLMDeadlineExceeded
+            for task in done:
+                won, error = resilience.finished_request(task.exception(), task is primary, started, error)
+                if won:
+                    return task.result()
+        raise error
+    finally:
+        # Unlike the threaded server, losing or overdue requests can be cancelled
+        for task in tasks:
+            task.cancel()
+
+async def generate_rag_response(user_query: str, user_name: str = None, conversation_history: List[Dict] = None,
+                                conversation_summary: str = None) -> Dict:
+    """Async counterpart of VREGRAGSystem.generate_rag_response"""
+    try:
+        rag_request = await run_blocking(
+            rag_system.prepare_rag_request, user_query, user_name, conversation_history, conversation_summary
+        )
+        if "result" in rag_request:
+            return rag_request["result"]
+
+        short_circuit = rag_system.short_circuit_response(rag_request)
+        if short_circuit is not None:
+            return short_circuit
+
+        async with dispatcher.slot():
+            started = time.monotonic()
+            try:
+                response = await resilient_call(
+                    lambda timeout: async_client.messages.create(**rag_system.claude_params(rag_request), timeout=timeout)
+                )
+            except Exception as e:
+                return rag_system.llm_failure_response(rag_request, e)
+        return rag_system.llm_success_response(
+            rag_request, response.content[0].text, getattr(response, "usage", None), time.monotonic() - started
+        )
+
+    except LLMOverloadedError as e:
+        print(f"⏳ {e}")
+        return rag_system.overloaded_response(e.retry_after)
+    except Exception as e:
+        print(f"❌ Error generating RAG response: {e}")
+        return rag_system.error_response()
+
+async def stream_rag_response(user_query: str, user_name: str = None, conversation_history: List[Dict] = None,
+                              conversation_summary: str = None):
+    """Async counterpart of VREGRAGSystem.stream_rag_response"""
+    try:
+        rag_request = await run_blocking(
+            rag_system.prepare_rag_request, user_query, user_name, conversation_history, conversation_summary
+        )
+        if "result" in rag_request:
+            yield "done", rag_request["result"]
+            return
+
+        short_circuit = rag_system.short_circuit_response(rag_request)
+        if short_circuit is not None:
+            yield "done", short_circuit
+            return
+
+        chunks = []
+        deadline = resilience.start()
+        async with dispatcher.slot():
+            for attempt in itertools.count():
+                started = time.monotonic()
+                first_token_seconds = None
+                try:
+                    async with async_client.messages.stream(
+                        **rag_system.claude_params(rag_request), timeout=resilience.remaining(deadline)
+                    ) as stream:
+                        async for text in stream.text_stream:
+                            if first_token_seconds is None:
+                                first_token_seconds = time.monotonic() - started
+                            chunks.append(text)
+                            yield "delta", text
+                        usage = (await stream.get_final_message()).usage
+                    break
+                except Exception as e:
+                    delay = resilience.retry_delay(attempt, e, deadline, streamed=bool(chunks))
+                    if delay is None:
+                        yield "done", rag_system.llm_failure_response(rag_request, e, streamed=bool(chunks))
+                        return
+                    await asyncio.sleep(delay)
+
+        resilience.record_latency(time.monotonic() - started)
+        yield "done", rag_system.llm_success_response(rag_request, "".join(chunks), usage, first_token_seconds or 0.0)
+
+    except LLMOverloadedError as e:
+        print(f"⏳ {e}")
+        yield "done", rag_system.overloaded_response(e.retry_after)
+    except Exception as e:
+        print(f"❌ Error streaming RAG response: {e}")
+        yield "done", rag_system.error_response()
+
+def overloaded_reply(retry_after: int) -> JSONResponse:
+    return JSONResponse(
+        {"error": "Service busy, please retry shortly", "retry_after": retry_after},
+        status_code=503,
+        headers={"Retry-After": str(retry_after)}
+    )
+
+async def read_chat_request(request: Request):
+    """parse_chat_request for a Starlette request; malformed JSON is a 400 as in Flask"""
+    # Flask enforces MAX_CONTENT_LENGTH itself; here the body is read up to the same limit
+    max_bytes = flask_app.config["MAX_CONTENT_LENGTH"]
+    raw = bytearray()
+    async for chunk in request.stream():
+        raw += chunk
+        if len(raw) > max_bytes:
+            return None, None, ({"error": "Request too large"}, 413)
+    try:
+        body = json.loads(raw)
+    except ValueError:
+        body = None
+    return parse_chat_request(body)
+
+async def chat(request: Request):
+    user_input, conversation_id, error = await read_chat_request(request)
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+
+    if dispatcher.is_full():
+        return overloaded_reply(dispatcher.retry_after())
+
+    try:
+        early_reply, user_name, conversation_history, conversation_summary = await run_blocking(
+            start_chat_turn, conversation_id, user_input
+        )
+        if early_reply:
+            return JSONResponse(early_reply)
+
+        response_data = await generate_rag_response(user_input, user_name, conversation_history, conversation_summary)
+        if response_data["response_path"] == "overloaded":
+            return overloaded_reply(response_data["retry_after"])
+
+        await run_blocking(finish_chat_turn, conversation_id, conversation_history, response_data)
+        return JSONResponse(build_chat_reply(response_data, user_name, conversation_id))
+
+    except Exception as e:
+        print(f"❌ Error in chat endpoint: {e}")
+        return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+async def chat_stream(request: Request):
+    """Streaming variant of /chat that forwards Claude's token deltas as Server-Sent Events"""
+    user_input, conversation_id, error = await read_chat_request(request)
+    if error:
+        return JSONResponse(error[0], status_code=error[1])
+
+    if dispatcher.is_full():
+        return overloaded_reply(dispatcher.retry_after())
+
+    async def generate():
+        try:
+            early_reply, user_name, conversation_history, conversation_summary = await run_blocking(
+                start_chat_turn, conversation_id, user_input
+            )
+            if early_reply:
+                yield sse_event("done", early_reply)
+                return
+
+            linkifier = IncrementalHyperlinker()
+            async for event, data in stream_rag_response(user_input, user_name, conversation_history, conversation_summary):
+                if event == "delta":
+                    yield sse_event("delta", {"text": data, "html": linkifier.feed(data)})
+                else:
+                    if data["response_path"] == "overloaded":
+                        yield sse_event("error", {"error": "Service busy, please retry shortly", "retry_after": data["retry_after"]})
+                        return
+                    tail = linkifier.flush()
+                    if tail:
+                        yield sse_event("delta", {"text": "", "html": tail})
+                    await run_blocking(finish_chat_turn, conversation_id, conversation_history, data)
+                    yield sse_event("done", build_chat_reply(data, user_name, conversation_id))
+
+        except Exception as e:
+            print(f"❌ Error in chat stream endpoint: {e}")
+            yield sse_event("error", {"error": "Internal server error"})
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+async def health(request: Request):
+    return JSONResponse(await run_blocking(health_payload, dispatcher, resilience))
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # uvicorn replaces the SIGTERM handler vreg_app installs, so snapshot conversations here
+    await run_blocking(conversation_manager.save_snapshot)
+    executor.shutdown(wait=False)
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+        # Conversation, session, search and frontend routes don't wait on Claude
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["*"],
+            allow_methods=["*"],
+            allow_headers=["*"],
+            expose_headers=["ETag", "Retry-After"]
+        )
+    ],
+    lifespan=lifespan
+)
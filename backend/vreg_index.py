@@ -0,0 +1,279 @@
+"""VREG knowledge base and its versioned vector index
+
+Importing this module has no side effects beyond loading the embedding
+model on demand, so the image build can prebuild the index without
+starting the chatbot (no conversation store, threads or signal handlers):
+    python vreg_index.py
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import uuid
+from typing import Dict, List
+
+import chromadb
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.config import Settings as ChromaSettings
+from dotenv import load_dotenv
+from sentence_transformers import SentenceTransformer
+
+load_dotenv()
+
+# Vector index configuration
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_index"))
+VECTOR_INDEX_SCHEMA_VERSION = 1
+
+class EmbeddingEngine(EmbeddingFunction):
+    """Single shared embedding model used by ChromaDB and every query path"""
+
+    def __init__(self, model_name: str = None, model=None):
+        self.model_name = model_name or os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
+        # Any object with a SentenceTransformer-style encode() can be plugged in
+        self.model = model if model is not None else SentenceTransformer(self.model_name)
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of texts into normalized float32 vectors"""
+        vectors = self.model.encode(
+            list(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a single query"""
+        return self.embed_documents([text])[0]
+
+    def __call__(self, input: Documents) -> Embeddings:
+        """ChromaDB embedding function interface"""
+        return self.embed_documents(input).tolist()
+
+# VREG Knowledge Base
+vreg_faqs = [
+    {
+        "question": 'I am not getting my confirmation link after registration',
+        "answer": 'Check your spam folder or confirm if you used the correct email address in creating a VREG account.',
+        "category": 'registration'
+    },
+    {
+        "question": 'After inputting my TIN on the portal, it brought out an Invalid statement',
+        "answer": 'Go to www.trade.gov.ng, click on Agencies then FIRS to validate your TIN',
+        "category": 'registration'
+    },
+    {
+        "question": 'I cannot access my dashboard because I forgot the password',
+        "answer": 'Please visit www.vreg.gov.ng and click on “Login.”\nNext, select “Forgot Password” and enter the email address you used during registration.\nA password recovery link will be sent to your email — simply click on the link and follow the instructions to create a new password.',
+        "category": 'registration'
+    },
+    {
+        "question": 'I tried to register for VREG but after inputting my TIN/Agency code it says TIN/Agency code has been taken',
+        "answer": 'Your agency already has an account created with VREG, kindly confirm the email address used during the registration and reset your password to be able to login successfully.',
+        "category": 'registration'
+    },
+    {
+      "question": 'How much is registeration',
+        "answer": 'Registration fees differ per vehicle. Kindly contact our customer service desk for an accurate fee',
+        "category":'registration'  
+    },
+    {
+        "question": "The portal is not recognizing my VIN, showing 'Warning! This is a non-standard VIN'",
+        "answer": 'This VIN appears to be non-standard and requires manual validation.\nPlease enter the HS code and VIN number, then click “Submit.”\nWhen the prompt appears, select “Decode Manually,” enter the vehicle details, and click “Submit” again.\nAfter submission, kindly wait while the VIN is being validated.',
+        "category": 'vin_validation'
+    },
+    {
+        "question": "I submitted my VIN for validation and it's showing on the Pending tab",
+        "answer": 'Your VIN has been validated manually, kindly generate an invoice and proceed to make payment.',
+        "category": 'vin_validation'
+    },
+    {
+        "question": 'I submitted a wrong VIN for manual validation, how can I cancel it?',
+        "answer": 'The VIN will automatically be erased from your dashboard once the due date elapses.',
+        "category": 'vin_validation'
+    },
+    {
+        "question": 'SGD Portal is telling me VREG does not exist',
+        "answer": 'Take a screenshot of the error message and attach the affected VREG certificate and send it to support@vreg.gov.ng',
+        "category": 'transmission'
+    },
+    {
+        "question": 'My VREG certificate information was not transmitted to customs ESGD platform',
+        "answer": 'This is a transmission case where VREG certificate information failed to reach customs. Please contact support@vreg.gov.ng with your certificate details and error screenshots.',
+        "category": 'transmission'
+    },
+    {
+        "question": 'I made a payment for a VREG certificate but no certificate was generated',
+        "answer": 'Send the invoice number, payment proof and the date payment were made to payments@vreg.gov.ng',
+        "category": 'payment'
+    },
+    {
+        "question": 'How can I get access to the certificate which I generated on the VREG portal?',
+        "answer": 'Login to your dashboard, click on certificate and then enter either the invoice number or VIN for the vehicle on the search tab to be able to view the certificate.',
+        "category": 'payment'
+    },
+    {
+        "question": 'My VIN is generating multiple invoices. Can I make the payment?',
+        "answer": 'Select a single Invoice number and proceed to initiate payment for the VIN.',
+        "category": 'payment'
+    },
+    {
+        "question": 'My payment is under investigation',
+        "answer": 'Kindly note that this issue is under investigation. Once the payment has been confirmed successful, the VREG certificate will be generated. Endeavor to check your payment status occasionally.',
+        "category": 'payment'
+    },
+    {
+        "question": 'My payment transaction was unsuccessful',
+        "answer": 'Kindly note that your payment transaction was unsuccessful on this invoice. Reach out or contact your bank to log a complaint or seek a reversal.',
+        "category": 'payment'
+    },
+    {
+        "question": 'How do I request a refund?',
+        "answer": 'Kindly fill in your details to process your refund: Full Name, Email Address, Phone Number, Excess Amount Paid, Invoice Number, Proof of Payment, Account Number, Account Name, Transaction Date, Bank Name. Your refund will be processed within 3-7 working days.',
+        "category": 'payment'
+    },
+    {
+        "question": 'The Agency we used for capturing has been blocked. I want to change to another',
+        "answer": 'The consignee should write a letter of cancellation of VREG certificate addressing it to the managing director of VREG, and attach the bill of lading, VREG certificate and a CAC certificate (if consignee is a company) or a Valid means of identification (if consignee is an individual) and send it to support@vreg.gov.ng',
+        "category": 'agency'
+    },
+    {
+        "question": 'A wrong consignee TIN was used in generating a VREG certificate',
+        "answer": 'The agency should write a letter of cancellation of the VREG certificate addressing it to the managing director of VREG, and attach the bill of lading and VREG certificate.',
+        "category": 'agency'
+    },
+    {
+        "question": "I cannot access the Vehicle on Custom portal because it says the company's code on VREG is different from that on ESGD",
+        "answer": "Kindly enter the correct consignee's TIN that was used in generating the VREG certificate to be able to access the Vehicle on customs portal.",
+        "category": 'agency'
+    },
+    {
+        "question": "After entering my correct login details an error message pop up saying 'this field is required'",
+        "answer": 'Ensure you have a good network connection and then try to login again.',
+        "category": 'technical'
+    },
+    {
+        "question": 'What is VREG?',
+        "answer": 'The National Vehicle Registry (VREG) is the centralized database for all vehicles in Nigeria through unique Vehicle Identification Numbers (VIN). It stores detailed vehicular information such as specifications, ownership, and history of each vehicle in Nigeria.',
+        "category": 'general'
+    },
+    {
+        "question": 'What is the purpose of VREG?',
+        "answer": 'VREG was created by the Federal Ministry of Finance as a solution to customs duty evasion, vehicle theft, vehicle-related crimes, and ineffective vehicle insurance coverage. All vehicle owners are required to register their vehicles using the VIN on the VREG portal.',
+        "category": 'general'
+    },
+    {
+        "question": 'What documents do I need for VREG registration?',
+        "answer": "You'll need: Valid ID/Passport, Vehicle purchase receipt, Customs clearance certificate, Insurance certificate, Vehicle inspection report, and your Tax Identification Number (TIN).",
+        "category": 'general'
+    },
+    {
+        "question": 'How can I contact VREG support?',
+        "answer": 'You can contact VREG support via: Email: support@vreg.gov.ng, Payment issues: payments@vreg.gov.ng, Phone: Contact helpdesk, Visit: Physical walk-in support, Website: www.vreg.gov.ng',
+        "category": 'general'
+    }
+]
+
+def knowledge_base_hash(faqs: List[Dict], model_name: str) -> str:
+    """Content hash of the knowledge base and embedding model, used to version the index"""
+    payload = json.dumps(
+        {"schema": VECTOR_INDEX_SCHEMA_VERSION, "model": model_name, "faqs": faqs},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+FAQ_COLLECTION_NAME = "vreg_faqs"
+
+def vector_index_path(model_name: str, index_dir: str = VECTOR_INDEX_DIR) -> str:
+    """Directory of the index for the current knowledge base; each version lives in its own"""
+    kb_hash = knowledge_base_hash(vreg_faqs, model_name)
+    return os.path.join(index_dir, f"v{VECTOR_INDEX_SCHEMA_VERSION}-{kb_hash[:16]}")
+
+def open_vector_index(embedding_engine: EmbeddingEngine, path: str):
+    """Open the FAQ collection stored at path"""
+    chroma_client = chromadb.PersistentClient(
+        path=path,
+        settings=ChromaSettings(anonymized_telemetry=False)
+    )
+    return chroma_client.get_collection(
+        name=FAQ_COLLECTION_NAME,
+        embedding_function=embedding_engine
+    )
+
+def build_vector_index(embedding_engine: EmbeddingEngine, path: str):
+    """Embed every FAQ and write the collection to path"""
+    build_client = chromadb.PersistentClient(
+        path=path,
+        settings=ChromaSettings(anonymized_telemetry=False)
+    )
+    collection = build_client.create_collection(
+        name=FAQ_COLLECTION_NAME,
+        metadata={"hnsw:space": "cosine", "kb_hash": knowledge_base_hash(vreg_faqs, embedding_engine.model_name)},
+        embedding_function=embedding_engine
+    )
+    
+    # Prepare documents for embedding
+    documents = []
+    metadatas = []
+    ids = []
+    
+    for i, faq in enumerate(vreg_faqs):
+        # Combine question and answer for better context
+        doc_text = f"Question: {faq['question']}\nAnswer: {faq['answer']}"
+        documents.append(doc_text)
+        metadatas.append({
+            "category": faq['category'],
+            "question": faq['question'],
+            "answer": faq['answer']
+        })
+        # Stable ids so the index is reproducible across builds
+        ids.append(f"faq-{i}")
+    
+    collection.add(
+        documents=documents,
+        metadatas=metadatas,
+        ids=ids
+    )
+    print(f"🔨 Built vector index with {len(vreg_faqs)} FAQs at {path}")
+
+def ensure_vector_index(embedding_engine: EmbeddingEngine, index_dir: str = VECTOR_INDEX_DIR) -> str:
+    """Path of the index for the current knowledge base, building it first if it is missing"""
+    path = vector_index_path(embedding_engine.model_name, index_dir)
+    if os.path.isdir(path):
+        return path
+    
+    # Build into a scratch directory and rename it into place, so
+    # concurrent workers never see a half-written index
+    os.makedirs(index_dir, exist_ok=True)
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    build_vector_index(embedding_engine, tmp_path)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Another worker won the race - use its index
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
+
+def prune_stale_indexes(current_path: str):
+    """Remove index directories built for other knowledge base versions
+
+    Only the build step calls this: on a shared volume during a rolling deploy,
+    workers of the previous version still have their index open.
+    """
+    index_dir, current = os.path.split(current_path)
+    for entry in os.listdir(index_dir):
+        if entry != current and entry.startswith("v") and ".tmp-" not in entry:
+            shutil.rmtree(os.path.join(index_dir, entry), ignore_errors=True)
+
+def main() -> int:
+    """Build the index for the current knowledge base and drop older versions"""
+    path = ensure_vector_index(EmbeddingEngine())
+    prune_stale_indexes(path)
+    print(f"📦 Vector index ready at {path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())